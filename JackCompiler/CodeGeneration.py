@@ -1,32 +1,342 @@
 """
 A designated module for translating parsed jack code into vm-language code.
+
+The CodeGenerator walks the abstract syntax tree that the Parser builds (see AST) and
+writes the same VM code the CompilationEngine writes while it parses.
 """
 
+from functools import partial
+
+from JackCompiler.SymbolTable import *
+from JackCompiler.SyntaxAnalyzer.AST import *
+from JackCompiler.ConstantFolding import ConstantFolder, MULTIPLY_LIMIT
+from JackCompiler.Optimizer import write_if_false, write_if_true, write_array_index, \
+    write_array_read, write_array_store
+from JackCompiler.SyntaxAnalyzer.CompilationEngine import OP_COMMANDS, OP_CALLS, \
+    UNARY_COMMANDS, BuiltinFunctions, ARGS, LOCAL, THIS, THAT, CONSTANT, POINTER, TEMP, \
+    IF, WHILE, STRING, POOLED_STRING_NAME, POOLED_STRING_TYPE, write_string, \
+    write_pooled_string
+
 
 class CodeGenerator():
     """
 
     """
 
+    def __init__(self, writer, identifiers, optimize=False,
+                 multiply_limit=MULTIPLY_LIMIT, pool_strings=False):
+        """
+        :param writer: VMWriter the code is written into
+        :param identifiers: IdentifierTable the names of the tree were interned in
+        :param optimize: fold constant expressions and locals assigned a constant once,
+        branch on negated conditions and rotate loops, and write cheaper array accesses,
+        as the CompilationEngine does
+        :param multiply_limit: with optimize, the most commands a multiplication by a
+        constant is written in instead of a call of Math.multiply
+        :param pool_strings: build every distinct string constant of a class once, into
+        a static, as the CompilationEngine does
+        """
+        self.writer = writer
+        self.intern = identifiers.intern
+        self.symbol_table = SymbolTable()
+        self.label_counter = [0, 0, 0]
+        self.pool_strings = pool_strings
+        self.binary_operators = {op: partial(writer.write_arithmetic, command)
+                                 for op, command in OP_COMMANDS.items()}
+        self.binary_operators.update({op: partial(writer.write_call, func, 2)
+                                      for op, func in OP_CALLS.items()})
+        self.folder = ConstantFolder(writer, multiply_limit) if optimize else None
+        if self.folder is not None:
+            self.binary_operators = {
+                op: partial(self.folder.write_binary, op, write)
+                for op, write in self.binary_operators.items()}
+        self.constants = {}
+        self.single_assignments = frozenset()
+        self.nesting = 0
+        self.statement_writers = {Let: self.write_let, If: self.write_if,
+                                  While: self.write_while, Do: self.write_do,
+                                  Return: self.write_return}
+        self.term_writers = {IntConst: self.write_int, StringConst: self.write_string,
+                             KeywordConst: self.write_keyword, Var: self.write_var,
+                             ArrayRef: self.write_array_ref, Call: self.write_term_call,
+                             Unary: self.write_unary, Expression: self.write_expression}
+
+    def write_classes(self, classes):
+        """
+        Writes the code of all the classes of a file
+        """
+        for class_node in classes:
+            self.write_class(class_node)
+
+    def write_class(self, class_node):
+        self.symbol_table = SymbolTable()
+        self.class_name = class_node.name
+        for member in class_node.members:
+            if type(member) is ClassVarDec:
+                for name in member.names:
+                    self.symbol_table.define(self.intern(name), member.type, member.kind)
+            else:
+                self.write_subroutine(member)
+
+    def write_subroutine(self, subroutine):
+        """
+        Defines the arguments and locals of a subroutine and writes its code
+        """
+        self.symbol_table.start_subroutine()
+        self.return_type = subroutine.return_type
+        if subroutine.kind == "method":
+            self.symbol_table.define(self.intern("this"), self.class_name, ARGS)
+            self.writer.write_push(ARGS, 0)
+            self.writer.write_pop(POINTER, 0)
+        for var_type, name in subroutine.params:
+            self.symbol_table.define(self.intern(name), var_type, ARGS)
+        for var_type, name in subroutine.local_vars:
+            self.symbol_table.define(self.intern(name), var_type, LOCAL)
+        self.constants = {}
+        if self.folder is not None:
+            counts = {}
+            for let in lets(subroutine.statements):
+                counts[let.name] = counts.get(let.name, 0) + 1
+            self.single_assignments = frozenset(name for name, count in counts.items()
+                                                if count == 1)
+
+        self.writer.write_function(self.class_name + "." + subroutine.name,
+                                   self.symbol_table.var_count(LOCAL))
+        if subroutine.kind == "constructor":
+            self.writer.write_push(CONSTANT, self.symbol_table.var_count("field"))
+            self.writer.write_call(BuiltinFunctions.mem_alloc.value, num_args=1)
+            self.writer.write_pop(POINTER, 0)
+        self.write_statements(subroutine.statements)
+
+    def lookup(self, name):
+        """
+        Returns the (kind, index) of a variable, or (None, None) if it is not one
+        """
+        entry = self.symbol_table.lookup(self.intern(name))
+        return (entry[KIND], entry[NUM]) if entry else (None, None)
+
+# Statements -----------------------------------------------------------------------------
+
+    def write_statements(self, statements):
+        writers = self.statement_writers
+        self.nesting += 1
+        for statement in statements:
+            writers[type(statement)](statement)
+        self.nesting -= 1
+
+    def write_let(self, let):
+        segment, index = self.lookup(let.name)
+        if let.index is not None:
+            if segment == "field":
+                self.writer.write_push(POINTER, 0)
+                self.writer.write_push(THIS, index)
+            elif segment:
+                self.writer.write_push(segment, index)
+            self.write_expression(let.index)
+            if self.folder is not None:
+                offset = write_array_index(self.writer)
+                value_start = len(self.writer.current())
+                self.write_expression(let.value)
+                write_array_store(self.writer, value_start, offset)
+            else:
+                self.writer.write_arithmetic('add')
+                self.write_expression(let.value)
+                self.writer.write_pop(TEMP, 0)
+                self.writer.write_pop(POINTER, 1)
+                self.writer.write_push(TEMP, 0)
+                self.writer.write_pop(THAT, 0)
+        else:
+            self.write_expression(let.value)
+            if segment == LOCAL and self.nesting == 1 and \
+                    let.name in self.single_assignments:
+                value = self.folder.top_constant()
+                if value is not None:
+                    self.constants[let.name] = value
+        segment = THIS if segment == 'field' else segment
+        self.writer.write_pop(segment, index)
+
+    def write_if(self, if_node):
+        self.label_counter[IF] += 1
+        count = str(self.label_counter[IF])
+        true_label, false_label = "IF_TRUE" + count, "IF_FALSE" + count
+        self.write_expression(if_node.condition)
+        if self.folder is None:
+            self.writer.write_if(true_label)
+            self.writer.write_goto(false_label)
+            self.writer.write_label(true_label)
+        else:
+            write_if_false(self.writer, false_label)
+        self.write_statements(if_node.statements)
+        if if_node.else_statements is None:
+            self.writer.write_label(false_label)
+        else:
+            cont_label = "IF_CONT" + count
+            self.writer.write_goto(cont_label)
+            self.writer.write_label(false_label)
+            self.write_statements(if_node.else_statements)
+            self.writer.write_label(cont_label)
+
+    def write_while(self, while_node):
+        self.label_counter[WHILE] += 1
+        count = str(self.label_counter[WHILE])
+        label_loop, label_continue = "WHILE_LOOP" + count, "WHILE_CONT" + count
+        if self.folder is not None:
+            # Tested at the bottom, as the CompilationEngine does. The condition is
+            # generated first and its code moved after the statements, so that its
+            # labels and pooled strings are numbered as the engine numbers them
+            label_test = "WHILE_TEST" + count
+            self.writer.write_goto(label_test)
+            self.writer.write_label(label_loop)
+            function = self.writer.current()
+            start = len(function)
+            self.write_expression(while_node.condition)
+            condition = function.commands(start)
+            function.delete(start)
+            self.write_statements(while_node.statements)
+            self.writer.write_label(label_test)
+            self.writer.write_code(condition)
+            write_if_true(self.writer, label_loop)
+            return
+        self.writer.write_label(label_loop)
+        self.write_expression(while_node.condition)
+        self.writer.write_arithmetic("not")
+        self.writer.write_if(label_continue)
+        self.write_statements(while_node.statements)
+        self.writer.write_goto(label_loop)
+        self.writer.write_label(label_continue)
+
+    def write_do(self, do):
+        segment, index = self.lookup(do.call.target or do.call.name)
+        self.write_call(do.call, segment is not None)
+        self.writer.write_pop(TEMP, 0)
+
+    def write_return(self, return_node):
+        if self.return_type == "void":
+            self.writer.write_push(CONSTANT, 0)
+        elif return_node.value is not None:
+            self.write_expression(return_node.value)
+        self.writer.write_return()
+
+# Expressions ----------------------------------------------------------------------------
+
     def write_expression(self, expression):
         """
-        recursive function for write an expression in vm
         The write_expression(exp) algorithm:
         if exp is a constant n then output "push n"
         if exp is a variable v then output "push v"
         if exp is op(exp1) then codeWrite(exp1); output "op";
         if exp is (exp1 op exp2) then codeWrite(exp1); codeWrite(exp2); output "op";
         if exp is f (exp1, ..., expn) then codeWrite(exp1); ... codeWrite(exp1); output "call f";
-        :param expression:
-        :return:
+        As the items of an expression are already in postfix order, they are written
+        one after the other.
+        :param expression: Expression
+        """
+        operators, term_writers = self.binary_operators, self.term_writers
+        for item in expression.items:
+            if type(item) is str:
+                operators[item]()
+            else:
+                term_writers[type(item)](item)
+
+    def write_term(self, term):
+        self.term_writers[type(term)](term)
+
+    def write_int(self, term):
+        self.writer.write_push(CONSTANT, term.value)
+
+    def write_string(self, term):
+        if not self.pool_strings:
+            write_string(self.writer, term.value)
+            return
+        name_id = self.intern(POOLED_STRING_NAME.format(term.value))
+        entry = self.symbol_table.lookup(name_id)
+        if entry is None:
+            self.symbol_table.define(name_id, POOLED_STRING_TYPE, "static")
+            entry = self.symbol_table.lookup(name_id)
+        self.label_counter[STRING] += 1
+        write_pooled_string(self.writer, term.value, entry[NUM],
+                            "STRING_BUILT" + str(self.label_counter[STRING]))
+
+    def write_keyword(self, term):
+        if term.word in ["false", "null"]:
+            self.writer.write_push(CONSTANT, 0)
+        elif term.word == "true":
+            self.writer.write_push(CONSTANT, 0)
+            self.writer.write_arithmetic("not")
+        else:
+            self.writer.write_push(POINTER, 0)
+
+    def push_var(self, name):
         """
-        pass
+        Pushes a variable if it is one, and returns its index
+        """
+        kind, index = self.lookup(name)
+        if kind == "field":
+            self.writer.write_push(THIS, index)
+        elif kind == LOCAL and name in self.constants:
+            self.folder.write_constant(self.constants[name])
+        elif kind:
+            self.writer.write_push(kind, index)
+        return index
+
+    def write_var(self, term):
+        self.push_var(term.name)
+
+    def write_array_ref(self, term):
+        self.push_var(term.name)
+        self.write_expression(term.index)
+        if self.folder is not None:
+            write_array_read(self.writer)
+            return
+        self.writer.write_arithmetic('add')
+        self.writer.write_pop(POINTER, 1)
+        self.writer.write_push(THAT, 0)
 
+    def write_unary(self, term):
+        self.write_term(term.term)
+        if self.folder is None:
+            self.writer.write_arithmetic(UNARY_COMMANDS[term.op])
+        else:
+            self.folder.write_unary(term.op, UNARY_COMMANDS[term.op])
+
+    def write_term_call(self, call):
+        """
+        A call inside an expression. Its first identifier is pushed like a variable
+        first, as the CompilationEngine does
+        """
+        index = self.push_var(call.target or call.name)
+        self.write_call(call, True if index else False)
 
-    def write_flow(self):
+    def write_call(self, call, is_method):
         """
-        write
-        :return:
+        Writes a subroutine call
+        :param is_method: whether the call target is an object the method is called on
         """
-        # This will probably be broken up into smaller bits
-        pass
\ No newline at end of file
+        if call.target is None:
+            func, num_exp = call.name, 0
+        elif is_method:
+            obj_type, segment, index = self.symbol_table.lookup(self.intern(call.target))
+            if segment == "field":
+                self.writer.write_push(POINTER, 0)
+                segment = THIS
+            self.writer.write_push(segment, index)
+            func, num_exp = obj_type + "." + call.name, 1
+        else:
+            func, num_exp = call.target + "." + call.name, 0
+        for arg in call.args:
+            self.write_expression(arg)
+        self.writer.write_call(func, num_exp + len(call.args))
+
+
+def lets(statements):
+    """
+    Yields the let statements among the given ones and inside them
+    """
+    for statement in statements:
+        if type(statement) is Let:
+            yield statement
+        elif type(statement) is If:
+            yield from lets(statement.statements)
+            yield from lets(statement.else_statements or [])
+        elif type(statement) is While:
+            yield from lets(statement.statements)
@@ -0,0 +1,317 @@
+"""
+Compile-time evaluation of Jack expressions.
+
+The ConstantFolder sits between a code generator and its VMWriter. When an operator is
+written and the code of its operands, just recorded by the writer, only pushes
+constants, the operation is done right away and its result is pushed instead. Values
+are Jack's 16-bit two's complement words, and only what Jack itself would compute first
+is folded: an expression is still computed from left to right, and folding never
+reorders it.
+
+A multiplication or division with one constant operand is reduced to cheaper commands
+where it can be, as every call of Math.multiply and Math.divide takes hundreds of
+cycles on the Hack platform.
+"""
+
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import INT_CONST_MAX
+from JackCompiler.VMWriter import PUSH, POP, CALL, NEG, NOT, SEGMENT_NAMES, \
+    SEGMENT_CODES, operand_start
+
+CONSTANT = SEGMENT_CODES["constant"]
+TEMP = SEGMENT_CODES["temp"]
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+# The one word whose negation is itself, and that has no positive constant to negate
+MIN_WORD = -0x8000
+TRUE = -1
+FALSE = 0
+
+
+def to_word(value):
+    """
+    Wraps an int into a 16-bit two's complement word
+    :return: int in [-32768, 32767]
+    """
+    value &= WORD_MASK
+    return value - (WORD_MASK + 1) if value & SIGN_BIT else value
+
+
+def divide(x, y):
+    """
+    Math.divide of the Jack OS: divides the absolute values and rounds towards 0.
+    :return: the quotient, or None when the OS is left to handle it: division by 0
+    is an error, and the absolute value of MIN_WORD is not a word
+    """
+    if y == 0 or MIN_WORD in (x, y):
+        return None
+    quotient = abs(x) // abs(y)
+    return quotient if (x < 0) == (y < 0) else -quotient
+
+
+# What every binary operator computes from its two operand words
+BINARY_FOLDS = {'+': lambda x, y: x + y,
+                '-': lambda x, y: x - y,
+                '*': lambda x, y: x * y,
+                '/': divide,
+                '&': lambda x, y: x & y,
+                '|': lambda x, y: x | y,
+                '=': lambda x, y: TRUE if x == y else FALSE,
+                '<': lambda x, y: TRUE if x < y else FALSE,
+                '>': lambda x, y: TRUE if x > y else FALSE}
+UNARY_FOLDS = {'-': lambda x: -x, '~': lambda x: ~x}
+UNARY_OPCODES = {NEG: UNARY_FOLDS['-'], NOT: UNARY_FOLDS['~']}
+
+# The constants an operator leaves the other operand as it is with, on its right and
+# on its left
+RIGHT_IDENTITIES = {'+': 0, '-': 0, '*': 1, '/': 1, '|': 0, '&': TRUE}
+LEFT_IDENTITIES = {'+': 0, '*': 1, '|': 0, '&': TRUE}
+
+# The most commands a multiplication by a constant is written in instead of a call of
+# Math.multiply, unless the folder is given another limit. A multiplication by 0 or -1
+# is always reduced, as it never takes more commands than the call
+MULTIPLY_LIMIT = 16
+
+# Reduced code is written as these commands: (VM command, segment, index) or (command,)
+NEGATE = ("neg",)
+ADD = ("add",)
+SAVED_OPERAND = ("push", "temp", 0)
+SAVE_OPERAND = ("pop", "temp", 0)
+# Doubles the value on top of the stack, through temp 1 as temp 0 may hold the operand
+DOUBLE = [("pop", "temp", 1), ("push", "temp", 1), ("push", "temp", 1), ADD]
+
+
+def constant_before(function, end):
+    """
+    Finds a constant computed by the commands of a function just before the given
+    command index: a push of a constant, followed by any number of neg and not
+    :param function: VMFunction
+    :return: (the constant as a word, index of its first command), or None
+    """
+    unary = []
+    i = end - 1
+    while i >= 0:
+        op, arg, index = function.command(i)
+        if op == PUSH:
+            if arg != CONSTANT or index > INT_CONST_MAX:
+                return None
+            value = index
+            for fold in reversed(unary):
+                value = to_word(fold(value))
+            return value, i
+        fold = UNARY_OPCODES.get(op)
+        if fold is None:
+            return None
+        unary.append(fold)
+        i -= 1
+    return None
+
+
+def horner_sequence(factor, operand):
+    """
+    Multiplies the value on top of the stack by doubling it for every bit of the
+    factor after the first, and adding the value again for every 1 bit. The first
+    doubling is an add of the value itself
+    :param operand: the command that pushes the value, or None if there is none
+    :return: list of commands, or None if the factor needs the value added and there
+    is no operand
+    """
+    commands = []
+    for i, bit in enumerate(bin(factor)[3:]):
+        commands += [operand, ADD] if i == 0 and operand else DOUBLE
+        if bit == '1':
+            if operand is None:
+                return None
+            commands += [operand, ADD]
+    return commands
+
+
+def multiply_sequence(factor, push_operand):
+    """
+    Returns the commands that multiply the value on top of the stack by a factor of
+    at least 2: the shortest of adding the value factor - 1 times, and doubling it bit
+    by bit (see horner_sequence)
+    :param push_operand: the command that pushes the value again, if it is a push of
+    its own. Otherwise the value is kept in temp 0 when it is needed again
+    :return: list of commands
+    """
+    if push_operand is not None:
+        candidates = [[push_operand, ADD] * (factor - 1),
+                      horner_sequence(factor, push_operand)]
+    else:
+        save = [SAVE_OPERAND, SAVED_OPERAND]
+        candidates = [save + [SAVED_OPERAND, ADD] * (factor - 1),
+                      save + horner_sequence(factor, SAVED_OPERAND),
+                      horner_sequence(factor, None)]
+    return min((commands for commands in candidates if commands is not None), key=len)
+
+
+class ConstantFolder():
+    """
+    Writes the operators of expressions for a code generator, folding them when it can
+    """
+
+    def __init__(self, writer, multiply_limit=MULTIPLY_LIMIT):
+        """
+        :param writer: VMWriter the code generator writes into
+        :param multiply_limit: the most commands a multiplication by a constant is
+        written in instead of a call of Math.multiply. The bigger it is, the faster and
+        bigger the code. 0 leaves all the calls but those of 0 and -1
+        """
+        self.writer = writer
+        self.multiply_limit = multiply_limit
+
+    def write_constant(self, value):
+        """
+        Writes the shortest code that pushes a word: a constant, negated if it is
+        negative. True is written as the compiler always writes it
+        :param value: int in [-32768, 32767]
+        """
+        if value >= 0:
+            self.writer.write_push("constant", value)
+        elif value == TRUE:
+            self.writer.write_push("constant", 0)
+            self.writer.write_arithmetic("not")
+        elif value == MIN_WORD:
+            self.writer.write_push("constant", ~MIN_WORD)
+            self.writer.write_arithmetic("not")
+        else:
+            self.writer.write_push("constant", -value)
+            self.writer.write_arithmetic("neg")
+
+    def top_constant(self):
+        """
+        Returns the value of the expression just written, if it is a constant
+        :return: int, or None
+        """
+        function = self.writer.current()
+        constant = constant_before(function, len(function))
+        return None if constant is None else constant[0]
+
+    def write_binary(self, op, write_operator):
+        """
+        Writes a binary operator. With two constant operands the result is pushed in
+        their place. With one operand that leaves the other one as it is, such as
+        x + 0 or 1 * x, that constant is taken back and nothing is written. A
+        multiplication or division by a constant is reduced when it can be (see
+        reduction).
+        :param op: the operator symbol
+        :param write_operator: function that writes the operator when it is not folded
+        """
+        function = self.writer.current()
+        end = len(function)
+        right = constant_before(function, end)
+        if right is not None:
+            right_value, right_start = right
+            left = constant_before(function, right_start)
+            if left is not None:
+                value = BINARY_FOLDS[op](left[0], right_value)
+                if value is not None:
+                    function.delete(left[1])
+                    self.write_constant(to_word(value))
+                    return
+            if RIGHT_IDENTITIES.get(op) == right_value:
+                function.delete(right_start)
+                return
+            start = operand_start(function.command, right_start - 1)
+            if self.__reduce(op, right_value, function, (start, right_start),
+                             (right_start, end)):
+                return
+        elif op in LEFT_IDENTITIES:
+            start = operand_start(function.command, end - 1)
+            left = constant_before(function, start) if start > 0 else None
+            if left is not None:
+                if left[0] == LEFT_IDENTITIES[op]:
+                    function.delete(left[1], start)
+                    return
+                # Multiplying is commutative, so the constant can go either side
+                if op == '*' and self.__reduce(op, left[0], function, (start, end),
+                                               (left[1], start)):
+                    return
+        write_operator()
+
+    def __reduce(self, op, value, function, operand, constant):
+        """
+        Reduces an operation of an operand and a constant, if it can
+        :param operand: (start, end) command indices of the code of the operand. The
+        start is -1 if it is not known
+        :param constant: (start, end) command indices of the code of the constant,
+        right before or right after the operand
+        :return: whether the operation was written
+        """
+        start, end = operand
+        reduction = self.reduction(op, value, function.commands(start, end)
+                                   if start >= 0 else None)
+        if reduction is None:
+            return False
+        drop_operand, commands = reduction
+        if drop_operand:
+            function.delete(min(start, constant[0]), max(end, constant[1]))
+        else:
+            function.delete(*constant)
+        self.__write(commands)
+        return True
+
+    def reduction(self, op, value, operand):
+        """
+        Finds cheaper code for a multiplication or division of an operand by a
+        constant:
+        x * 0 is 0, and the code of x is dropped too when it has no effect but its
+        value. x * -1 and x / -1 are -x. x * k is written with adds (see
+        multiply_sequence) when that takes no more than multiply_limit commands, and
+        negated when k is negative. Dividing by anything else is left to Math.divide,
+        as there is no shift to divide by powers of 2 with.
+        :param op: '*' or '/'
+        :param value: the constant
+        :param operand: the commands of the other operand, None if they are not known
+        :return: (whether the code of the operand is dropped, commands that replace the
+        operator and the constant), or None
+        """
+        if op == '/':
+            return (False, [NEGATE]) if value == TRUE else None
+        if op != '*':
+            return None
+        if value == 0:
+            if operand is not None and all(command[0] not in (POP, CALL)
+                                           for command in operand):
+                return True, [("push", "constant", 0)]
+            return False, [SAVE_OPERAND, ("push", "constant", 0)]
+        if value == TRUE:
+            return False, [NEGATE]
+        push_operand = None
+        # A push from temp could be of a value the reduced code overwrites
+        if operand is not None and len(operand) == 1 and operand[0][0] == PUSH and \
+                operand[0][1] != TEMP:
+            push_operand = ("push", SEGMENT_NAMES[operand[0][1]], operand[0][2])
+        commands = multiply_sequence(abs(value), push_operand)
+        if value < 0:
+            commands.append(NEGATE)
+        if len(commands) > self.multiply_limit:
+            return None
+        return False, commands
+
+    def __write(self, commands):
+        """
+        Writes reduced code
+        """
+        for command in commands:
+            if command[0] == "push":
+                self.writer.write_push(command[1], command[2])
+            elif command[0] == "pop":
+                self.writer.write_pop(command[1], command[2])
+            else:
+                self.writer.write_arithmetic(command[0])
+
+    def write_unary(self, op, command):
+        """
+        Writes a unary operator, folding it into a constant operand
+        :param op: the operator symbol
+        :param command: the VM command of the operator
+        """
+        function = self.writer.current()
+        operand = constant_before(function, len(function))
+        if operand is None:
+            self.writer.write_arithmetic(command)
+        else:
+            function.delete(operand[1])
+            self.write_constant(to_word(UNARY_FOLDS[op](operand[0])))
@@ -13,14 +13,168 @@ Include testing modules.
 
 
 """
+import os
+
 from JackCompiler.SyntaxAnalyzer.CompilationEngine import CompilationEngine
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import IdentifierTable
+from JackCompiler.SyntaxAnalyzer.TokenCache import TokenCache
+from JackCompiler.SyntaxAnalyzer.Parser import Parser
+from JackCompiler.CodeGeneration import CodeGenerator
+from JackCompiler.VMWriter import VMWriter
+from JackCompiler.Optimizer import PeepholeOptimizer, FunctionPruner, Inliner, \
+    INLINE_LIMIT
+from JackCompiler.ConstantFolding import MULTIPLY_LIMIT
 
 class Compiler:
 
 
-    def __init__(self):
-        pass
+    def __init__(self, streaming=False, cache_dir=None, precedence=False, ast=False,
+                 jobs=1, optimize=False, multiply_limit=MULTIPLY_LIMIT,
+                 pool_strings=False, inline_limit=INLINE_LIMIT):
+        """
+        :param streaming: tokenize each file lazily while it is being compiled
+        :param cache_dir: directory where token streams are cached between runs, so
+        unchanged files are not tokenized again
+        :param precedence: use conventional operator precedence in expressions
+        :param ast: parse each file into a syntax tree first and generate its code from
+        the tree, instead of generating code while parsing
+        :param jobs: number of processes the subroutines of a big file are compiled in
+        :param optimize: fold constant expressions, and run the peephole optimizer over
+        the VM code of every file
+        :param multiply_limit: with optimize, the most commands a multiplication by a
+        constant is written in instead of a call of Math.multiply
+        :param pool_strings: build every distinct string constant of a class once, and
+        share it after that (see CompilationEngine)
+        :param inline_limit: the most commands a function of a whole program is inlined
+        with (see start_program and Inliner)
+        """
+        self.streaming = streaming
+        self.cache = TokenCache(cache_dir) if cache_dir else None
+        self.precedence = precedence
+        self.ast = ast
+        self.jobs = jobs
+        self.optimize = optimize
+        self.multiply_limit = multiply_limit
+        self.pool_strings = pool_strings
+        self.inline_limit = inline_limit
+        # Kept for all the files, so it counts what was removed from all of them
+        self.peephole = PeepholeOptimizer() if optimize else None
+        self.passes = [self.peephole] if optimize else []
+        # Names are interned once for all the files this compiler compiles
+        self.identifiers = IdentifierTable()
+        # (writer, destination, whether it compiled) of every file of the program
+        # being compiled, see start_program, and the passes finish_program ran over it
+        self.program = None
+        self.inliner = None
+        self.pruner = None
 
 
     def compile(self, jack_file, dest_file_name):
-        jack_compiler = CompilationEngine(jack_file, dest_file_name)
\ No newline at end of file
+        """
+        Compiles a jack file into a vm file. The code of a file with errors is not
+        written, and a vm file left from an earlier compilation of it is removed, so
+        that no vm file is there for code that did not compile
+        :return: list of the error messages of the file, empty if it compiled
+        """
+        # The code is recorded and only written once the file compiled, or with the
+        # whole program
+        writer = VMWriter(None)
+        try:
+            errors = self.generate(jack_file, writer)
+        except Exception:
+            self.__compiled(writer, dest_file_name, False)
+            raise
+        self.__compiled(writer, dest_file_name, not errors)
+        return errors
+
+    def __compiled(self, writer, dest_file_name, compiled):
+        """
+        Writes the code of a file that was compiled, or keeps it for finish_program
+        when a whole program is being compiled
+        :param compiled: whether the file compiled without errors
+        """
+        if self.program is None:
+            self.write(writer, dest_file_name, compiled)
+        else:
+            self.program.append((writer, dest_file_name, compiled))
+
+    def generate(self, jack_file, writer):
+        """
+        Compiles a jack file into the code of a VMWriter, and closes it
+        :return: list of the error messages of the file, empty if it compiled
+        """
+        if self.ast:
+            parser = self.parse(jack_file)
+            if parser.errors:
+                return parser.errors
+            for vm_pass in self.passes:
+                writer.add_pass(vm_pass)
+            CodeGenerator(writer, self.identifiers, optimize=self.optimize,
+                          multiply_limit=self.multiply_limit,
+                          pool_strings=self.pool_strings).write_classes(parser.classes)
+            writer.close()
+            return []
+        return CompilationEngine(jack_file, writer, streaming=self.streaming,
+                                 identifiers=self.identifiers, cache=self.cache,
+                                 precedence=self.precedence, jobs=self.jobs,
+                                 passes=self.passes, optimize=self.optimize,
+                                 multiply_limit=self.multiply_limit,
+                                 pool_strings=self.pool_strings).errors
+
+    @staticmethod
+    def write(writer, dest_file_name, compiled):
+        """
+        Writes the code of a file into its vm file, or removes the vm file if the
+        file did not compile
+        :param writer: closed VMWriter of the file
+        :param compiled: whether the file compiled without errors
+        """
+        if not compiled:
+            if os.path.isfile(dest_file_name):
+                os.remove(dest_file_name)
+            return
+        with open(dest_file_name, 'w') as file:
+            file.write(writer.text())
+
+    def start_program(self):
+        """
+        Starts compiling the files of a whole program. Their code is not written
+        when they are compiled, but by finish_program once all of them are
+        """
+        self.program = []
+
+    def finish_program(self, keep=()):
+        """
+        Inlines the small functions of the program (see Inliner), removes the
+        functions that can never be called after that (see FunctionPruner), and writes
+        the code of all its files. The files that did not compile are left out of it
+        all, and not written (see write). The passes are kept in self.inliner and
+        self.pruner, which count what they changed
+        :param keep: names of more functions to keep, with all they call
+        """
+        program, self.program = self.program, None
+        writers = [writer for writer, dest_file_name, compiled in program if compiled]
+        self.inliner = Inliner(self.inline_limit)
+        self.inliner(writers)
+        self.pruner = FunctionPruner(keep)
+        self.pruner(writers)
+        for writer, dest_file_name, compiled in program:
+            self.write(writer, dest_file_name, compiled)
+
+    def check(self, jack_file):
+        """
+        Checks that a jack file compiles, without generating or writing any code
+        :return: list of the error messages of the file, empty if it compiles
+        """
+        return CompilationEngine(jack_file, None, streaming=self.streaming,
+                                 identifiers=self.identifiers, cache=self.cache,
+                                 precedence=self.precedence).errors
+
+    def parse(self, jack_file):
+        """
+        Parses a file into its syntax tree
+        :return: the Parser, with the AST.Class nodes of the file in its classes, or
+        its error in its errors
+        """
+        return Parser(jack_file, streaming=self.streaming, identifiers=self.identifiers,
+                      cache=self.cache, precedence=self.precedence)
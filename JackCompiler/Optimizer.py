@@ -0,0 +1,544 @@
+"""
+Optimization passes over the VM code that a VMWriter records, run before the code is
+written (see VMWriter.add_pass).
+
+The PeepholeOptimizer looks at a few commands at a time and rewrites sequences that the
+compiler is known to produce into shorter ones that do the same, and drops the labels
+that nothing jumps to and the commands that nothing reaches.
+
+The Inliner and the FunctionPruner run over a whole program once all of its classes are
+compiled. The Inliner replaces the calls of small functions with their code, and the
+FunctionPruner removes the functions that no call can reach from its entry points.
+
+write_if_false, write_if_true and the array functions are for code generators, to write
+cheaper control flow and array accesses as the code is being written.
+"""
+
+from JackCompiler.VMWriter import PUSH, POP, LABEL, GOTO, IF_GOTO, CALL, FUNCTION, \
+    RETURN, EQ, GT, LT, AND, OR, NOT, SEGMENT_CODES, STACK_EFFECTS, operand_start
+from JackCompiler.ConstantFolding import constant_before, TRUE
+
+CONSTANT = SEGMENT_CODES["constant"]
+ARGUMENT = SEGMENT_CODES["argument"]
+LOCAL = SEGMENT_CODES["local"]
+STATIC = SEGMENT_CODES["static"]
+POINTER = SEGMENT_CODES["pointer"]
+TEMP = SEGMENT_CODES["temp"]
+THAT = SEGMENT_CODES["that"]
+
+# The arithmetic commands that always leave true (-1) or false (0)
+COMPARISONS = frozenset([EQ, GT, LT])
+
+# The functions a program starts from: the bootstrap code calls Sys.init, which calls
+# Main.main
+MAIN_FUNCTION = "Main.main"
+ENTRY_FUNCTIONS = ("Sys.init", MAIN_FUNCTION)
+
+# The most commands, besides its function command and return, a function is inlined
+# with, unless the inliner is given another limit
+INLINE_LIMIT = 8
+# The temps the arguments and locals of inlined code are kept in. The code generators
+# only use temp 0 and 1 themselves
+INLINE_TEMPS = range(2, 8)
+
+
+def is_boolean(commands, i):
+    """
+    Whether the command at i is known to leave true (-1) or false (0) on the stack:
+    a comparison, a constant 0, or a not, and or or of these
+    """
+    while i >= 0:
+        op, arg, index = commands[i]
+        if op in COMPARISONS:
+            return True
+        if op == PUSH and arg == CONSTANT:
+            return index == 0
+        if op == AND or op == OR:
+            start = operand_start(commands.__getitem__, i - 1)
+            return start > 0 and is_boolean(commands, i - 1) and \
+                is_boolean(commands, start - 1)
+        if op != NOT:
+            return False
+        i -= 1
+    return False
+
+
+def write_if_false(writer, label):
+    """
+    Writes a jump to label that is taken when the condition just written into the
+    writer is false, that is 0. A condition known to be true or false is negated, and
+    one that ends with a not of such a condition is jumped on without it. Any other
+    value is compared with 0, as if-goto jumps on every value but 0.
+    :param writer: VMWriter
+    :param label: string
+    """
+    function = writer.current()
+    last = len(function) - 1
+    if last >= 0 and function[last][0] == NOT and is_boolean(function, last - 1):
+        function.delete(last)
+    elif is_boolean(function, last):
+        writer.write_arithmetic("not")
+    else:
+        writer.write_push("constant", 0)
+        writer.write_arithmetic("eq")
+    writer.write_if(label)
+
+
+def write_if_true(writer, label):
+    """
+    Writes a jump to label that is taken when the condition just written into the
+    writer is true, that is -1, as a while loop written without -O only goes on then.
+    A condition known to be true or false is jumped on as it is. Any other value is
+    compared with true: its not is compared with 0, and a not it ends with is taken
+    back instead. A constant is replaced by what it is compared to.
+    :param writer: VMWriter
+    :param label: string
+    """
+    function = writer.current()
+    last = len(function) - 1
+    constant = constant_before(function, len(function))
+    if constant is not None:
+        function.delete(constant[1])
+        writer.write_push("constant", 0)
+        if constant[0] == TRUE:
+            writer.write_arithmetic("not")
+    elif not is_boolean(function, last):
+        if last >= 0 and function[last][0] == NOT:
+            function.delete(last)
+        else:
+            writer.write_arithmetic("not")
+        writer.write_push("constant", 0)
+        writer.write_arithmetic("eq")
+    writer.write_if(label)
+
+
+def write_array_index(writer):
+    """
+    Writes what adds the index of an array entry to the base of the array, once the
+    code of both is written. A constant index that is not negative is taken back
+    instead, and the entry is then reached at that offset from 'that', with 'that'
+    pointed at the base.
+    :param writer: VMWriter
+    :return: the offset of the entry from 'that'
+    """
+    function = writer.current()
+    index = constant_before(function, len(function))
+    if index is not None and index[0] >= 0:
+        function.delete(index[1])
+        return index[0]
+    writer.write_arithmetic("add")
+    return 0
+
+
+def write_array_read(writer):
+    """
+    Writes the read of an array entry, once the code of its base and index is written
+    :param writer: VMWriter
+    """
+    offset = write_array_index(writer)
+    writer.write_pop("pointer", 1)
+    writer.write_push("that", offset)
+
+
+def uses_that(command):
+    """
+    Whether a command reads or writes 'that' or the pointer to it
+    """
+    op, arg, index = command
+    return (op == PUSH or op == POP) and (arg == THAT or arg == POINTER and index == 1)
+
+
+def write_array_store(writer, value_start, offset):
+    """
+    Writes the store of a value into an array entry, once the code of the value is
+    written after that of the entry (see write_array_index). When the value leaves
+    'that' as it is, 'that' is pointed at the entry before the value is computed, and
+    the value is stored right away. A call leaves it too, as every function gets its
+    own. Otherwise the value is kept aside in temp 0 while 'that' is pointed.
+    :param writer: VMWriter
+    :param value_start: index of the first command of the value
+    :param offset: the offset of the entry from 'that'
+    """
+    function = writer.current()
+    value = function.commands(value_start)
+    if any(uses_that(command) for command in value):
+        writer.write_pop("temp", 0)
+        writer.write_pop("pointer", 1)
+        writer.write_push("temp", 0)
+    else:
+        function.delete(value_start)
+        writer.write_pop("pointer", 1)
+        writer.write_code(value)
+    writer.write_pop("that", offset)
+
+
+# Rewrite rules. Each one looks at the last commands written so far and returns how
+# many of them to take back and the commands to put in their place, or None.
+
+def double_not(out):
+    """
+    not; not  ->  nothing
+    """
+    if len(out) >= 2 and out[-1][0] == NOT and out[-2][0] == NOT:
+        return 2, []
+
+
+def jump_to_next(out):
+    """
+    goto L; label L  ->  label L
+    """
+    if len(out) >= 2 and out[-1][0] == LABEL and out[-2][0] == GOTO and \
+            out[-1][1] == out[-2][1]:
+        return 2, [out[-1]]
+
+
+def constant_branch(out):
+    """
+    push constant 0; if-goto L  ->  nothing, and with any other constant  ->  goto L
+    """
+    if len(out) >= 2 and out[-1][0] == IF_GOTO and out[-2][:2] == (PUSH, CONSTANT):
+        return 2, [] if out[-2][2] == 0 else [(GOTO, out[-1][1], 0)]
+
+
+def true_branch(out):
+    """
+    push constant 0; not; if-goto L  ->  goto L
+    """
+    if len(out) >= 3 and out[-1][0] == IF_GOTO and out[-2][0] == NOT and \
+            out[-3] == (PUSH, CONSTANT, 0):
+        return 3, [(GOTO, out[-1][1], 0)]
+
+
+def branch_over_goto(out):
+    """
+    if-goto A; goto B; label A  ->  not; if-goto B; label A
+    As 'if-goto' jumps on any value but 0, this is only right when the condition is
+    known to be true or false, such as the result of a comparison. The label is then
+    dropped if nothing else jumps to it.
+    """
+    if len(out) >= 4 and out[-1][0] == LABEL and out[-2][0] == GOTO and \
+            out[-3][0] == IF_GOTO and out[-3][1] == out[-1][1] and \
+            is_boolean(out, len(out) - 4):
+        return 3, [(NOT, 0, 0), (IF_GOTO, out[-2][1], 0), out[-1]]
+
+
+def array_store(out):
+    """
+    push x; pop temp 0; pop pointer 1; push temp 0; pop that 0
+        ->  pop pointer 1; push x; pop that 0
+    The value of an array store is kept aside in temp 0 while 'that' is pointed at the
+    entry. A value that is a single push can be pushed after that instead, as long as
+    it does not read through 'that' itself.
+    """
+    if len(out) >= 5 and out[-1] == (POP, THAT, 0) and out[-2] == (PUSH, TEMP, 0) \
+            and out[-3] == (POP, POINTER, 1) and out[-4] == (POP, TEMP, 0) and \
+            out[-5][0] == PUSH and out[-5][1] != THAT and out[-5][:2] != (PUSH, POINTER):
+        return 5, [out[-3], out[-5], out[-1]]
+
+
+def push_pop_same(out):
+    """
+    push x; pop x  ->  nothing
+    """
+    if len(out) >= 2 and out[-1][0] == POP and out[-2][0] == PUSH and \
+            out[-1][1:] == out[-2][1:]:
+        return 2, []
+
+
+RULES = [double_not, jump_to_next, constant_branch, true_branch, branch_over_goto,
+         array_store, push_pop_same]
+
+
+class PeepholeOptimizer():
+    """
+    A pass for VMWriter.add_pass. It keeps count of the commands it saw and of the
+    commands it removed, over all the files it optimized, and of how many of these
+    were unreachable and the bytes they took
+    """
+
+    def __init__(self):
+        self.seen = 0
+        self.removed = 0
+        self.unreachable = 0
+        self.unreachable_bytes = 0
+        self.dropped = []
+
+    def __call__(self, writer):
+        for function in writer.functions:
+            commands = function.commands()
+            optimized = self.optimize(commands)
+            self.seen += len(commands)
+            if optimized != commands:
+                self.removed += len(commands) - len(optimized)
+                function.replace(optimized)
+        self.unreachable += len(self.dropped)
+        self.unreachable_bytes += writer.size(self.dropped)
+        self.dropped = []
+
+    def optimize(self, commands):
+        """
+        Rewrites the commands of a function and drops its unused labels, over and
+        over until nothing changes
+        :param commands: list of (opcode, arg, index) tuples
+        :return: the optimized list
+        """
+        while True:
+            optimized = self.drop_unreachable(self.drop_unused_labels(
+                self.rewrite(commands)))
+            if optimized == commands:
+                return optimized
+            commands = optimized
+
+    def rewrite(self, commands):
+        """
+        Runs the rules over the commands. The commands a rule puts in are fed through
+        the rules again, and so is the command before them, so rewrites that make new
+        patterns are followed up on right away.
+        :return: list of commands
+        """
+        out = []
+        pending = commands[::-1]
+        while pending:
+            out.append(pending.pop())
+            for rule in RULES:
+                match = rule(out)
+                if match is not None:
+                    taken, replacement = match
+                    del out[-taken:]
+                    pending.extend(reversed(replacement))
+                    if out:
+                        pending.append(out.pop())
+                    break
+        return out
+
+    def drop_unused_labels(self, commands):
+        """
+        Labels are local to their function, so a label that no goto or if-goto of
+        the function names can go
+        """
+        targets = {arg for op, arg, index in commands if op == GOTO or op == IF_GOTO}
+        return [command for command in commands
+                if command[0] != LABEL or command[1] in targets]
+
+    def drop_unreachable(self, commands):
+        """
+        Drops the commands that no path from the function command reaches, such as
+        statements after a return, or those of a branch a constant condition never
+        takes. Every command passes on to the next one but goto and return, and goto
+        and if-goto also to their label. A group of commands that is not a function,
+        such as those before the first function of a file, is never reached.
+        """
+        labels = {arg: i for i, (op, arg, index) in enumerate(commands) if op == LABEL}
+        reached = [False] * len(commands)
+        pending = [0] if commands and commands[0][0] == FUNCTION else []
+        while pending:
+            i = pending.pop()
+            while i < len(commands) and not reached[i]:
+                reached[i] = True
+                op, arg, index = commands[i]
+                if (op == GOTO or op == IF_GOTO) and arg in labels:
+                    pending.append(labels[arg])
+                if op == GOTO or op == RETURN:
+                    break
+                i += 1
+        if all(reached):
+            return commands
+        self.dropped += [command for command, kept in zip(commands, reached)
+                         if not kept]
+        return [command for command, kept in zip(commands, reached) if kept]
+
+
+class FunctionPruner():
+    """
+    Removes the functions of a program that are never called: those that no chain of
+    calls reaches from the entry functions, or from the functions it is told to keep.
+    A call of a name that is not a function of the program, such as a bare subroutine
+    name or one qualified by a variable, could mean any function of that subroutine
+    name, so all of those are kept. A program without Main.main, such as a library,
+    is left as it is. It keeps count of the functions and commands it saw, and of those
+    it removed and their bytes
+    """
+
+    def __init__(self, keep=()):
+        """
+        :param keep: names of more functions to keep, with all they call
+        """
+        self.roots = list(ENTRY_FUNCTIONS) + list(keep)
+        self.functions = 0
+        self.seen = 0
+        self.removed_functions = 0
+        self.removed = 0
+        self.removed_bytes = 0
+
+    def __call__(self, writers):
+        """
+        :param writers: the VMWriters of all the classes of the program, after their
+        passes and before they are written
+        """
+        definitions = {}
+        for writer in writers:
+            for function in writer.functions:
+                self.seen += len(function)
+                if len(function) and function[0][0] == FUNCTION:
+                    self.functions += 1
+                    definitions[writer.name(function[0][1])] = (writer, function)
+        if MAIN_FUNCTION not in definitions:
+            return
+        by_subroutine = {}
+        for name in definitions:
+            by_subroutine.setdefault(name.split('.')[-1], []).append(name)
+        reached = set()
+        pending = [name for name in self.roots if name in definitions]
+        while pending:
+            name = pending.pop()
+            if name in reached:
+                continue
+            reached.add(name)
+            writer, function = definitions[name]
+            for op, arg, index in function.commands():
+                if op == CALL:
+                    callee = writer.name(arg)
+                    pending += [callee] if callee in definitions else \
+                        by_subroutine.get(callee.split('.')[-1], [])
+        for name, (writer, function) in definitions.items():
+            if name not in reached:
+                self.removed_functions += 1
+                self.removed += len(function)
+                self.removed_bytes += writer.size(function.commands())
+                writer.functions.remove(function)
+
+
+class Inliner():
+    """
+    Replaces the calls of the small leaf functions of a program with their code, which
+    saves the frame every call sets up and tears down. A function is inlined when its
+    code runs straight to a single return, without a call or a jump, in no more than
+    the limit of commands, and leaves just the value it returns on the stack.
+
+    The code does what the call would: its arguments and locals are kept in temps
+    (see INLINE_TEMPS), a local it reads before it sets starts at 0, and 'this' and
+    'that' are those the
+    function would get, the caller's. A function that points 'this' elsewhere is not
+    inlined, and 'that' is pointed back after one that points it elsewhere, as on a
+    return. A function that uses its statics is only inlined into its own class, as
+    the statics of a class are its file's. It keeps count of the calls it replaced, of
+    the functions they called, and of the commands and bytes the code grew by.
+    """
+
+    def __init__(self, limit=INLINE_LIMIT):
+        """
+        :param limit: the most commands a function is inlined with. 0 inlines nothing
+        """
+        self.limit = limit
+        self.calls = 0
+        self.functions = 0
+        self.added = 0
+        self.added_bytes = 0
+
+    def __call__(self, writers):
+        """
+        :param writers: the VMWriters of all the classes of the program, after their
+        passes and before they are written
+        """
+        inlinable = {}
+        for writer in writers:
+            for function in writer.functions:
+                if len(function) and function[0][0] == FUNCTION:
+                    inline = self.inline_code(function.commands())
+                    if inline is not None:
+                        inlinable[writer.name(function[0][1])] = (writer, inline)
+        if not inlinable:
+            return
+        inlined = set()
+        for writer in writers:
+            for function in writer.functions:
+                commands = function.commands()
+                code = []
+                for command in commands:
+                    op, arg, index = command
+                    callee = inlinable.get(writer.name(arg)) if op == CALL else None
+                    expansion = None if callee is None else \
+                        self.expand(callee[1], index, callee[0] is writer)
+                    if expansion is None:
+                        code.append(command)
+                    else:
+                        code += expansion
+                        inlined.add(writer.name(arg))
+                        self.calls += 1
+                if code != commands:
+                    self.added += len(code) - len(commands)
+                    self.added_bytes += writer.size(code) - writer.size(commands)
+                    function.replace(code)
+        self.functions += len(inlined)
+
+    def inline_code(self, commands):
+        """
+        Finds whether a function can be inlined
+        :param commands: the commands of the function, from its function command
+        :return: (its code between the function command and the return, number of
+        locals, the locals it reads before it sets, number of arguments it uses,
+        whether it uses its statics, whether it points 'that' elsewhere), or None if it
+        can't be inlined
+        """
+        depth = 0
+        num_args = 0
+        uses_statics = sets_that = False
+        read_first, accessed = [], set()
+        for i, (op, arg, index) in enumerate(commands[1:self.limit + 2]):
+            if op == RETURN:
+                if depth != 1:
+                    return None
+                return commands[1:i + 1], commands[0][2], read_first, num_args, \
+                    uses_statics, sets_that
+            effect = STACK_EFFECTS.get(op)
+            if effect is None:
+                # A call or a jump
+                return None
+            depth += effect
+            if depth < 0:
+                # A pop of what the caller left on the stack
+                return None
+            if op == PUSH or op == POP:
+                if arg == TEMP and index >= INLINE_TEMPS[0] or \
+                        op == POP and arg == POINTER and index == 0:
+                    return None
+                if arg == ARGUMENT:
+                    num_args = max(num_args, index + 1)
+                if arg == LOCAL and index not in accessed:
+                    accessed.add(index)
+                    if op == PUSH:
+                        read_first.append(index)
+                uses_statics = uses_statics or arg == STATIC
+                sets_that = sets_that or op == POP and arg == POINTER
+        return None
+
+    def expand(self, inline, num_args, same_class):
+        """
+        Writes the code that replaces a call of a function
+        :param inline: what inline_code found of the function
+        :param num_args: the number of arguments of the call
+        :param same_class: whether the call is in the class of the function
+        :return: list of commands, or None if the call can't be replaced
+        """
+        code, num_locals, read_first, used_args, uses_statics, sets_that = inline
+        if used_args > num_args or uses_statics and not same_class or \
+                num_args + num_locals + sets_that > len(INLINE_TEMPS):
+            return None
+        first_local = INLINE_TEMPS[0] + num_args
+        saved_that = first_local + num_locals
+        # The last argument is on top of the stack
+        expansion = [(POP, TEMP, INLINE_TEMPS[0] + i) for i in reversed(range(num_args))]
+        for i in read_first:
+            expansion += [(PUSH, CONSTANT, 0), (POP, TEMP, first_local + i)]
+        if sets_that:
+            expansion += [(PUSH, POINTER, 1), (POP, TEMP, saved_that)]
+        for op, arg, index in code:
+            if (op == PUSH or op == POP) and arg == ARGUMENT:
+                expansion.append((op, TEMP, INLINE_TEMPS[0] + index))
+            elif (op == PUSH or op == POP) and arg == LOCAL:
+                expansion.append((op, TEMP, first_local + index))
+            else:
+                expansion.append((op, arg, index))
+        if sets_that:
+            expansion += [(PUSH, TEMP, saved_that), (POP, POINTER, 1)]
+        return expansion
@@ -24,6 +24,9 @@ in project 10. This module sotres and handles the following data:
     assigned to the identifier by the symbol table.
 -> Whether the identifier is presently being defined (e.g. the identifier stands for a
     variable declared in a "var" statement) or used
+
+Symbols are keyed on the integer IDs that the tokenizer's IdentifierTable gives to names,
+so every lookup is a plain int keyed dictionary hit.
     """
 
 from enum import Enum
@@ -73,21 +76,21 @@ class SymbolTable:
         Defines a new identifier of a given name, type, and kind and assigns it a running
         index. STATIC and FIELD identifiers have a class scope, while ARG and VAR
         identifiers have a subroutine scope.
-        :param name: unique identifier representing this symbol (string)
+        :param name: unique identifier representing this symbol (interned name ID)
         :param type: type of identifier
         :param kind: one of [static, field, argument, var]
         :return:
         """
         if kind in ["static", "field"]:
-            assert name not in self.class_table.table.keys()
+            assert name not in self.class_table.table
             num = self.class_table.counters[kind]
             self.class_table.counters[kind] += 1
-            self.class_table.table[name] = [type, kind, num]
+            self.class_table.table[name] = (type, kind, num)
         elif kind in ["argument", "local"]:
-            assert name not in self.subroutine_tables[-1].table.keys()
+            assert name not in self.subroutine_tables[-1].table
             num = self.subroutine_tables[-1].counters[kind]
             self.subroutine_tables[-1].counters[kind] += 1
-            self.subroutine_tables[-1].table[name] = [type, kind, num]
+            self.subroutine_tables[-1].table[name] = (type, kind, num)
         else:
             raise ValueError("'{}' is an unrecognized type to define in the symbol "
                              "table".format(kind))
@@ -108,55 +111,48 @@ class SymbolTable:
             raise ValueError("{} is an unrecognized type to define in the symbol "
                              "table".format(kind))
 
+    def lookup(self, name):
+        """
+        Returns everything that is known about the named identifier in the current
+        scope, with a single lookup per scope.
+        :param name: interned name ID of the symbol
+        :return: a (type, kind, index) tuple, or None if the identifier is unknown
+        """
+        entry = self.subroutine_tables[-1].table.get(name)
+        if entry is None:
+            entry = self.class_table.table.get(name)
+        return entry
+
     def kind_of(self, name):
         """
         Returns the kind of the named identifier in
         the current scope. Returns NONE if the
         identifier is unknown in the current scope.
-        :param name: string of symbol identifier
+        :param name: interned name ID of the symbol
         :return:
         """
-        if name in self.subroutine_tables[-1].table.keys():
-            return self.subroutine_tables[-1].table[name][KIND]
-
-        elif name in self.class_table.table.keys():
-            return self.class_table.table[name][KIND]
-
-        else:
-            return None
-
+        entry = self.lookup(name)
+        return entry and entry[KIND]
 
     def type_of(self, name):
         """
         Returns the type of the named identifier in
         the current scope.
-        :param name: string of symbol identifier
+        :param name: interned name ID of the symbol
         :return:
         """
-        if name in self.subroutine_tables[-1].table.keys():
-            return self.subroutine_tables[-1].table[name][TYPE]
-
-        elif name in self.class_table.table.keys():
-            return self.class_table.table[name][TYPE]
-
-        else:
-            return None
+        entry = self.lookup(name)
+        return entry and entry[TYPE]
 
     def index_of(self, name):
         """
         Returns the index assigned to named
         identifier.
-        :param name: string of symbol identifier
+        :param name: interned name ID of the symbol
         :return:
         """
-        if name in self.subroutine_tables[-1].table.keys():
-            return self.subroutine_tables[-1].table[name][NUM]
-
-        elif name in self.class_table.table.keys():
-            return self.class_table.table[name][NUM]
-
-        else:
-            return None
+        entry = self.lookup(name)
+        return entry and entry[NUM]
 
 
     # ------------------ Internal/ alternative API   ------------------------------------
@@ -0,0 +1,196 @@
+"""
+The nodes of the abstract syntax tree that the Parser builds and the CodeGenerator walks.
+
+Every node keeps its fields in __slots__, so a node costs a few dozen bytes and no
+per instance dictionary, and the tree of a whole project can be held at once. Names
+and keywords are kept as the shared string objects of the tokenizer.
+
+An expression is kept flat: its terms and binary operator symbols in postfix order,
+the order in which their VM code is written. A term is any node other than a
+statement, a parenthesized term being an Expression of its own.
+"""
+
+
+class Node():
+    """
+    Base of all the nodes
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            repr(getattr(self, field)) for field in self.__slots__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = None
+
+
+# Program structure ----------------------------------------------------------------------
+
+class Class(Node):
+    """
+    A class. Its members are ClassVarDec and Subroutine nodes in source order
+    """
+    __slots__ = ('name', 'members')
+
+    def __init__(self, name, members):
+        self.name = name
+        self.members = members
+
+
+class ClassVarDec(Node):
+    """
+    A static or field declaration of one or more names
+    """
+    __slots__ = ('kind', 'type', 'names')
+
+    def __init__(self, kind, type, names):
+        self.kind = kind
+        self.type = type
+        self.names = names
+
+
+class Subroutine(Node):
+    """
+    A constructor, method or function. params and local_vars hold (type, name) pairs
+    """
+    __slots__ = ('kind', 'return_type', 'name', 'params', 'local_vars', 'statements')
+
+    def __init__(self, kind, return_type, name, params, local_vars, statements):
+        self.kind = kind
+        self.return_type = return_type
+        self.name = name
+        self.params = params
+        self.local_vars = local_vars
+        self.statements = statements
+
+
+# Statements -----------------------------------------------------------------------------
+
+class Let(Node):
+    """
+    let name = value, or let name[index] = value when index is not None
+    """
+    __slots__ = ('name', 'index', 'value')
+
+    def __init__(self, name, index, value):
+        self.name = name
+        self.index = index
+        self.value = value
+
+
+class If(Node):
+    """
+    An if statement. else_statements is None when there is no else part
+    """
+    __slots__ = ('condition', 'statements', 'else_statements')
+
+    def __init__(self, condition, statements, else_statements):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class While(Node):
+    __slots__ = ('condition', 'statements')
+
+    def __init__(self, condition, statements):
+        self.condition = condition
+        self.statements = statements
+
+
+class Do(Node):
+    __slots__ = ('call',)
+
+    def __init__(self, call):
+        self.call = call
+
+
+class Return(Node):
+    """
+    A return statement. value is None when nothing is returned
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# Expressions ----------------------------------------------------------------------------
+
+class Expression(Node):
+    """
+    Terms and binary operator symbols in postfix order
+    """
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+
+class IntConst(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class StringConst(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class KeywordConst(Node):
+    """
+    One of true, false, null and this
+    """
+    __slots__ = ('word',)
+
+    def __init__(self, word):
+        self.word = word
+
+
+class Var(Node):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class ArrayRef(Node):
+    """
+    name[index]
+    """
+    __slots__ = ('name', 'index')
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class Call(Node):
+    """
+    A subroutine call, target.name(args), or name(args) when target is None
+    """
+    __slots__ = ('target', 'name', 'args')
+
+    def __init__(self, target, name, args):
+        self.target = target
+        self.name = name
+        self.args = args
+
+
+class Unary(Node):
+    """
+    A unary operator symbol applied to a term
+    """
+    __slots__ = ('op', 'term')
+
+    def __init__(self, op, term):
+        self.op = op
+        self.term = term
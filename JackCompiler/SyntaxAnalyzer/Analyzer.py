@@ -1,10 +1,14 @@
 """
-
+Writes the xml outputs of the syntax analyzer: the token stream of a jack file, and its
+parse tree.
 """
 
+import os
+
 from JackCompiler.SyntaxAnalyzer.CompilationEngine import CompilationEngine
 
 from JackCompiler.SyntaxAnalyzer.JackTokenizer import JackTokenizer
+from JackCompiler.SyntaxAnalyzer.XMLWriter import XMLWriter
 
 FILE_PATH = 1
 
@@ -22,18 +26,24 @@ class Analyzer():
         pass
 
     def tokenize(self, source, destination):
-        tokenizer = JackTokenizer(source)
-        with open(destination, 'w') as out:
-            out.write("<tokens>\n")
-            while tokenizer.has_more_tokens():
-                tokenizer.advance()
-                out.write("<" + tokenizer.token_type().value + "> "
-                          + tokenizer.cur_val + " </" +
-                          tokenizer.token_type().value + ">\n")
-            out.write("</tokens>\n")
+        """
+        Writes the tokens of the source file as xml
+        """
+        tokenizer = JackTokenizer(source, streaming=True)
+        out = XMLWriter(destination, indent="")
+        out.open_element("tokens")
+        out.write_terminals(tokenizer.token_gen())
+        out.close_element("tokens")
+        out.close()
 
     def compile(self, source, destination):
-        engine = CompilationEngine(source, destination)
+        """
+        Writes the parse tree of the source file as xml. No VM code is kept
+        :return: list of the error messages of the file
+        """
+        engine = CompilationEngine(source, os.devnull, streaming=True,
+                                   xml_file=destination)
+        return engine.errors
 
 
 if __name__ == '__main__':
@@ -9,25 +9,33 @@ If xxx is a part of an expression and thus has a value, then the emitted code sh
 value and leave it at the top of the VM stack.
 """
 
-from JackCompiler.SyntaxAnalyzer.JackTokenizer import JackTokenizer, Token_Types
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import JackTokenizer, Token_Types, \
+    line_and_column, KEYWORD, SYMBOL, IDENTIFIER, STRING_CONST
+from JackCompiler.SyntaxAnalyzer.XMLWriter import XMLWriter
 from JackCompiler import VMWriter
+from JackCompiler.ConstantFolding import ConstantFolder, MULTIPLY_LIMIT
+from JackCompiler.Optimizer import write_if_false, write_if_true, write_array_index, \
+    write_array_read, write_array_store
 from JackCompiler.SymbolTable import *
 from enum import Enum, unique
+from functools import partial
+import multiprocessing
 
 # branchhh
 
-END_LINE    = "\n"
-SPACE         = "  "
-
 # EXPRESSIONS = {"INT_CONST": "integerConstant",
 #                 "STRING_CONST": "stringConstant",
 #                 "KEYWORD": "KeywordConstant",
 #                 "IDENTIFIER": "identifier"}
 STATEMENTS      = ['let', 'if', 'while', 'do', 'return']
 KEY_TERMS       = ["true", "false", "null", "this"]
-# SPECIAL_SYMBOL  = {'&quot;': "\"", '&amp;': "&", '&lt;': "<", '&gt;': ">"}
-OPERANDS        = ['+', '-', '*', '&amp;', '|', '&lt;', '&gt;', '=', "/"]
 ROUTINES        = ['function', 'method', 'constructor']
+# The tokens that can follow the class or subroutine name of a call
+CALL_SYMBOLS    = [(Token_Types.symbol, '.'), (Token_Types.symbol, '(')]
+# Keywords the parser synchronizes on after an error, inside a subroutine and in a class
+STATEMENT_SYNC  = frozenset(STATEMENTS)
+VAR_DEC_SYNC    = frozenset(STATEMENTS + ['var'])
+CLASS_SYNC      = frozenset(ROUTINES + ['static', 'field'])
 ARGS = 'argument'
 LOCAL = 'local'
 THIS = 'this'
@@ -40,6 +48,12 @@ TEMP = "temp"
 
 IF = 0
 WHILE = 1
+STRING = 2
+
+# A pooled string constant is kept in a static of its class, under the constant in
+# quotes, a name no variable can have
+POOLED_STRING_NAME = '"{}"'
+POOLED_STRING_TYPE = "String"
 
 
 @unique
@@ -54,6 +68,24 @@ class BuiltinFunctions(Enum):
     mem_alloc = "Memory.alloc"
 
 
+# Binary operators, by their raw symbol, mapped to the VM arithmetic command or the
+# builtin function that computes them
+OP_COMMANDS     = {'+': 'add', '-': 'sub', '=': 'eq', '>': 'gt', '<': 'lt', '&': 'and',
+                   '|': 'or'}
+OP_CALLS        = {'*': BuiltinFunctions.math_mult.value,
+                   '/': BuiltinFunctions.math_div.value}
+UNARY_COMMANDS  = {'-': 'neg', '~': 'not'}
+
+# How tightly every binary operator binds when conventional precedence is asked for.
+# Jack itself gives all of them the same precedence
+PRECEDENCE      = {'|': 1, '&': 2, '=': 3, '<': 3, '>': 3, '+': 4, '-': 4, '*': 5, '/': 5}
+JACK_PRECEDENCE = 0
+
+# Files with fewer tokens than this are compiled on one core even when more jobs are
+# asked for, as starting the worker processes would take longer than the compilation
+PARALLEL_MIN_TOKENS = 20000
+
+
 
 
 
@@ -62,25 +94,122 @@ class CompilationEngine():
 
     """
 
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, streaming=False, identifiers=None,
+                 xml_file=None, cache=None, precedence=False, jobs=1, tokenizer=None,
+                 subroutine_of=None, passes=(), optimize=False,
+                 multiply_limit=MULTIPLY_LIMIT, pool_strings=False):
         """
         Creates a new compilation engine with the given input and output. The next
         routine called must be compile_class()
         :param input_file:
-        :param output_file:
+        :param output_file: path of the vm file, a stream to write the VM code into or
+        a VMWriter to record it in. If None, the file is only checked and no VM code is
+        written anywhere
+        :param streaming: tokenize lazily while compiling, see JackTokenizer
+        :param identifiers: IdentifierTable shared by the whole compilation
+        :param xml_file: if given, the parse tree is written into it as xml
+        :param cache: TokenCache of token streams, see JackTokenizer
+        :param precedence: compute expressions with the conventional operator
+        precedence instead of Jack's left to right order
+        :param jobs: number of processes the subroutines of a big file are compiled
+        in. The code written is the same as with a single one. Not used in streaming
+        mode or when writing the parse tree
+        :param tokenizer: a JackTokenizer of input_file to compile from, instead of
+        making a new one
+        :param subroutine_of: (token position, class name, class symbols, label counts)
+        to compile only the one subroutine at the position, see compile_subroutine_of
+        :param passes: passes to run over the VM code before it is written, see
+        VMWriter.add_pass
+        :param optimize: fold constant expressions, and push the value of a local that
+        is assigned a constant once instead of reading it (see ConstantFolding). An if
+        jumps over its statements on the negated condition, and a while tests its
+        condition at the bottom of the loop. Array entries at constant indices are read
+        and written at an offset from 'that', and values are stored into arrays without
+        going through temp when they leave 'that' as it is
+        :param multiply_limit: with optimize, the most commands a multiplication by a
+        constant is written in instead of a call of Math.multiply
+        :param pool_strings: build every distinct string constant of a class once, the
+        first time it is evaluated, into a static of its own, and push that static
+        every time after. The string is then shared, so changing or disposing of it
+        changes the constant for the rest of the run. Each one takes a static of the
+        240 the Hack platform has for all the classes
+
+        Errors do not stop the compilation. Each one is recorded in self.errors as a
+        "file:line:column: message" string, and the parser skips ahead to the next
+        statement or declaration and goes on.
         """
+        self.input_file = input_file
+        self.errors = []
         self.symbol_table = SymbolTable()
-        self.tokenizer = JackTokenizer(input_file)
+        self.tokenizer = tokenizer
+        try:
+            if tokenizer is None:
+                self.tokenizer = JackTokenizer(input_file, streaming=streaming,
+                                               identifiers=identifiers, cache=cache)
+        except ValueError as error:
+            # The tokens of the whole file could not be read, so there is nothing to
+            # compile. The message already holds the position
+            self.errors.append(input_file + ": " + str(error))
+            return
+        self.identifiers = self.tokenizer.identifiers
 
 
         # todo: Here we need to see if we open a new writer per class.
 
-        self.writer = VMWriter.VMWriter(output_file)
+        if output_file is None:
+            self.writer = VMWriter.NullWriter()
+        elif isinstance(output_file, VMWriter.VMWriter):
+            self.writer = output_file
+        else:
+            self.writer = VMWriter.VMWriter(output_file)
+        for vm_pass in passes:
+            self.writer.add_pass(vm_pass)
+        self.folder = ConstantFolder(self.writer, multiply_limit) if optimize else None
+        self.pool_strings = pool_strings
+        self.binary_operators = self.__gen_operator_table(precedence)
+        # The locals of the current subroutine known to hold a constant, and the
+        # variables it assigns only once. Statements of the subroutine body are at
+        # nesting 1
+        self.constants = {}
+        self.single_assignments = frozenset()
+        self.nesting = 0
+        self.xml = XMLWriter(xml_file) if xml_file else None
+        if not self.xml:
+            # Nothing to write for the parse tree, so skip the extra calls altogether
+            self.advance = self.tokenizer.advance
+            self.open_xml = self.close_xml = lambda name: None
         self.__reset_label_counter()
-        self.num_spaces = 0
-        self.buffer = ""
         self.symbol_table = SymbolTable()
-        # with open(output_file, 'w') as self.output:
+        self.__last_error = None
+        self.pool = None
+        if jobs > 1 and not streaming and not self.xml and \
+                self.tokenizer.num_tokens >= PARALLEL_MIN_TOKENS:
+            # Every worker takes the token store once, when it starts
+            self.pool = multiprocessing.Pool(jobs, _init_worker, (
+                input_file, self.tokenizer.token_store(),
+                dict(precedence=precedence, optimize=optimize,
+                     multiply_limit=multiply_limit, pool_strings=pool_strings)))
+        try:
+            if subroutine_of is not None:
+                self.compile_subroutine_of(*subroutine_of)
+            else:
+                self.compile_file()
+        except EOFError:
+            # Recovering from an error ran into the end of the file
+            pass
+        except Exception as error:
+            self.report(error)
+        if self.pool is not None:
+            # Every result that is still needed was collected by now
+            self.pool.terminate()
+        self.writer.close()
+        if self.xml:
+            self.xml.close()
+
+    def compile_file(self):
+        """
+        Compiles all the classes of the file
+        """
         while self.tokenizer.has_more_tokens():
             self.tokenizer.advance()
             # assert self.tokenizer.token_type() == Token_Types.keyword
@@ -88,28 +217,66 @@ class CompilationEngine():
                 self.class_name = None
                 self.compile_class()
             else:
-                raise KeyError("Received a token that does not fit the beginning of a "
-                               "module. " + self.tokenizer.keyWord()
-                               + " in " + input_file)
-        self.writer.close()
+                raise KeyError("Received a token that does not fit the beginning of "
+                               "a module. " + self.tokenizer.keyWord())
+
+    def compile_subroutine_of(self, pos, class_name, class_symbols, label_counter):
+        """
+        Compiles the one subroutine at the given token position, as a member of the
+        given class. This is the work of a worker process in a parallel compilation,
+        see compile_class
+        :param class_symbols: (name, type, kind) of the statics and fields declared
+        before the subroutine, in the order they were declared in
+        :param label_counter: the if, while and pooled string label counts the
+        subroutine starts from
+        """
+        self.class_name = class_name
+        for name, var_type, var_kind in class_symbols:
+            self.symbol_table.define(self.identifiers.intern(name), var_type, var_kind)
+        # Also kept under a public name, for the worker to send the final counts back
+        self.__label_counter = self.label_counter = list(label_counter)
+        self.tokenizer.seek(pos)
+        self.compile_subroutine()
+
+    def advance(self):
+        """
+        Advances the tokenizer over the current token, which becomes a terminal of the
+        parse tree
+        """
+        self.xml.write_terminal(self.tokenizer.token_type(), self.tokenizer.cur_val)
+        self.tokenizer.advance()
+
+    def open_xml(self, name):
+        """
+        Opens a non terminal element of the parse tree
+        """
+        self.xml.open_element(name)
+
+    def close_xml(self, name):
+        """
+        Closes a non terminal element of the parse tree
+        """
+        self.xml.close_element(name)
 
     def compile_class(self):
         """
-        Compiles a complete class
+        Compiles a complete class. With worker processes, each subroutine is sent to
+        one of them as soon as the statics and fields declared before it are known, and
+        the code they send back is written in source order once the class is read.
         :return:
         """
+        class_pos, num_errors = self.tokenizer.cur_pos, len(self.errors)
+        last_error, label_counter = self.__last_error, list(self.__label_counter)
+        fragments = [] if self.pool is not None else None
 
-
-        # self.write('class', delim=True)
-        # self.num_spaces += 1
-        # self.write_terminal(self.tokenizer.token_type().value, self.tokenizer.keyWord())
+        self.open_xml("class")
         self.eat('class')
         self.symbol_table = SymbolTable()
 
         t_type, self.class_name = self.tokenizer.token_type(), self.tokenizer.identifier()
         # self.write_terminal(t_type.value, class_name)
 
-        self.tokenizer.advance()
+        self.advance()
 
         # t_type, symbol = self.tokenizer.token_type(), self.tokenizer.symbol()
         # self.write_terminal(t_type.value, symbol)
@@ -117,24 +284,118 @@ class CompilationEngine():
 
         t_type = self.tokenizer.token_type()
         while t_type != Token_Types.symbol:
-            operation = self.tokenizer.keyWord()
-            if operation in ['static', 'field']:
-                self.compile_class_var_dec()
-            elif operation in ROUTINES:
-                self.compile_subroutine()
-            else:
-                raise KeyError("Found statement that does not fit class declaration. ",
-                               operation)
-
-            # self.tokenizer.advance()
+            start = self.tokenizer.cur_pos
+            try:
+                operation = self.tokenizer.keyWord()
+                if operation in ['static', 'field']:
+                    self.compile_class_var_dec()
+                elif operation in ROUTINES:
+                    if fragments is None:
+                        self.compile_subroutine()
+                    else:
+                        fragments.append(self.__dispatch_subroutine())
+                else:
+                    raise KeyError("Found statement that does not fit class "
+                                   "declaration.", operation)
+            except EOFError:
+                raise
+            except Exception as error:
+                self.recover(error, start, CLASS_SYNC, in_class=True)
 
             t_type = self.tokenizer.token_type()
 
-        # self.eat('}')
+        # The closing '}' is the last token, so it is not advanced over
+        if self.xml:
+            self.xml.write_terminal(t_type, self.tokenizer.symbol())
+        self.close_xml("class")
+
+        if fragments and not self.__write_fragments(fragments, num_errors):
+            # Something in the class went wrong. It is compiled again on one core, so
+            # that its code and errors come out exactly as in a serial compilation
+            del self.errors[num_errors:]
+            self.__last_error, self.__label_counter = last_error, label_counter
+            self.tokenizer.seek(class_pos)
+            pool, self.pool = self.pool, None
+            try:
+                self.compile_class()
+            finally:
+                self.pool = pool
 
-        # self.write_terminal(t_type.value, self.tokenizer.symbol())
-        # self.num_spaces -= 1
-        # self.write('class', delim=True, end=True)
+    def __dispatch_subroutine(self):
+        """
+        Sends the subroutine at the current token to a worker process and skips the
+        tokenizer over it. The subroutine ends at the '}' that matches its first '{'.
+        Its labels are numbered on from those of the subroutines before it, which are
+        counted by the if and while keywords, as every if and while statement takes
+        exactly one number. When strings are pooled, so is every string constant, and
+        the statics of the constants it adds to the pool are defined here in the order
+        it adds them, to be known to the subroutines after it.
+        :return: (pending result, label counts expected at the end of the subroutine)
+        """
+        tokenizer = self.tokenizer
+        kinds, starts, ends, text = tokenizer.kinds, tokenizer.starts, tokenizer.ends, \
+            tokenizer.text
+        start, depth = tokenizer.cur_pos, 0
+        label_counter = list(self.__label_counter)
+        strings = []
+        # A subroutine is always followed by one more token, at least the '}' of the
+        # class, which its last '}' is advanced onto
+        for pos in range(start, tokenizer.num_tokens - 1):
+            kind = kinds[pos]
+            if kind == SYMBOL:
+                char = text[starts[pos]]
+                if char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if not depth:
+                        break
+            elif kind == KEYWORD:
+                word = text[starts[pos]:ends[pos]]
+                if word == 'if':
+                    label_counter[IF] += 1
+                elif word == 'while':
+                    label_counter[WHILE] += 1
+            elif kind == STRING_CONST and self.pool_strings:
+                label_counter[STRING] += 1
+                strings.append(text[starts[pos]:ends[pos]])
+        else:
+            raise Exception("Could not find the end of the subroutine.")
+
+        name = self.identifiers.name
+        class_symbols = [(name(name_id), entry[TYPE], entry[KIND]) for name_id, entry
+                         in self.symbol_table.class_table.table.items()]
+        result = self.pool.apply_async(_compile_subroutine, (
+            start, self.class_name, class_symbols, self.__label_counter))
+        for string in strings:
+            self.__pooled_string(string)
+        self.__label_counter = label_counter
+        tokenizer.seek(pos + 1)
+        return result, list(label_counter)
+
+    def __write_fragments(self, fragments, num_errors):
+        """
+        Waits for the code of the subroutines sent to the workers, and writes it in
+        source order
+        :param fragments: (pending result, expected label counts) of every subroutine
+        :param num_errors: the number of errors there were before the class
+        :return: whether the class compiled without errors, and so exactly as it would
+        have on one core. Nothing is written if it did not
+        """
+        if len(self.errors) > num_errors:
+            return False
+        codes = []
+        for result, expected_counter in fragments:
+            try:
+                code, errors, label_counter = result.get()
+            except Exception:
+                return False
+            if errors or label_counter != expected_counter:
+                return False
+            codes.append(code)
+        for code in codes:
+            self.writer.extend(code)
+        return True
 
     def eat(self, string):
         """
@@ -143,25 +404,92 @@ class CompilationEngine():
         :param string: the expected string.
         :raise: the current token is not the expected string.
         """
+        if self.tokenizer.matches(string):
+            self.advance()
+            return
         type = self.tokenizer.token_type()
         value = "not keyword and not symbol"
         if type == Token_Types.keyword:
             value = self.tokenizer.keyWord()
         elif type == Token_Types.symbol:
             value = self.tokenizer.symbol()
+        raise Exception("Received '" + value +
+                        "' which is not the expected string: '" + string + "'")
 
-        if value != string:
-            raise Exception("Received '" + value +
-                            "' which is not the expected string: '" + string + "'")
-        # assert value == string
-        self.tokenizer.advance()
+    def match(self, string):
+        """
+        Eats the current token only if it is the given string (keyword or symbol).
+        Nothing is raised when it is not, so optional parts of the grammar are probed
+        with this instead of eat().
+        :param string: the possible string.
+        :return: whether the token was eaten
+        """
+        if self.tokenizer.matches(string):
+            self.advance()
+            return True
+        return False
+
+    def report(self, error):
+        """
+        Records an error found at the current token. Only the first error found at a
+        token is kept, as the rest follow from it
+        :param error: the exception that was raised
+        """
+        token = self.tokenizer.cur_token
+        offset = token[1] if token is not None else 0
+        if offset == self.__last_error:
+            return
+        self.__last_error = offset
+        self.errors.append(error_message(self.input_file, self.tokenizer, error))
+
+    def recover(self, error, start, stop_words, in_class=False):
+        """
+        Reports an error and skips tokens until the parser can go on, which is after
+        the next ';', or before the next '}' or one of the stop words. A '{' is skipped
+        together with its whole block.
+        :param error: the exception that was raised
+        :param start: position of the token the failed element started at
+        :param stop_words: keywords an element can start with
+        :param in_class: skipping class members, where a '}' only ends the class if it
+        is the last token
+        :raise EOFError: there is nothing left to go on with
+        """
+        self.report(error)
+        tokenizer = self.tokenizer
+        if tokenizer.cur_pos == start:
+            # Nothing was read, so skip at least the token the error is in
+            if not tokenizer.has_more_tokens():
+                raise EOFError()
+            tokenizer.advance()
+
+        depth = 0
+        while True:
+            kind = tokenizer.token_type()
+            value = tokenizer.cur_val
+            if depth == 0:
+                if kind == Token_Types.keyword and value in stop_words:
+                    return
+                if kind == Token_Types.symbol and value == '}' and \
+                        not (in_class and tokenizer.has_more_tokens()):
+                    return
+            if kind == Token_Types.symbol:
+                if value == '{':
+                    depth += 1
+                elif value == '}' and depth:
+                    depth -= 1
+                elif value == ';' and not depth:
+                    if tokenizer.has_more_tokens():
+                        tokenizer.advance()
+                    return
+            if not tokenizer.has_more_tokens():
+                raise EOFError()
+            tokenizer.advance()
 
     def compile_class_var_dec(self):
         """
         Compiles a static declaration or a field declaration.
         """
-        # self.write("classVarDec", True)
-        # self.num_spaces += 1
+        self.open_xml("classVarDec")
 
         # First word is static or field.
 
@@ -171,7 +499,7 @@ class CompilationEngine():
             raise Exception("Cant compile class variable declaration without static of "
                             "field." + var_kind)
         # self.write("<keyword> " + var_sort + " </keyword>")
-        self.tokenizer.advance()
+        self.advance()
 
         # Second word is type.
         if self.tokenizer.token_type() == Token_Types.keyword:
@@ -187,7 +515,7 @@ class CompilationEngine():
         else:
             raise Exception("Cant compile class variable declaration with invalid identifier type.")
 
-        self.tokenizer.advance()
+        self.advance()
 
         # Third and so on, are variables names.
         # if self.tokenizer.token_type() != Token_Types.identifier:
@@ -195,39 +523,28 @@ class CompilationEngine():
 
         # assert self.tokenizer.token_type() == Token_Types.identifier
         # self.write("<identifier> " + self.tokenizer.identifier() + " </identifier>")
-        var_name = self.tokenizer.identifier()
+        var_name = self.tokenizer.identifier_id()
 
-        self.tokenizer.advance()
+        self.advance()
 
         self.symbol_table.define(var_name, var_type, var_kind)
         self.possible_varName(var_type, var_kind)
 
         # It will always end with ';'
         self.eat(';')
-        # self.write("<symbol> ; </symbol>")
-
-        # self.num_spaces -= 1
-        # self.write("classVarDec", True, True)
+        self.close_xml("classVarDec")
 
     def possible_varName(self, var_type, var_kind):
         """
         Compile 0 or more variable names, after an existing variable name.
         """
-        try:
-            self.eat(',')
-        except:
-            # There is no varName
-            return
-        # There is a varName
-        # self.write("<symbol> , </symbol>")
-        # if self.tokenizer.token_type() != Token_Types.identifier:
-        #     raise Exception("Cant compile (class or not) variable declaration without varName" +
-        #                     " identifier after ',' .")
-
-        # self.write("<identifier> " + self.tokenizer.identifier() + " </identifier>")
-        self.symbol_table.define(self.tokenizer.identifier(), var_type, var_kind)
-        self.tokenizer.advance()
-        self.possible_varName(var_type, var_kind)
+        while self.match(','):
+            # There is a varName
+            # if self.tokenizer.token_type() != Token_Types.identifier:
+            #     raise Exception("Cant compile (class or not) variable declaration without varName" +
+            #                     " identifier after ',' .")
+            self.symbol_table.define(self.tokenizer.identifier_id(), var_type, var_kind)
+            self.advance()
 
 # Subroutine Compilation logic ---------------------------------------------------------
 
@@ -238,6 +555,7 @@ class CompilationEngine():
         """
 
         self.symbol_table.start_subroutine()
+        self.open_xml("subroutineDec")
 
         subroutine_type = self.tokenizer.keyWord()
 
@@ -257,11 +575,15 @@ class CompilationEngine():
 
         self.eat(')')
 
+        self.open_xml("subroutineBody")
         self.eat('{')
 
         # Compiles all the var decelerations so we know how many locals this function
         # defines
         self.compile_var_declarations()
+        self.constants = {}
+        if self.folder is not None and not self.tokenizer.streaming:
+            self.single_assignments = self.__single_assignments()
 
         # Finally we can declare the function
         self.writer.write_function(name, self.symbol_table.var_count("local"))
@@ -275,6 +597,8 @@ class CompilationEngine():
         self.compile_subroutine_body()
 
         self.eat('}')
+        self.close_xml("subroutineBody")
+        self.close_xml("subroutineDec")
 
     def compile_constructor(self):
         """
@@ -290,13 +614,13 @@ class CompilationEngine():
 
         self.cur_func_type = self.class_name
 
-        self.tokenizer.advance()
+        self.advance()
         # self.eat("new")
         func_name = self.tokenizer.identifier()
 
         func_name = self.class_name + "." + func_name
 
-        self.tokenizer.advance()
+        self.advance()
 
         # return func_name
 
@@ -316,7 +640,8 @@ class CompilationEngine():
         """
         self.eat("method")
 
-        self.symbol_table.define("this", self.class_name, "argument")
+        self.symbol_table.define(self.identifiers.intern("this"), self.class_name,
+                                 "argument")
         self.writer.write_push(ARGS, 0)
         self.writer.write_pop(POINTER, 0)
 
@@ -342,11 +667,11 @@ class CompilationEngine():
         else:
             self.cur_func_type = self.tokenizer.identifier()
 
-        self.tokenizer.advance()
+        self.advance()
 
         func_name = self.class_name + "." + self.tokenizer.identifier()
 
-        self.tokenizer.advance()
+        self.advance()
         return func_name
 
     def compile_var_declarations(self):
@@ -356,42 +681,63 @@ class CompilationEngine():
         """
         t_type = self.tokenizer.token_type()
         while t_type != Token_Types.symbol:
-            token = self.tokenizer.keyWord()
-            if token == 'var':
-                self.compile_var_dec()
-            elif token in STATEMENTS:
-                break
-            else:
-                raise KeyError("an unknown step inside a subroutine, ", t_type)
+            start = self.tokenizer.cur_pos
+            try:
+                token = self.tokenizer.keyWord()
+                if token == 'var':
+                    self.compile_var_dec()
+                elif token in STATEMENTS:
+                    break
+                else:
+                    raise KeyError("an unknown step inside a subroutine,", token)
+            except EOFError:
+                raise
+            except Exception as error:
+                self.recover(error, start, VAR_DEC_SYNC)
             t_type = self.tokenizer.token_type()
 
 
-    def compile_subroutine_body(self):
+    def __single_assignments(self):
         """
+        Finds the variables that the rest of the subroutine, up to the '}' that closes
+        it, assigns in exactly one let statement
+        :return: set of interned name IDs
+        """
+        tokenizer = self.tokenizer
+        kinds, starts, ends, ids, text = tokenizer.kinds, tokenizer.starts, \
+            tokenizer.ends, tokenizer.ids, tokenizer.text
+        counts, depth = {}, 1
+        for pos in range(tokenizer.cur_pos, tokenizer.num_tokens - 1):
+            kind = kinds[pos]
+            if kind == SYMBOL:
+                char = text[starts[pos]]
+                if char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if not depth:
+                        break
+            elif kind == KEYWORD and kinds[pos + 1] == IDENTIFIER and \
+                    text[starts[pos]:ends[pos]] == 'let':
+                counts[ids[pos + 1]] = counts.get(ids[pos + 1], 0) + 1
+        return frozenset(name_id for name_id, count in counts.items() if count == 1)
 
+    def compile_subroutine_body(self):
+        """
+        Compiles the statements of a subroutine, including return
         :return:
         """
         t_type = self.tokenizer.token_type()
-        while t_type != Token_Types.symbol:
-            token = self.tokenizer.keyWord()
-            if token == 'var':
-                self.compile_var_dec()
-            elif token in STATEMENTS:
-                # Direct control over return case. This may be unnecessary
-                if token == "return":
-                    self.compile_return()
-                else:
-                    self.compile_statements()
-            else:
-                raise KeyError("an unknown step inside a subroutine, ", t_type)
-            # self.tokenizer.advance()
-            t_type = self.tokenizer.token_type()
+        if t_type != Token_Types.symbol and self.tokenizer.keyWord() not in STATEMENTS:
+            raise KeyError("an unknown step inside a subroutine, ", t_type)
+        self.compile_statements()
 
     def compile_param_list(self):
         """
         Compiles a parameter list, which may be empty, not including the "()"
         :return:
         """
+        self.open_xml("parameterList")
         t_type = self.tokenizer.token_type()
         finished = t_type == Token_Types.symbol and self.tokenizer.symbol() == ")"
         while not finished:
@@ -402,11 +748,11 @@ class CompilationEngine():
                 var_type = self.tokenizer.identifier()
             else:
                 raise KeyError("Got some weird type in paramlist: " + t_type.value)
-            self.tokenizer.advance()
+            self.advance()
 
             # Write var name
-            var_name = self.tokenizer.identifier()
-            self.tokenizer.advance()
+            var_name = self.tokenizer.identifier_id()
+            self.advance()
 
             # Add the variable as an argument to the symbol table
             self.symbol_table.define(var_name, var_type, ARGS)
@@ -417,6 +763,7 @@ class CompilationEngine():
             else:
                 self.eat(',')
                 t_type = self.tokenizer.token_type()
+        self.close_xml("parameterList")
 
     def compile_var_dec(self):
         """
@@ -424,6 +771,7 @@ class CompilationEngine():
         :return:
         """
         # First word is valid.
+        self.open_xml("varDec")
         self.eat('var')
 
         # Second word is type.
@@ -431,22 +779,23 @@ class CompilationEngine():
             var_type = self.tokenizer.keyWord()
             if var_type not in ["int", "char", "boolean"]:
                 raise Exception("Cant compile variable declaration with invalid keyword type.")
-            self.tokenizer.advance()
+            self.advance()
         elif self.tokenizer.token_type() == Token_Types.identifier:
             var_type = self.tokenizer.identifier()
-            self.tokenizer.advance()
+            self.advance()
         else:
             raise Exception("Cant compile variable declaration with invalid identifier type.")
 
         # Third and so on, are variables names.
-        var_name = self.tokenizer.identifier()
+        var_name = self.tokenizer.identifier_id()
         # Add the variable as an local to the symbol table
         self.symbol_table.define(var_name, var_type, LOCAL)
-        self.tokenizer.advance()
+        self.advance()
         self.possible_varName(var_type, LOCAL)
 
         # It will always end with ';'
         self.eat(';')
+        self.close_xml("varDec")
 
 # End of Subroutine Compilation logic ---------------------------------------------------
 
@@ -460,44 +809,44 @@ class CompilationEngine():
         # statement = self.tokenizer.keyWord()
         # if statement not in ['let', 'if', 'while', 'do', 'return']:
         #     return
-        # self.write("statements", True)
-        # self.num_spaces += 1
-
-        self.possible_single_statement()
-
-        # self.num_spaces -= 1
-        # self.write("statements", True, True)
+        self.open_xml("statements")
+        self.nesting += 1
+        try:
+            self.possible_single_statement()
+        finally:
+            self.nesting -= 1
+        self.close_xml("statements")
 
     def possible_single_statement(self):
         """
         Compile 0 or more single statements..
         """
-        if (self.tokenizer.token_type() == Token_Types.keyword and
+        while (self.tokenizer.token_type() == Token_Types.keyword and
                     self.tokenizer.keyWord() in STATEMENTS):
-
-        # if self.tokenizer.keyWord() in STATEMENTS:
             statement = self.tokenizer.keyWord()
-            # self.write(statement + "Statement", True)
-            if statement == 'let':
-                self.compile_let()
-            elif statement == 'if':
-                self.compile_if()
-            elif statement == 'while':
-                self.compile_while()
-            elif statement == 'do':
-                self.compile_do()
-            elif statement == 'return':
-                self.compile_return()
-            # else:
-            #     raise Exception("Invalid statement.")
-            # self.write(statement + "Statement", True, True)
-            self.possible_single_statement()
+            start = self.tokenizer.cur_pos
+            try:
+                if statement == 'let':
+                    self.compile_let()
+                elif statement == 'if':
+                    self.compile_if()
+                elif statement == 'while':
+                    self.compile_while()
+                elif statement == 'do':
+                    self.compile_do()
+                elif statement == 'return':
+                    self.compile_return()
+            except EOFError:
+                raise
+            except Exception as error:
+                self.recover(error, start, STATEMENT_SYNC)
 
     def compile_do(self):
         """
         Compile do statement.
         :return:
         """
+        self.open_xml("doStatement")
         self.eat('do')
 
 
@@ -512,9 +861,10 @@ class CompilationEngine():
         # get variable / class name
         num_of_expressions = 0
         call_apparatus = self.tokenizer.identifier()
-        self.tokenizer.advance()
+        call_id = self.tokenizer.identifier_id()
+        self.advance()
         self.subroutineCall_continue(call_apparatus, self.symbol_table.index_of(
-            call_apparatus) != None)
+            call_id) != None, call_id)
         # self.tokenizer.advance()  #todo: advance here or not?
         # If we encountered a variable or class name   (class.subroutine)
         # if self.tokenizer.lookahead("."):
@@ -552,34 +902,50 @@ class CompilationEngine():
         self.eat(';')
         # self.writer.write_call(call_apparatus, num_of_expressions)
         self.writer.write_pop("temp", 0)
+        self.close_xml("doStatement")
 
 
     def compile_let(self):
         """
         Compile let statement.
         """
+        self.open_xml("letStatement")
         self.eat('let')
         # self.num_spaces += 1
         # self.write("<keyword> let </keyword>")
-        symbol = self.tokenizer.identifier()
-        segment = self.symbol_table.kind_of(symbol)
-        index = self.symbol_table.index_of(symbol)
+        symbol = self.tokenizer.identifier_id()
+        entry = self.symbol_table.lookup(symbol)
+        if entry is None:
+            # Nothing to assign to, but the rest of the statement can still be checked
+            self.report(KeyError("Undefined variable '" + self.tokenizer.identifier() +
+                                 "'."))
+        segment, index = (entry[KIND], entry[NUM]) if entry else (None, None)
         # if segment == "field":
         #     # Using 'this'
         #     self.writer.write_push(POINTER, 0)
         #     self.writer.write_push(THIS, index)
         # elif segment:
         #     self.writer.write_push(segment, index)
-        self.tokenizer.advance()
+        self.advance()
 
         used_eq = self.possible_array(symbol)
+        value = None
         if not used_eq:
             self.eat('=')
             self.compile_expression()
+            if segment == LOCAL and self.nesting == 1 and \
+                    symbol in self.single_assignments:
+                # Every statement after this one runs after it, and nothing else
+                # assigns the local, so they can all use the value
+                value = self.folder.top_constant()
 
         self.eat(';')
-        segment = THIS if segment == 'field' else segment
-        self.writer.write_pop(segment, index)
+        if entry is not None:
+            segment = THIS if segment == 'field' else segment
+            self.writer.write_pop(segment, index)
+            if value is not None:
+                self.constants[symbol] = value
+        self.close_xml("letStatement")
         # self.write("<symbol> ; </symbol>")
         # self.num_spaces -= 1
         # self.write("</letStatement>")
@@ -587,10 +953,9 @@ class CompilationEngine():
     def possible_array(self, symbol):
         """
         Compile 0 or 1 array.
+        :param symbol: interned name ID of the array variable
         """
-        try:
-            self.eat('[')
-        except:
+        if not self.match('['):
             # There is no array
             return False
         # # There is an array
@@ -600,7 +965,8 @@ class CompilationEngine():
         # # self.write("<symbol> ] </symbol>")
         # Handling an array
         # Pushing the array name
-        kind, index = self.symbol_table.kind_of(symbol), self.symbol_table.index_of(symbol)
+        entry = self.symbol_table.lookup(symbol)
+        kind, index = (entry[KIND], entry[NUM]) if entry else (None, None)
         if kind == "field":
             # Using 'this'
             self.writer.write_push(POINTER, 0)
@@ -610,11 +976,19 @@ class CompilationEngine():
 
         self.compile_expression()
         self.eat(']')
+        if self.folder is not None:
+            offset = write_array_index(self.writer)
+            if not self.match('='):
+                self.writer.write_pop(POINTER, 1)
+                self.writer.write_push(THAT, offset)
+                return False
+            value_start = len(self.writer.current())
+            self.compile_expression()
+            write_array_store(self.writer, value_start, offset)
+            return True
         self.writer.write_arithmetic('add')
 
-        try:
-            self.eat('=')
-        except Exception:
+        if not self.match('='):
             self.writer.write_pop(POINTER, 1)
             self.writer.write_push(THAT, 0)
             return False
@@ -631,8 +1005,13 @@ class CompilationEngine():
         """
         Compile while statement.
         """
+        self.open_xml("whileStatement")
         self.eat('while')
         label_loop, label_continue = self.__gen_while_label()
+        if self.folder is not None:
+            self.__compile_rotated_while(label_loop)
+            self.close_xml("whileStatement")
+            return
         self.writer.write_label(label_loop)
         self.eat('(')
 
@@ -647,12 +1026,42 @@ class CompilationEngine():
 
         self.writer.write_goto(label_loop)
         self.writer.write_label(label_continue)
+        self.close_xml("whileStatement")
+
+    def __compile_rotated_while(self, label_loop):
+        """
+        Compiles the rest of a while statement with its condition tested at the bottom
+        of the loop, so that every iteration takes a single jump back on it, taken when
+        the condition is true (see write_if_true). The loop is entered by a jump to
+        the test. The code of the condition is taken out when
+        it is compiled, and written again after the statements.
+        :param label_loop: the label of the statements
+        """
+        label_test = "WHILE_TEST" + str(self.__label_counter[WHILE])
+        self.writer.write_goto(label_test)
+        self.writer.write_label(label_loop)
+        function = self.writer.current()
+        start = len(function)
+        self.eat('(')
+        self.compile_expression()
+        self.eat(')')
+        condition = function.commands(start)
+        function.delete(start)
+
+        self.eat('{')
+        self.compile_statements()
+        self.eat('}')
+
+        self.writer.write_label(label_test)
+        self.writer.write_code(condition)
+        write_if_true(self.writer, label_loop)
 
 
     def compile_return(self):
         """
         Compile return statement.
         """
+        self.open_xml("returnStatement")
         self.eat('return')
         # self.num_spaces += 1
         # self.write("<keyword> return </keyword>")
@@ -660,14 +1069,12 @@ class CompilationEngine():
         if self.cur_func_type == "void":
             self.writer.write_push(CONSTANT, 0)
             self.eat(';')
-        else:
-            try:
-                self.eat(';')
-            except:  # would it work?
-                self.compile_expression()
-                self.eat(';')
+        elif not self.match(';'):
+            self.compile_expression()
+            self.eat(';')
 
         self.writer.write_return()
+        self.close_xml("returnStatement")
 
         # self.write("<symbol> ; </symbol>")
         # self.num_spaces -= 1
@@ -678,14 +1085,18 @@ class CompilationEngine():
         Compile if statement.
         """
         true_label, false_label, cont_label = self.__gen_if_label()
+        self.open_xml("ifStatement")
         self.eat('if')
 
         self.eat('(')
         self.compile_expression()
         self.eat(')')
-        self.writer.write_if(true_label)
-        self.writer.write_goto(false_label)
-        self.writer.write_label(true_label)
+        if self.folder is None:
+            self.writer.write_if(true_label)
+            self.writer.write_goto(false_label)
+            self.writer.write_label(true_label)
+        else:
+            write_if_false(self.writer, false_label)
 
         self.eat('{')
         self.compile_statements()
@@ -700,9 +1111,11 @@ class CompilationEngine():
                 self.compile_statements()
                 self.eat('}')
                 self.writer.write_label(cont_label)
+                self.close_xml("ifStatement")
                 return
         # else:
         self.writer.write_label(false_label)
+        self.close_xml("ifStatement")
 
     # def possible_else(self):
     #     """
@@ -723,36 +1136,40 @@ class CompilationEngine():
     #     self.eat('}')
 
 
-    def compile_expression(self, from_op_term=False):
+    def compile_expression(self):
         """
-        Compile an expression.
+        Compile an expression. Terms and operators are read in a single loop and the
+        operators wait on a stack until an operator that binds looser comes along, so
+        every operator is looked up once in the operator table and nothing recurses
+        per term. In Jack all operators bind the same and the expression is computed
+        from left to right, unless the engine uses conventional precedence.
         :return:
         """
-
-        if self.tokenizer.token_type() == Token_Types.symbol:
-            if self.tokenizer.symbol() == '(':
-                # There is an open bracket
-                self.tokenizer.advance()
-                self.compile_expression()
-                self.eat(")")
-                # if self.tokenizer.token_type() == Token_Types.symbol: # maybe use eat
-                #     if self.tokenizer.symbol() == ')':
-                #         self.tokenizer.advance()
-                # else:
-                #     raise Exception("There more '(' than ')', while compiling expression.")
-
-                if not from_op_term:
-                    self.possible_op_term()
-                return
-
-        # There is no open bracket
+        self.open_xml("expression")
         self.compile_term()
-        self.possible_op_term()
+        operators = self.binary_operators
+        pending = []
+        while self.tokenizer.token_type() == Token_Types.symbol:
+            operator = operators.get(self.tokenizer.symbol())
+            if operator is None:
+                break
+            precedence = operator[0]
+            while pending and pending[-1][0] >= precedence:
+                pending.pop()[1]()
+            pending.append(operator)
+            self.advance()
+            self.compile_term()
+        while pending:
+            pending.pop()[1]()
+        self.close_xml("expression")
 
-    def subroutineCall_continue(self, func, is_method):
+    def subroutineCall_continue(self, func, is_method, func_id=None):
         """
         After an identifier there can be a '.' or '(', otherwise it not function call
         (subroutineCall).
+        :param func: name of the identifier before the call
+        :param is_method: whether the identifier is an object the method is called on
+        :param func_id: interned name ID of that identifier
         :return:
         """
         # should i check every time if it's type symbol?
@@ -767,19 +1184,18 @@ class CompilationEngine():
         elif symbol == '.':
             self.eat('.')
             if is_method:
-                object = func  # The object name
-                segment, index = self.symbol_table.kind_of(object), self.symbol_table.index_of(object)
+                # The object name
+                obj_type, segment, index = self.symbol_table.lookup(func_id)
                 # what is happening if the kind is field?
                 if segment == "field":
                     self.writer.write_push(POINTER, 0)
                     segment = THIS
                 self.writer.write_push(segment, index)
                 num_exp += 1
-                func = self.symbol_table.type_of(object) + "." + \
-                       self.tokenizer.identifier()
+                func = obj_type + "." + self.tokenizer.identifier()
             else:   # is class function
                 func += "." + self.tokenizer.identifier()
-            self.tokenizer.advance()
+            self.advance()
 
             self.eat('(')
             num_exp += self.compile_expression_list()
@@ -801,21 +1217,24 @@ class CompilationEngine():
         :return:
         """
         type = self.tokenizer.token_type()
+        self.open_xml("term")
 
         # If the token is a int_const
         if type == Token_Types.int_const :
             self.writer.write_push(CONSTANT, self.tokenizer.intVal())
-            self.tokenizer.advance()
+            self.advance()
 
         # If the token is a string_const
         elif type == Token_Types.string_const:
             str_const = self.tokenizer.stringVal()
-            self.writer.write_push(CONSTANT, len(str_const)) # len(str_const) - 1
-            self.writer.write_call(BuiltinFunctions.str_new.value, 1)
-            for i in range(len(str_const)):
-                self.writer.write_push(CONSTANT, ord(str_const[i]))
-                self.writer.write_call(BuiltinFunctions.str_app_char.value, 2)
-            self.tokenizer.advance()
+            if self.pool_strings:
+                index = self.__pooled_string(str_const)
+                self.__label_counter[STRING] += 1
+                write_pooled_string(self.writer, str_const, index,
+                                    "STRING_BUILT" + str(self.__label_counter[STRING]))
+            else:
+                write_string(self.writer, str_const)
+            self.advance()
 
         # If the token is a keyword
         elif type == Token_Types.keyword:
@@ -829,42 +1248,51 @@ class CompilationEngine():
                 self.writer.write_push(POINTER, 0)
             else:
                 raise Exception()
-            self.tokenizer.advance()
+            self.advance()
 
         # If the token is an identifier
         elif type == Token_Types.identifier:
-            name = self.tokenizer.identifier()
-            kind, index = self.symbol_table.kind_of(name), self.symbol_table.index_of(name)
+            name, name_id = self.tokenizer.identifier(), self.tokenizer.identifier_id()
+            entry = self.symbol_table.lookup(name_id)
+            kind, index = (entry[KIND], entry[NUM]) if entry else (None, None)
             if kind == "field":
                 # Using 'this'
                 # self.writer.write_push(POINTER, 0)
                 self.writer.write_push(THIS, index)
+            elif kind == LOCAL and name_id in self.constants:
+                self.folder.write_constant(self.constants[name_id])
             elif kind:
                 self.writer.write_push(kind, index)
+            elif self.tokenizer.peek() not in CALL_SYMBOLS:
+                # Not a variable, so it can only be the class or subroutine of a call
+                self.report(KeyError("Undefined variable '" + name + "'."))
 
             is_object = True if index else False
-            self.tokenizer.advance()
-            self.possible_identifier_continue(name, is_object)
+            self.advance()
+            self.possible_identifier_continue(name, is_object, name_id)
 
         # If the token is an symbol
         elif type == Token_Types.symbol:
-            if self.tokenizer.symbol() == '(':
-                self.compile_expression()
-            elif self.tokenizer.symbol() in ["-", "~"]:
-                # self.write("<symbol> " + self.tokenizer.symbol() + " </symbol>", use_buffer=True)
-                self.eat(self.tokenizer.symbol())
-                # self.write("<symbol> " + self.tokenizer.symbol() + " </symbol>")
+            symbol = self.tokenizer.symbol()
+            if symbol == '(':
+                self.advance()
                 self.compile_expression()
-                command = "neg" if self.tokenizer.symbol() == "-" else "not"
-                self.writer.write_arithmetic(command)
+                self.eat(')')
+            elif symbol in UNARY_COMMANDS:
+                self.advance()
+                self.compile_term()
+                if self.folder is None:
+                    self.writer.write_arithmetic(UNARY_COMMANDS[symbol])
+                else:
+                    self.folder.write_unary(symbol, UNARY_COMMANDS[symbol])
             else:
-                # self.cleanbuffer()
-                raise Exception()
+                raise Exception("'" + symbol + "' can not start a term.")
 
         else:
             raise Exception("Invalid token for creating term.")
+        self.close_xml("term")
 
-    def possible_identifier_continue(self, identifier_val, is_obj):
+    def possible_identifier_continue(self, identifier_val, is_obj, identifier_id=None):
         """
         In a term if identifier continues with
         - '[' - it's a call of an array
@@ -878,153 +1306,41 @@ class CompilationEngine():
                 self.eat('[')
                 self.compile_expression() # do i nead to make sure it's not const string?
                 self.eat(']')
-                self.writer.write_arithmetic('add')
-
-                try:
-                    self.eat('=')
-                except Exception:
-                    self.writer.write_pop(POINTER, 1)
-                    self.writer.write_push(THAT, 0)
+                if self.folder is not None:
+                    write_array_read(self.writer)
                     return
-
-                # Handling A[a] = B[b] situation
-                self.compile_expression()
-                self.writer.write_pop(TEMP, 0)
+                self.writer.write_arithmetic('add')
                 self.writer.write_pop(POINTER, 1)
-                self.writer.write_push(TEMP, 0)
-                self.writer.write_pop(THAT, 0)
+                self.writer.write_push(THAT, 0)
                 return
 
-            try:
-                self.subroutineCall_continue(identifier_val, is_obj)
-            except Exception:
-                # raise Exception("If there is a symbol in the token it have to be . or [ or (.")
-                return
-
-    def possible_op_term(self):
-        """
-        If the next token is a suitable operation symbol than compile more terms,
-        otherwise return nothing.
-        """
-        # There is no op term
-        if self.tokenizer.token_type() != Token_Types.symbol:
-            return
-        op = self.tokenizer.symbol()
-        if op not in OPERANDS:
-            return
-
-        # There is op term
-        self.tokenizer.advance()
-        if self.tokenizer.token_type() == Token_Types.symbol:
-            if self.tokenizer.symbol() == '(':
-                self.compile_expression(True)
-            else:
-                raise Exception("There was '" + self.tokenizer.symbol() +
-                                "' after a valid operator symbol '" + op + "'.")
-        else:
-            self.compile_term()
-
-        self.handle_op(op)
-        self.possible_op_term()
-
-    def handle_op(self, op):
-        if op == '+':
-            self.writer.write_arithmetic('add')
-        elif op == '-':
-            self.writer.write_arithmetic('sub')
-        elif op == '*':
-            self.writer.write_call(BuiltinFunctions.math_mult.value, 2)
-        elif op == '/':
-            self.writer.write_call(BuiltinFunctions.math_div.value, 2)
-        elif op == '=':
-            self.writer.write_arithmetic('eq')
-        elif op == '&gt;':
-            self.writer.write_arithmetic('gt')
-        elif op == '&lt;':
-            self.writer.write_arithmetic('lt')
-        elif op == '&amp;':
-            self.writer.write_arithmetic('and')
-        elif op == '|':
-            self.writer.write_arithmetic('or')
-        else:
-            raise Exception(op + " is an invalid operation between 2 terms.") # wont happen according to the current use
+            if self.tokenizer.symbol() in ('.', '('):
+                self.subroutineCall_continue(identifier_val, is_obj, identifier_id)
 
     def compile_expression_list(self):
         """
         Compile a comma-separated list of expressions, which may be empty.
         """
-        try:
+        self.open_xml("expressionList")
+        # An empty list is known by its closing bracket
+        if self.tokenizer.matches(')'):
+            num_exp = 0
+        else:
             self.compile_expression()
-        except Exception:
-            return 0
-
-        return self.possible_more_expression() + 1
-
-    # def possible_more_expression(self, exp_count):
-    #     return self.possible_more_expression() + 1
-    #     # self.num_spaces -= 1
-    #     # self.write("expressionList", True, True)
-
+            num_exp = self.possible_more_expression() + 1
+        self.close_xml("expressionList")
+        return num_exp
 
     def possible_more_expression(self):
         """
-        If the next token is a ',' than compile more expressions,
-        otherwise return nothing.
-        """
-        try:
-            self.eat(',')
-        except Exception:
-            return 0
-
-        self.compile_expression()
-        return self.possible_more_expression() + 1
-
-
-#-------------------------------------------------------------------------------------
-    def write(self, statement, delim = False, end = False, new_line=True,
-              no_space = False, use_buffer=False):
-        """
-
-        :param statement:
-        :return:
-        """
-        if use_buffer:
-            self.output.write(self.buffer)
-            self.buffer = ""
-        if end:
-            statement = "/" + statement
-        if delim:
-            statement = "<" + statement + ">"
-        if not no_space:
-            statement = SPACE * self.num_spaces + statement
-        if new_line:
-            statement += END_LINE
-
-
-        self.output.write(statement)
-
-        # if delim:
-        #     self.output.write(TAB * self.num_spaces + "<" + statement + ">")
-        # else:
-
-        # if new_line:
-        #     self.output.write(END_LINE)
-
-    def write_terminal(self, t_type, arg):
-        """
-
-        :param t_type:
-        :param arg:
-        :return:
+        While the next token is a ',' compile more expressions.
+        :return: the number of expressions compiled
         """
-        self.write(t_type, delim=True, new_line=False, no_space=False)
-        self.write(" " + arg + " ", delim=False, new_line=False, no_space=True)
-        self.write(t_type, delim=True, new_line=True, end=True, no_space=True)
-
-    def cleanbuffer(self):
-        self.num_spaces -= 1
-        self.buffer = ""
-
+        num_exp = 0
+        while self.match(','):
+            self.compile_expression()
+            num_exp += 1
+        return num_exp
 
 
     # def write_recursive(self, name, advance_lim=1):
@@ -1132,6 +1448,24 @@ class CompilationEngine():
     #     else:
     #         self.write_recursive(type)
 
+    def __gen_operator_table(self, precedence):
+        """
+        Maps every binary operator symbol to its precedence and a function writing its
+        VM code
+        :param precedence: use the conventional precedence instead of Jack's
+        """
+        table = {}
+        for op, command in OP_COMMANDS.items():
+            table[op] = (PRECEDENCE[op] if precedence else JACK_PRECEDENCE,
+                         partial(self.writer.write_arithmetic, command))
+        for op, func in OP_CALLS.items():
+            table[op] = (PRECEDENCE[op] if precedence else JACK_PRECEDENCE,
+                         partial(self.writer.write_call, func, 2))
+        if self.folder is not None:
+            table = {op: (binds, partial(self.folder.write_binary, op, write))
+                     for op, (binds, write) in table.items()}
+        return table
+
     def __gen_while_label(self):
         self.__label_counter[WHILE] += 1
         return ("WHILE_LOOP" + str(self.__label_counter[WHILE]), "WHILE_CONT" + str(
@@ -1144,7 +1478,92 @@ class CompilationEngine():
             self.__label_counter[IF]), "IF_CONT" + str(self.__label_counter[IF]))
 
     def __reset_label_counter(self):
-        self.__label_counter = [0, 0]
+        self.__label_counter = [0, 0, 0]
 
+    def __pooled_string(self, string):
+        """
+        Returns the static a string constant of the class is pooled in, defining it if
+        the constant is new to the class
+        :return: int, index of the static
+        """
+        name_id = self.identifiers.intern(POOLED_STRING_NAME.format(string))
+        entry = self.symbol_table.lookup(name_id)
+        if entry is None:
+            self.symbol_table.define(name_id, POOLED_STRING_TYPE, "static")
+            entry = self.symbol_table.lookup(name_id)
+        return entry[NUM]
 
 
+def write_string(writer, string):
+    """
+    Writes the code that builds a new string of a string constant
+    :param writer: VMWriter
+    """
+    writer.write_push(CONSTANT, len(string))
+    writer.write_call(BuiltinFunctions.str_new.value, 1)
+    for char in string:
+        writer.write_push(CONSTANT, ord(char))
+        writer.write_call(BuiltinFunctions.str_app_char.value, 2)
+
+
+def write_pooled_string(writer, string, index, label):
+    """
+    Writes the code of a pooled string constant: the string is built into its static
+    the first time, when the static is still 0, as no object is at address 0. After
+    that it is only pushed
+    :param index: index of the static of the constant
+    :param label: a new label, that the code jumps to once the string is built
+    """
+    writer.write_push("static", index)
+    writer.write_if(label)
+    write_string(writer, string)
+    writer.write_pop("static", index)
+    writer.write_label(label)
+    writer.write_push("static", index)
+
+
+# The file the worker processes of a parallel compilation compile the subroutines of,
+# with its tokenizer. They are set up once, when the worker starts
+_worker_file = None
+
+
+def error_message(input_file, tokenizer, error):
+    """
+    Makes the message of an error found at the current token of a tokenizer
+    :param error: the exception that was raised
+    :return: "file:line:column: message" string
+    """
+    token = tokenizer.cur_token
+    offset = token[1] if token is not None else 0
+    if isinstance(error, IndexError):
+        # Only running out of tokens raises it
+        message = "Unexpected end of file."
+    else:
+        message = " ".join(str(arg) for arg in error.args)
+    if not message and token is not None:
+        message = "Unexpected {} '{}'.".format(tokenizer.cur_type.value,
+                                              tokenizer.cur_val)
+    line, column = line_and_column(tokenizer.text, offset)
+    return "{}:{}:{}: {}".format(input_file, line, column, message)
+
+
+def _init_worker(input_file, tokens, options):
+    """
+    :param options: the keyword arguments of the CompilationEngine that change the code
+    """
+    global _worker_file
+    _worker_file = (input_file, JackTokenizer(input_file, tokens=tokens), options)
+
+
+def _compile_subroutine(pos, class_name, class_symbols, label_counter):
+    """
+    Compiles one subroutine in a worker process, see CompilationEngine.compile_class
+    :return: (VM code as exported by VMWriter, errors, label counts at the end of the
+    subroutine)
+    """
+    input_file, tokenizer, options = _worker_file
+    writer = VMWriter.VMWriter(None)
+    engine = CompilationEngine(input_file, writer, tokenizer=tokenizer, **options,
+                               subroutine_of=(
+                                   pos, class_name, class_symbols, label_counter))
+    return writer.export(), engine.errors, engine.label_counter
@@ -1,6 +1,9 @@
 """
 
 """
+from array import array
+from bisect import bisect_left
+from collections import deque
 from enum import Enum, unique
 
 import re
@@ -48,14 +51,6 @@ class Key_Words(Enum):
 
 KEYWORDS = [key.value.lower() for key in Key_Words]
 
-def gen_keywords():
-    conc_str = ''
-    for key in KEYWORDS:
-
-        conc_str += key + "\\s|"
-
-    return conc_str[:-1]
-
 def gen_symbols():
     conc_str = ''
     for symbol in symbols:
@@ -90,62 +85,328 @@ symbols = {
 INT_CONST_MIN = 0
 INT_CONST_MAX = 32767
 
-class Comp_Exp(Enum):
+KEYWORDS_SET = frozenset(KEYWORDS)
+
+# All the token rules folded into one pattern. Keywords are not a rule of their own:
+# they are whole words that are found in KEYWORDS. Only the opening of a comment is
+# matched here, its end is searched for by the scanner so no backtracking can happen.
+TOKEN_PATTERN = re.compile("|".join([
+    r"(?P<comment>\/[\/*])",
+    r'(?P<string>"(?:(?:\\")|(?:[^"]))*")',
+    "(?P<symbol>" + gen_symbols() + ")",
+    r"(?P<int>\d+)",
+    r"(?P<word>\w+)",
+    r"(?P<space>\s+)",
+]))
+
+
+# Compact codes for the token types, as kept in the token store. The string-const
+# offsets exclude the surrounding "" symbols. A symbol is carried as its raw character,
+# which is a shared single character string.
+TOKEN_TYPES = list(Token_Types)
+KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST = range(len(TOKEN_TYPES))
+
+# How many tokens ahead of the current one can be looked at in streaming mode
+LOOKAHEAD_WINDOW = 8
+
+# Bumped whenever the scanning rules or the token store change, so that token streams
+# cached by an older version are never used
+TOKENIZER_VERSION = 1
+
+
+def scan(text, pos=0):
+    """
+    Scans the source text in a single pass. A position cursor is moved over the text
+    and each step is decided by one match of the combined token pattern, so the source
+    is never re-sliced and lexing stays linear in the file size.
+    :param text: jack source code
+    :param pos: offset to start scanning from
+    :return: generator of (type code, start offset, end offset) tuples
     """
+    end = len(text)
+    match = TOKEN_PATTERN.match
+    while pos < end:
+        m = match(text, pos)
+        if m is None:
+            line, column = line_and_column(text, pos)
+            raise ValueError("found impossible situation at line {}, column {}: {!r}"
+                             .format(line, column, text[pos:pos + 20]))
+        kind = m.lastgroup
+        start, pos = pos, m.end()
+
+        if kind == 'word':
+            # Keywords are recognized as whole words, so "return;" or "this." come
+            # out as keywords just like "class "
+            if text[start:pos] in KEYWORDS_SET:
+                yield KEYWORD, start, pos
+            else:
+                yield IDENTIFIER, start, pos
+
+        elif kind == 'symbol':
+            yield SYMBOL, start, pos
+
+        elif kind == 'int':
+            yield INT_CONST, start, pos
+
+        elif kind == 'string':
+            yield STRING_CONST, start + 1, pos - 1
+
+        elif kind == 'comment':
+            pos = skip_comment(text, start)
+
+        # Anything else is white space and is skipped
 
+
+def skip_comment(text, start):
+    """
+    Finds the end of the "//", "/* */" or "/** */" comment that opens at start. Only
+    a plain search for the closing characters is made, which is linear in the length
+    of the comment.
+    :param text: jack source code
+    :param start: offset of the opening "/"
+    :return: offset right after the comment
     """
-    single_line_comment = re.compile("(\/\/.*)")
-    doc_string = re.compile("(\/\*\*((([^*])*([^/])*)|(([^/])*([^*])*))\*\/)")
-    # comment = re.compile("((\/\/.*)|(\/\*\*((([^*])*([^/])*)|(([^/])*([^*])*))\*\/))")
-    string_single_line = re.compile("(\"((\\\\\")|([^\"]))*\")")
-    keywords = re.compile(gen_keywords())
-    symbols = re.compile(gen_symbols())
-    floats = re.compile("((\d+\.\d+)|(\d+))")
-    ints = re.compile("\d+")
-    identifiers = re.compile("\w+")
-    spaces = re.compile("(\s+\n?)+")
+    if text[start + 1] == '/':
+        end = text.find('\n', start + 2)
+        return len(text) if end < 0 else end
+
+    end = text.find('*/', start + 2)
+    if end < 0:
+        line, column = line_and_column(text, start)
+        raise ValueError("Unterminated comment starting at line {}, column {}"
+                         .format(line, column))
+    return end + 2
+
+
+def line_and_column(text, offset):
+    """
+    Translates an offset in the text to a line and column, both counted from 1
+    :return: (line, column)
+    """
+    line = text.count('\n', 0, offset) + 1
+    column = offset - text.rfind('\n', 0, offset)
+    return line, column
+
+
+class IdentifierTable():
+    """
+    Interns identifier names for a whole compilation. Every distinct name is kept once
+    and given a running integer ID, which the symbol table uses as its key.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        """
+        Returns the ID of the given name, adding it to the table if it is new
+        :param name: string
+        :return: int
+        """
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def name(self, name_id):
+        """
+        Returns the shared name object of the given ID
+        """
+        return self.names[name_id]
+
+    def __len__(self):
+        return len(self.names)
 
 
 class JackTokenizer():
     """
+    Tokens are kept in a compact store of parallel arrays: a type code, a start
+    offset and an end offset per token. Token values are sliced out of the source
+    text only when one of the accessors asks for them.
 
+    In streaming mode no store is built. Tokens are pulled from the scanner on demand
+    into a small lookahead window, so the parser starts working right away and the
+    memory used for tokens stays flat however big the class is.
     """
-    def __init__(self, inputFile):
+    def __init__(self, inputFile, streaming=False, window=LOOKAHEAD_WINDOW,
+                 identifiers=None, cache=None, tokens=None):
         """
         Opens the input file/stream and gets ready to tokenize it
         :param inputFile:
+        :param streaming: pull tokens lazily instead of storing all of them
+        :param window: in streaming mode, the farthest lookahead that can be asked for
+        :param identifiers: IdentifierTable shared by the compilation. A new one is
+        made if not given
+        :param cache: TokenCache to load the token store from, and save it to when the
+        file was not cached yet. Not used in streaming mode
+        :param tokens: a token store of the file to take instead of scanning it, as
+        (kinds, starts, ends, local ids, names) in the form kept by the cache
         """
         with open(inputFile, 'r') as self.file:
             self.text = self.file.read()
 
-        # remove comments and save the result for parsing
-        # self.text = Comp_Exp.comment.value.sub(" ", temp)
+        self.streaming = streaming
+        self.window = window
+        self.identifiers = IdentifierTable() if identifiers is None else identifiers
+
+        if streaming:
+            self.scanner = scan(self.text)
+            self.upcoming = deque()
+        else:
+            entry = tokens
+            if entry is None and cache is not None:
+                entry = cache.load(self.text)
+            if entry is not None:
+                self._load_cached(*entry)
+            else:
+                self.kinds = array('B')
+                self.starts = array('I')
+                self.ends = array('I')
+                self.ids = array('I')
+                self._store(scan(self.text), self.kinds, self.starts, self.ends,
+                            self.ids)
+                if cache is not None:
+                    cache.save(self.text, *self.token_store())
+            self.num_tokens = len(self.kinds)
+
+        self.cur_pos = -1
+        self.cur_token = None
+        self.cur_id = None
+        self._cur_val = None
+
+    def _store(self, tokens, kinds, starts, ends, ids):
+        """
+        Appends scanned tokens to the given store columns, interning identifiers. The
+        ID column holds 0 for tokens that are not identifiers
+        """
+        text, intern = self.text, self.identifiers.intern
+        for kind, start, end in tokens:
+            kinds.append(kind)
+            starts.append(start)
+            ends.append(end)
+            ids.append(intern(text[start:end]) if kind == IDENTIFIER else 0)
+
+    def _load_cached(self, kinds, starts, ends, local_ids, names):
+        """
+        Takes the store columns of a cached token stream, translating its local
+        identifier IDs into IDs of this compilation
+        """
+        intern = self.identifiers.intern
+        mapping = [0] + [intern(name) for name in names]
+        self.kinds, self.starts, self.ends = kinds, starts, ends
+        self.ids = array('I', map(mapping.__getitem__, local_ids))
+
+    def _local_ids(self):
+        """
+        Numbers the identifiers of this file on their own, as kept in a cached token
+        stream: 0 for tokens that are not identifiers, otherwise the index of the name
+        in the returned names plus 1
+        :return: (array of local ids, list of names)
+        """
+        local_of, names = {}, []
+        local_ids = array('I', bytes(len(self.ids) * self.ids.itemsize))
+        name = self.identifiers.name
+        for i, (kind, name_id) in enumerate(zip(self.kinds, self.ids)):
+            if kind == IDENTIFIER:
+                local_id = local_of.get(name_id)
+                if local_id is None:
+                    names.append(name(name_id))
+                    local_id = local_of[name_id] = len(names)
+                local_ids[i] = local_id
+        return local_ids, names
+
+    def token_store(self):
+        """
+        Returns the token store in the form kept by the cache, which the tokens
+        parameter takes
+        :return: (kinds, starts, ends, local ids, names)
+        """
+        return (self.kinds, self.starts, self.ends) + self._local_ids()
 
-        # Generator object that retrieves tokens one at a time
-        self.token_gen = self.token_gen()
+    @property
+    def cur_type(self):
+        """
+        The type of the current token
+        """
+        if self.cur_token is None:
+            return None
+        return TOKEN_TYPES[self.cur_token[0]]
 
-        # A helping bool value for calibrating has-more and advance
-        self.wait = False
+    @property
+    def cur_val(self):
+        """
+        The value of the current token, sliced from the source once per token
+        """
+        if self._cur_val is None and self.cur_token is not None:
+            if self.cur_id is not None:
+                self._cur_val = self.identifiers.name(self.cur_id)
+            else:
+                self._cur_val = self.token_value(self.cur_token)
+        return self._cur_val
 
-        self.cur_type, self.cur_val = None, None
+    def token_value(self, token):
+        """
+        Returns the value of a (type code, start, end) token
+        :return: string
+        """
+        kind, start, end = token
+        if kind == SYMBOL:
+            return self.text[start]
+        if kind == IDENTIFIER:
+            return self.identifiers.name(self.identifiers.intern(self.text[start:end]))
+        return self.text[start:end]
+
+    def token_at(self, i):
+        """
+        Returns the i'th token of the store as a (type code, start, end) tuple
+        """
+        return self.kinds[i], self.starts[i], self.ends[i]
 
-        self.tokens = list(self.token_gen)
+    def value(self, i):
+        """
+        Returns the value of the i'th token of the store
+        :param i: token index
+        :return: string
+        """
+        return self.token_value(self.token_at(i))
 
-        self.cur_pos = -1
+    def token_gen(self):
+        """
+        Retrieves the tokens one at a time
+        :return: generator of (Token_Types, value) tuples
+        """
+        if self.streaming:
+            tokens = scan(self.text)
+        else:
+            tokens = (self.token_at(i) for i in range(self.num_tokens))
+        for token in tokens:
+            yield TOKEN_TYPES[token[0]], self.token_value(token)
+
+    def _peek(self, steps):
+        """
+        Streaming mode only. Fills the lookahead window with up to steps tokens
+        :return: the number of upcoming tokens available
+        """
+        if steps > self.window:
+            raise ValueError("Cannot look {} tokens ahead in streaming mode, the window "
+                             "is {}".format(steps, self.window))
+        upcoming = self.upcoming
+        while len(upcoming) < steps:
+            token = next(self.scanner, None)
+            if token is None:
+                break
+            upcoming.append(token)
+        return len(upcoming)
 
     def has_more_tokens(self):
         """
         Any more tokens in input?
         :return: bool
         """
-        return self.cur_pos < len(self.tokens) - 1
-
-        try:
-            self.cur_type, self.cur_val = self.token_gen.__next__()
-            self.wait = True
-            return True
-        except StopIteration:
-            return False
+        if self.streaming:
+            return self._peek(1) > 0
+        return self.cur_pos < self.num_tokens - 1
 
     def advance(self):
         """
@@ -154,13 +415,28 @@ class JackTokenizer():
         :return:
         """
         self.cur_pos += 1
-        self.cur_type, self.cur_val = self.tokens[self.cur_pos]
-        return
-
-        if self.wait:
-            self.wait = False
+        self.cur_id = None
+        if self.streaming:
+            self._peek(1)
+            kind, start, end = self.cur_token = self.upcoming.popleft()
+            if kind == IDENTIFIER:
+                self.cur_id = self.identifiers.intern(self.text[start:end])
         else:
-            self.cur_type, self.cur_val = self.token_gen.__next__()
+            self.cur_token = self.token_at(self.cur_pos)
+            if self.cur_token[0] == IDENTIFIER:
+                self.cur_id = self.ids[self.cur_pos]
+        self._cur_val = None
+
+    def seek(self, pos):
+        """
+        Makes the pos'th token of the store the current one. Not available in
+        streaming mode
+        :param pos: token index
+        """
+        if self.streaming:
+            raise ValueError("Cannot seek in streaming mode")
+        self.cur_pos = pos - 1
+        self.advance()
 
     def token_type(self):
         """
@@ -195,6 +471,15 @@ class JackTokenizer():
         assert self.cur_type is Token_Types.identifier
         return self.cur_val
 
+    def identifier_id(self):
+        """
+        Returns the interned ID of the current identifier. Only called when token_type
+        is IDENTIFIER
+        :return: int
+        """
+        assert self.cur_id is not None
+        return self.cur_id
+
     def intVal(self):
         """
         Returns an int value representing current token. Only called when token_type is
@@ -213,85 +498,123 @@ class JackTokenizer():
         assert self.cur_type is Token_Types.string_const
         return self.cur_val
 
-    def token_gen(self):
+    def edit(self, start, old_length, new_text):
+        """
+        Applies an edit to the source text and re-lexes only the region it affects,
+        splicing the new tokens into the store. The tokenizer is rewound to before the
+        first token.
+
+        Scanning restarts right after the last token that ends before the edit, as the
+        scanner carries no state between tokens. It stops as soon as a new token past
+        the edit starts where an old token started, since from there on the old and
+        new texts are the same. A string or comment that the edit opens or closes just
+        delays that point.
+        :param start: offset of the edit in the current text
+        :param old_length: number of characters replaced
+        :param new_text: the replacing string
+        :return: (index of the first re-lexed token, number of tokens removed,
+        number of tokens inserted)
         """
+        if self.streaming:
+            raise ValueError("Cannot edit the source of a streaming tokenizer")
+        if start < 0 or old_length < 0 or start + old_length > len(self.text):
+            raise ValueError("Edit of {} characters at offset {} is out of the source "
+                             "range".format(old_length, start))
+
+        text = self.text[:start] + new_text + self.text[start + old_length:]
+        delta = len(new_text) - old_length
+        edit_end = start + len(new_text)
+        kinds, starts, ends = self.kinds, self.starts, self.ends
+        num_tokens = self.num_tokens
+
+        # Keep every token that ends strictly before the edit, as a token right at it
+        # might be extended. A string token ends one character after its value.
+        first = bisect_left(ends, start)
+        if first and kinds[first - 1] == STRING_CONST and ends[first - 1] + 1 >= start:
+            first -= 1
+
+        # A string that ends with a backslash was only closed after its pattern ran to
+        # the end of the text looking for an unescaped '"', so it depends on all the
+        # text after it, including the edit
+        escaped_quote = self.text.find('\\"', 0, start)
+        while escaped_quote >= 0:
+            i = bisect_left(ends, escaped_quote + 1)
+            if i >= first:
+                break
+            if ends[i] == escaped_quote + 1 and kinds[i] == STRING_CONST:
+                first = i
+                break
+            escaped_quote = self.text.find('\\"', escaped_quote + 1, start)
+
+        pos = 0
+        if first:
+            pos = ends[first - 1] + (kinds[first - 1] == STRING_CONST)
+
+        new_tokens = []
+        old = first
+        for kind, tok_start, tok_end in scan(text, pos):
+            if tok_start - (kind == STRING_CONST) >= edit_end:
+                old_start = tok_start - delta
+                while old < num_tokens and starts[old] < old_start:
+                    old += 1
+                if old < num_tokens and starts[old] == old_start and kinds[old] == kind:
+                    break
+            new_tokens.append((kind, tok_start, tok_end))
+        else:
+            old = num_tokens
+        resync = old
+
+        tail_starts, tail_ends = starts[resync:], ends[resync:]
+        if delta:
+            tail_starts = array('I', [offset + delta for offset in tail_starts])
+            tail_ends = array('I', [offset + delta for offset in tail_ends])
+
+        self.text = text
+        new_kinds, new_starts, new_ends, new_ids = (array('B'), array('I'), array('I'),
+                                                    array('I'))
+        self._store(new_tokens, new_kinds, new_starts, new_ends, new_ids)
+        self.kinds = kinds[:first] + new_kinds + kinds[resync:]
+        self.starts = starts[:first] + new_starts + tail_starts
+        self.ends = ends[:first] + new_ends + tail_ends
+        self.ids = self.ids[:first] + new_ids + self.ids[resync:]
+        self.num_tokens = len(self.kinds)
 
-        :return:
+        self.cur_pos = -1
+        self.cur_token = None
+        self.cur_id = None
+        self._cur_val = None
+        return first, resync - first, len(new_tokens)
+
+    def matches(self, value):
+        """
+        Checks whether the current token is the given keyword or symbol, without
+        consuming it or making its value
+        :param value: keyword or symbol string
+        :return: bool
         """
-        # while True:
-        while self.text:
-            # In case of a token match, we yield it and substitute it from what is left
-            # of the current line being read
-            comment_match = Comp_Exp.single_line_comment.value.match(self.text)
-            # todo: needs good comment implementation and testing
-            if comment_match:
-                self.text = self.text[comment_match.end():]
-                continue
-
-            docstring_match = Comp_Exp.doc_string.value.match(self.text)
-            if docstring_match:
-                self.text = self.text[docstring_match.end():]
-                continue
-
-            string_match = Comp_Exp.string_single_line.value.match(self.text)
-
-            # Found a full string in what is left of the current line.
-            # Note the string-const values have their "" symbols left out.
-            if string_match:
-                yield (Token_Types.string_const, string_match.group(0)[1:-1])
-                self.text = self.text[string_match.end():]
-                continue
-
-            keyword_match = Comp_Exp.keywords.value.match(self.text) #self.cur_line)
-            if keyword_match:
-                # remove space
-                yield (Token_Types.keyword, keyword_match.group(0)[:-1])
-                self.text = self.text[keyword_match.end():]
-                continue
-
-            symbols_match = Comp_Exp.symbols.value.match(self.text)
-            if symbols_match:
-                symbol = symbols_match.group(0)
-                if symbol == '<':
-                    symbol = '&lt;'
-                elif symbol == '>':
-                    symbol = '&gt;'
-                elif symbol == '\"': # its a '"' symbol. the \ is an escape char
-                    symbol = '&quot;'
-                elif symbol == '&':
-                    symbol = '&amp;'
-                yield (Token_Types.symbol, symbol)
-                self.text = self.text[symbols_match.end():]
-                continue
-
-            int_match = Comp_Exp.ints.value.match(self.text)
-            if int_match:
-                yield (Token_Types.int_const, int_match.group(0))
-                self.text = self.text[int_match.end():]
-                continue
-
-            identifier_match = Comp_Exp.identifiers.value.match(self.text)
-            if identifier_match:
-                word = identifier_match.group(0)
-
-                # Here they may be a special case where a keyword was found without a
-                # space after it, such as "return;". In this case this identifier
-                # should rather be categorized at keyword, even though it previously
-                # did not match
-                if word in KEYWORDS:
-                    yield (Token_Types.keyword, identifier_match.group(0))
-                else:
-                    yield (Token_Types.identifier, identifier_match.group(0))
-                self.text = self.text[identifier_match.end():]
-                continue
-
-            space_match = Comp_Exp.spaces.value.match(self.text)
-            if space_match:
-                self.text = self.text[space_match.end():]
-                continue
+        token = self.cur_token
+        if token is None:
+            return False
+        kind, start, end = token
+        return (kind <= SYMBOL and end - start == len(value) and
+                self.text.startswith(value, start))
 
-            else:
-                raise StopIteration("found impossible situation: " + self.text)
+    def peek(self, steps=1):
+        """
+        Returns a token ahead of the current one, without consuming anything. In
+        streaming mode steps is bounded by the lookahead window
+        :param steps: how far ahead to look, 1 is the next token
+        :return: (Token_Types, value) or None if there are not enough tokens
+        """
+        if self.streaming:
+            if self._peek(steps) < steps:
+                return None
+            token = self.upcoming[steps - 1]
+        else:
+            if self.cur_pos + steps >= self.num_tokens:
+                return None
+            token = self.token_at(self.cur_pos + steps)
+        return TOKEN_TYPES[token[0]], self.token_value(token)
 
     def lookahead(self, token, steps = 1):
         """
@@ -303,9 +626,14 @@ class JackTokenizer():
         :return: True or False, if the symbol is within the number of steps,
         as an individual token
         """
-        trunc = min(len(self.tokens), self.cur_pos + steps + 1)
+        if self.streaming:
+            available = min(steps, self._peek(steps))
+            return any(token == self.token_value(self.upcoming[i])
+                       for i in range(available))
+
+        trunc = min(self.num_tokens, self.cur_pos + steps + 1)
         for i in range(self.cur_pos + 1, trunc):
-            if token == self.tokens[i][1]:
+            if token == self.value(i):
                 return True
         return False
 
@@ -0,0 +1,366 @@
+"""
+This class parses a jack file into an abstract syntax tree (see AST) instead of compiling
+it on the go, so the whole of every class is known before any VM code is written. It
+accepts the same language as the CompilationEngine, and the CodeGenerator writes the
+same VM code from its tree.
+"""
+
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import JackTokenizer, Token_Types
+from JackCompiler.SyntaxAnalyzer.CompilationEngine import STATEMENTS, ROUTINES, \
+    KEY_TERMS, UNARY_COMMANDS, PRECEDENCE, JACK_PRECEDENCE, error_message
+from JackCompiler.SyntaxAnalyzer.AST import *
+
+VAR_TYPES = ["int", "char", "boolean"]
+
+
+class Parser():
+    """
+
+    """
+
+    def __init__(self, input_file, streaming=False, identifiers=None, cache=None,
+                 precedence=False):
+        """
+        Parses the given file. Its classes are then found in self.classes. There is
+        no recovery from errors: the first one stops the parse, and is recorded in
+        self.errors as a "file:line:column: message" string, as in the
+        CompilationEngine
+        :param input_file:
+        :param streaming: tokenize lazily while parsing, see JackTokenizer
+        :param identifiers: IdentifierTable shared by the whole compilation
+        :param cache: TokenCache of token streams, see JackTokenizer
+        :param precedence: order expressions by the conventional operator precedence
+        instead of Jack's left to right order
+        """
+        self.classes = []
+        self.errors = []
+        try:
+            self.tokenizer = JackTokenizer(input_file, streaming=streaming,
+                                           identifiers=identifiers, cache=cache)
+        except ValueError as error:
+            # The message already holds the position
+            self.errors.append(input_file + ": " + str(error))
+            return
+        self.identifiers = self.tokenizer.identifiers
+        self.precedence = {op: PRECEDENCE[op] if precedence else JACK_PRECEDENCE
+                           for op in PRECEDENCE}
+        try:
+            while self.tokenizer.has_more_tokens():
+                self.tokenizer.advance()
+                if self.tokenizer.keyWord() == 'class':
+                    self.classes.append(self.parse_class())
+                else:
+                    raise KeyError("Received a token that does not fit the beginning "
+                                   "of a module. " + self.tokenizer.keyWord()
+                                   + " in " + input_file)
+        except Exception as error:
+            self.errors.append(error_message(input_file, self.tokenizer, error))
+
+    def eat(self, string):
+        """
+        If the given string is the current token (only if it keyword or symbol) the
+        tokenizer is advanced, otherwise an exception is raised.
+        :param string: the expected string.
+        """
+        if not self.match(string):
+            raise Exception("Received '" + str(self.tokenizer.cur_val) +
+                            "' which is not the expected string: '" + string + "'")
+
+    def match(self, string):
+        """
+        Eats the current token only if it is the given string (keyword or symbol)
+        :return: whether the token was eaten
+        """
+        if self.tokenizer.matches(string):
+            self.tokenizer.advance()
+            return True
+        return False
+
+    def parse_type(self, is_var=False):
+        """
+        Reads a type, a keyword or a class name
+        :param is_var: the type of a variable, so the only keywords allowed are VAR_TYPES
+        :return: string
+        """
+        if self.tokenizer.token_type() == Token_Types.keyword:
+            var_type = self.tokenizer.keyWord()
+            if is_var and var_type not in VAR_TYPES:
+                raise Exception("Cant compile variable declaration with invalid keyword "
+                                "type." + var_type)
+        else:
+            var_type = self.tokenizer.identifier()
+        self.tokenizer.advance()
+        return var_type
+
+    def parse_names(self):
+        """
+        Reads one or more comma separated variable names
+        :return: list of names
+        """
+        names = [self.tokenizer.identifier()]
+        self.tokenizer.advance()
+        while self.match(','):
+            names.append(self.tokenizer.identifier())
+            self.tokenizer.advance()
+        return names
+
+# Class parsing logic --------------------------------------------------------------------
+
+    def parse_class(self):
+        """
+        Parses a complete class. Like the CompilationEngine, it stops on the closing '}'
+        :return: Class
+        """
+        self.eat('class')
+        self.class_name = self.tokenizer.identifier()
+        self.tokenizer.advance()
+        self.eat('{')
+
+        members = []
+        while self.tokenizer.token_type() != Token_Types.symbol:
+            operation = self.tokenizer.keyWord()
+            if operation in ['static', 'field']:
+                members.append(self.parse_class_var_dec())
+            elif operation in ROUTINES:
+                members.append(self.parse_subroutine())
+            else:
+                raise KeyError("Found statement that does not fit class declaration. ",
+                               operation)
+        return Class(self.class_name, members)
+
+    def parse_class_var_dec(self):
+        """
+        Parses a static declaration or a field declaration.
+        :return: ClassVarDec
+        """
+        var_kind = self.tokenizer.keyWord()
+        self.tokenizer.advance()
+        var_type = self.parse_type(is_var=True)
+        names = self.parse_names()
+        self.eat(';')
+        return ClassVarDec(var_kind, var_type, names)
+
+    def parse_subroutine(self):
+        """
+        Parses a complete method, function or constructor
+        :return: Subroutine
+        """
+        kind = self.tokenizer.keyWord()
+        self.tokenizer.advance()
+        if kind == "constructor":
+            assert self.tokenizer.identifier() == self.class_name
+        self.return_type = self.parse_type()
+        name = self.tokenizer.identifier()
+        self.tokenizer.advance()
+
+        self.eat('(')
+        params = []
+        if not self.tokenizer.matches(')'):
+            params.append((self.parse_type(), self.tokenizer.identifier()))
+            self.tokenizer.advance()
+            while self.match(','):
+                params.append((self.parse_type(), self.tokenizer.identifier()))
+                self.tokenizer.advance()
+        self.eat(')')
+
+        self.eat('{')
+        local_vars = []
+        while self.match('var'):
+            var_type = self.parse_type(is_var=True)
+            local_vars.extend((var_type, var_name) for var_name in self.parse_names())
+            self.eat(';')
+        if self.tokenizer.token_type() != Token_Types.symbol and \
+                self.tokenizer.keyWord() not in STATEMENTS:
+            raise KeyError("an unknown step inside a subroutine, ",
+                           self.tokenizer.token_type())
+        statements = self.parse_statements()
+        self.eat('}')
+        return Subroutine(kind, self.return_type, name, params, local_vars, statements)
+
+# Statement parsing logic ----------------------------------------------------------------
+
+    def parse_statements(self):
+        """
+        Parses a sequence of 0 or more statements, not including the "{}".
+        :return: tuple of statement nodes
+        """
+        statements = []
+        while self.tokenizer.token_type() == Token_Types.keyword:
+            statement = self.tokenizer.keyWord()
+            if statement == 'let':
+                statements.append(self.parse_let())
+            elif statement == 'if':
+                statements.append(self.parse_if())
+            elif statement == 'while':
+                statements.append(self.parse_while())
+            elif statement == 'do':
+                statements.append(self.parse_do())
+            elif statement == 'return':
+                statements.append(self.parse_return())
+            else:
+                break
+        return tuple(statements)
+
+    def parse_let(self):
+        self.eat('let')
+        name = self.tokenizer.identifier()
+        self.tokenizer.advance()
+        index = None
+        if self.match('['):
+            index = self.parse_expression()
+            self.eat(']')
+        self.eat('=')
+        value = self.parse_expression()
+        self.eat(';')
+        return Let(name, index, value)
+
+    def parse_if(self):
+        self.eat('if')
+        condition = self.parse_condition()
+        statements = self.parse_block()
+        else_statements = self.parse_block() if self.match('else') else None
+        return If(condition, statements, else_statements)
+
+    def parse_while(self):
+        self.eat('while')
+        condition = self.parse_condition()
+        return While(condition, self.parse_block())
+
+    def parse_do(self):
+        self.eat('do')
+        name = self.tokenizer.identifier()
+        self.tokenizer.advance()
+        if self.tokenizer.token_type() != Token_Types.symbol or \
+                self.tokenizer.symbol() not in ('.', '('):
+            raise Exception("If there is a symbol in the subroutineCall it have to be . "
+                            "or (.")
+        call = self.parse_call(name)
+        self.eat(';')
+        return Do(call)
+
+    def parse_return(self):
+        """
+        Parses a return statement. As in the CompilationEngine, a void subroutine can
+        only return nothing
+        """
+        self.eat('return')
+        value = None
+        if self.return_type == "void":
+            self.eat(';')
+        elif not self.match(';'):
+            value = self.parse_expression()
+            self.eat(';')
+        return Return(value)
+
+    def parse_condition(self):
+        """
+        Parses the "(expression)" of an if or while statement
+        """
+        self.eat('(')
+        condition = self.parse_expression()
+        self.eat(')')
+        return condition
+
+    def parse_block(self):
+        """
+        Parses the "{statements}" of an if or while statement
+        """
+        self.eat('{')
+        statements = self.parse_statements()
+        self.eat('}')
+        return statements
+
+# Expression parsing logic ---------------------------------------------------------------
+
+    def parse_expression(self):
+        """
+        Parses an expression into postfix order. Operators wait on a stack until an
+        operator that binds looser comes along, as in CompilationEngine.compile_expression
+        :return: Expression
+        """
+        items = [self.parse_term()]
+        precedences = self.precedence
+        pending = []
+        while self.tokenizer.token_type() == Token_Types.symbol:
+            op = self.tokenizer.symbol()
+            precedence = precedences.get(op)
+            if precedence is None:
+                break
+            while pending and precedences[pending[-1]] >= precedence:
+                items.append(pending.pop())
+            pending.append(op)
+            self.tokenizer.advance()
+            items.append(self.parse_term())
+        pending.reverse()
+        items.extend(pending)
+        return Expression(tuple(items))
+
+    def parse_term(self):
+        """
+        Parses a term. After an identifier a single look-ahead token, "[", "(" or ".",
+        decides between a variable, an array entry and a subroutine call.
+        :return: term node
+        """
+        type = self.tokenizer.token_type()
+        if type == Token_Types.int_const:
+            term = IntConst(int(self.tokenizer.intVal()))
+            self.tokenizer.advance()
+
+        elif type == Token_Types.string_const:
+            term = StringConst(self.tokenizer.stringVal())
+            self.tokenizer.advance()
+
+        elif type == Token_Types.keyword:
+            word = self.tokenizer.keyWord()
+            if word not in KEY_TERMS:
+                raise Exception("'" + word + "' can not start a term.")
+            term = KeywordConst(word)
+            self.tokenizer.advance()
+
+        elif type == Token_Types.identifier:
+            name = self.tokenizer.identifier()
+            self.tokenizer.advance()
+            term = Var(name)
+            if self.tokenizer.token_type() == Token_Types.symbol:
+                symbol = self.tokenizer.symbol()
+                if symbol == '[':
+                    self.tokenizer.advance()
+                    term = ArrayRef(name, self.parse_expression())
+                    self.eat(']')
+                elif symbol in ('.', '('):
+                    term = self.parse_call(name)
+
+        elif type == Token_Types.symbol:
+            symbol = self.tokenizer.symbol()
+            if symbol == '(':
+                self.tokenizer.advance()
+                term = self.parse_expression()
+                self.eat(')')
+            elif symbol in UNARY_COMMANDS:
+                self.tokenizer.advance()
+                term = Unary(symbol, self.parse_term())
+            else:
+                raise Exception("'" + symbol + "' can not start a term.")
+
+        else:
+            raise Exception("Invalid token for creating term.")
+        return term
+
+    def parse_call(self, name):
+        """
+        Parses the rest of a subroutine call after its first identifier, which is
+        followed by '(' or '.'
+        :return: Call
+        """
+        target = None
+        if self.match('.'):
+            target, name = name, self.tokenizer.identifier()
+            self.tokenizer.advance()
+        self.eat('(')
+        args = []
+        if not self.tokenizer.matches(')'):
+            args.append(self.parse_expression())
+            while self.match(','):
+                args.append(self.parse_expression())
+        self.eat(')')
+        return Call(target, name, tuple(args))
@@ -0,0 +1,167 @@
+"""
+An on-disk cache of token streams, so that files which did not change are not lexed
+again on the next run.
+
+Every entry holds the token store columns of one source text in a compact binary form.
+Its file name is a hash of the source and of the tokenizer version, so an entry can
+only ever be found for the exact text and scanning rules it was made from. Identifier
+IDs are kept local to the entry, along with the names they stand for, as the
+IdentifierTable of a run is not known in advance.
+
+An entry that cannot be read or does not pass its checksum is treated as missing and
+is overwritten. Old entries are evicted by age and by the total size of the cache.
+"""
+
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import TOKENIZER_VERSION
+
+FILE_EXTENSION_CACHE = '.tok'
+
+MAGIC = b'JTOK'
+# magic, tokenizer version, offset item size, number of tokens, names length, crc32
+HEADER = struct.Struct('<4sHBIII')
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+class TokenCache():
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 version=TOKENIZER_VERSION):
+        """
+        Opens a cache directory, creating it if needed, and evicts old entries
+        :param directory: path of the cache directory
+        :param max_bytes: the total size the cache is trimmed down to
+        :param max_age: entries not used for this many seconds are removed
+        :param version: tokenizer version, part of every key
+        """
+        self.directory = directory
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def path_of(self, text):
+        """
+        Returns the path of the entry of the given source text
+        """
+        digest = hashlib.sha1(text.encode('utf-8', 'surrogatepass'))
+        digest.update(struct.pack('<H', self.version) + sys.byteorder.encode())
+        return os.path.join(self.directory, digest.hexdigest() + FILE_EXTENSION_CACHE)
+
+    def load(self, text):
+        """
+        Looks up the token store of a source text
+        :param text: jack source code
+        :return: (kinds, starts, ends, local ids, names) or None if there is no valid
+        entry. A local id is 0 for tokens that are not identifiers, and otherwise the
+        index in names plus 1
+        """
+        path = self.path_of(text)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            entry = self._decode(data)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            return None
+        if entry is None:
+            return None
+        # Mark the entry as used, so eviction by size drops the least recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _decode(self, data):
+        """
+        Unpacks an entry, returning None if it does not match this cache
+        """
+        magic, version, itemsize, num_tokens, names_length, crc = \
+            HEADER.unpack_from(data)
+        kinds, starts, ends, ids = array('B'), array('I'), array('I'), array('I')
+        if magic != MAGIC or version != self.version or itemsize != starts.itemsize:
+            return None
+        payload = memoryview(data)[HEADER.size:]
+        if len(payload) != num_tokens * (1 + 3 * itemsize) + names_length or \
+                zlib.crc32(payload) != crc:
+            return None
+
+        pos = 0
+        for column, width in ((kinds, 1), (starts, itemsize), (ends, itemsize),
+                              (ids, itemsize)):
+            column.frombytes(payload[pos:pos + num_tokens * width])
+            pos += num_tokens * width
+        names = bytes(payload[pos:]).decode('utf-8').split('\n') if names_length else []
+        return kinds, starts, ends, ids, names
+
+    def save(self, text, kinds, starts, ends, ids, names):
+        """
+        Writes the token store of a source text into the cache. Failing to write is not
+        an error, the entry is simply not cached
+        :param ids: local ids, see load()
+        :param names: the identifier names the local ids stand for
+        """
+        names_bytes = '\n'.join(names).encode('utf-8')
+        payload = b''.join([kinds.tobytes(), starts.tobytes(), ends.tobytes(),
+                            ids.tobytes(), names_bytes])
+        header = HEADER.pack(MAGIC, self.version, starts.itemsize, len(kinds),
+                             len(names_bytes), zlib.crc32(payload))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        except OSError:
+            return
+        try:
+            # Written aside and moved into place, so a reader never sees half an entry
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_path, self.path_of(text))
+        except OSError:
+            self._remove(tmp_path)
+
+    def evict(self):
+        """
+        Removes the entries that were not used for max_age seconds, then the least
+        recently used ones until the cache fits in max_bytes
+        :return: number of entries removed
+        """
+        now = time.time()
+        entries, removed = [], 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(FILE_EXTENSION_CACHE):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                removed += self._remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
@@ -0,0 +1,152 @@
+"""
+This class writes the xml output of the syntax analyzer: the token stream of a file or
+its full parse tree.
+
+The output is streamed. Lines are collected into a small batch which is written in one
+call once it is full, so memory stays bounded however big the file is. All the tag
+strings are computed once.
+"""
+
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import Token_Types
+
+NEW_LINE = "\n"
+SPACE = "  "
+
+# Number of lines collected before they are written to the file
+BATCH_SIZE = 4096
+
+# Characters that have to be escaped inside xml text. '&' goes first, so that the '&' of
+# the escapes written for the others is not escaped again
+XML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}
+ESCAPED_TYPES = (Token_Types.symbol, Token_Types.string_const)
+
+TERMINAL_TAGS = {t_type: ("<" + t_type.value + "> ", " </" + t_type.value + ">" + NEW_LINE)
+                 for t_type in Token_Types}
+
+# Keywords and symbols are few, so their whole lines are kept once made
+CACHED_TYPES = (Token_Types.keyword, Token_Types.symbol)
+
+
+def escape(value):
+    """
+    Escapes the xml special characters of a string
+    """
+    if len(value) == 1:
+        return XML_ESCAPES.get(value, value)
+    for char, escaped in XML_ESCAPES.items():
+        if char in value:
+            value = value.replace(char, escaped)
+    return value
+
+
+class XMLWriter:
+    def __init__(self, outfile, indent=SPACE, batch_size=BATCH_SIZE):
+        """
+        Creates a new file and prepares it for writing xml
+        :param outfile: output file/stream
+        :param indent: the indentation added for every level of the tree
+        :param batch_size: number of lines written to the file at a time
+        """
+        self.file = open(outfile, 'w')
+        self.indent = indent
+        # Every line is kept as its indentation and its text
+        self.batch_limit = 2 * batch_size
+        self.lines = []
+        self.depth = 0
+        self.indents = [""]
+        self.element_tags = {}
+        self.terminal_lines = {t_type: {} for t_type in CACHED_TYPES}
+
+    def _add(self, line):
+        """
+        Adds a line to the current batch, writing the batch once it is full
+        """
+        lines = self.lines
+        lines.append(self.indents[self.depth])
+        lines.append(line)
+        if len(lines) >= self.batch_limit:
+            self.flush()
+
+    def _tags(self, name):
+        """
+        Returns the opening and closing lines of the named element
+        """
+        tags = self.element_tags.get(name)
+        if tags is None:
+            tags = self.element_tags[name] = ("<" + name + ">" + NEW_LINE,
+                                              "</" + name + ">" + NEW_LINE)
+        return tags
+
+    def open_element(self, name):
+        """
+        Writes the opening tag of a non terminal element and indents its content
+        :param name: element name, such as "class" or "letStatement"
+        """
+        self._add(self._tags(name)[0])
+        self.depth += 1
+        if self.depth == len(self.indents):
+            self.indents.append(self.indents[-1] + self.indent)
+
+    def close_element(self, name):
+        """
+        Writes the closing tag of a non terminal element
+        :param name: element name, such as "class" or "letStatement"
+        """
+        self.depth -= 1
+        self._add(self._tags(name)[1])
+
+    def terminal_line(self, t_type, value):
+        """
+        Returns the xml line of a single token, without indentation
+        :param t_type: Token_Types of the token
+        :param value: raw string value of the token
+        """
+        cache = self.terminal_lines.get(t_type)
+        if cache is not None:
+            line = cache.get(value)
+            if line is None:
+                open_tag, close_tag = TERMINAL_TAGS[t_type]
+                line = cache[value] = open_tag + escape(value) + close_tag
+            return line
+        if t_type in ESCAPED_TYPES:
+            value = escape(value)
+        open_tag, close_tag = TERMINAL_TAGS[t_type]
+        return open_tag + value + close_tag
+
+    def write_terminal(self, t_type, value):
+        """
+        Writes a single token
+        :param t_type: Token_Types of the token
+        :param value: raw string value of the token
+        """
+        self._add(self.terminal_line(t_type, value))
+
+    def write_terminals(self, tokens):
+        """
+        Writes a whole stream of tokens at the current depth
+        :param tokens: iterable of (Token_Types, value) tuples
+        """
+        indent, limit = self.indents[self.depth], self.batch_limit
+        terminal_line = self.terminal_line
+        lines = self.lines
+        for t_type, value in tokens:
+            lines.append(indent)
+            lines.append(terminal_line(t_type, value))
+            if len(lines) >= limit:
+                self.flush()
+                lines = self.lines
+
+    def flush(self):
+        """
+        Writes the current batch to the file
+        """
+        self.file.write("".join(self.lines))
+        self.lines = []
+
+    def close(self):
+        """
+        Writes whatever is left and closes the file
+        :return:
+        """
+        self.flush()
+        self.file.close()
@@ -1,42 +1,182 @@
 """
 This class writes VM commands into a file. It encapsulates the VM command syntax.
 
-Emits VM commands into a file
+Commands are not written one by one as they come. They are recorded in a compact
+in-memory code, integer arrays grouped per function, and the whole file is written at
+once when the writer is closed. Until then, passes can inspect and rewrite the code of
+every function (see VMFunction and add_pass).
 """
 
+from array import array
+
 ARITHMETIC_COMMANDS = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
 SEGMENTS =  ["const", "arg", "local", "static", "this", "that", "pointer", "temp"]
+# The segments as they are written, in the order of their codes
+SEGMENT_NAMES = ["constant", "argument", "local", "static", "this", "that", "pointer",
+                 "temp"]
+SEGMENT_CODES = {segment: code for code, segment in enumerate(SEGMENT_NAMES)}
+
+# Opcodes of the recorded commands. Every arithmetic command has an opcode of its own,
+# ARITHMETIC plus its index in ARITHMETIC_COMMANDS
+PUSH, POP, LABEL, GOTO, IF_GOTO, CALL, FUNCTION, RETURN, ARITHMETIC = range(9)
+ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT = range(ARITHMETIC,
+                                                 ARITHMETIC + len(ARITHMETIC_COMMANDS))
+ARITHMETIC_CODES = {command: ARITHMETIC + i
+                    for i, command in enumerate(ARITHMETIC_COMMANDS)}
+# The VM commands of the opcodes below ARITHMETIC
+COMMAND_NAMES = ["push", "pop", "label", "goto", "if-goto", "call", "function", "return"]
+# The opcodes whose first operand is a name: a label or a function
+NAMED_OPS = frozenset([LABEL, GOTO, IF_GOTO, CALL, FUNCTION])
+# The opcodes whose command ends with their index
+INDEXED_OPS = frozenset([PUSH, POP, CALL, FUNCTION])
+# Opcodes fit in this many bits
+OPCODE_BITS = 5
+# How many values the commands that compute a value take off the stack and put on it,
+# all in all. A call puts one on for the arguments it takes
+STACK_EFFECTS = {PUSH: 1, POP: -1, ADD: -1, SUB: -1, EQ: -1, GT: -1, LT: -1, AND: -1,
+                 OR: -1, NEG: 0, NOT: 0}
 
 NEW_LINE = "\n"
 
+
+def operand_start(command, i):
+    """
+    Finds where the computation of the value that the i'th command leaves on the stack
+    starts, by going back until the commands add up to one value
+    :param command: function that returns the (opcode, arg, index) of a command index
+    :return: index of its first command, or -1 if it can't be told, such as when a
+    label or a jump is on the way
+    """
+    needed = 1
+    while i >= 0:
+        op, arg, index = command(i)
+        effect = 1 - index if op == CALL else STACK_EFFECTS.get(op)
+        if effect is None:
+            return -1
+        needed -= effect
+        if needed == 0:
+            return i
+        i -= 1
+    return -1
+
+
+class VMFunction():
+    """
+    The code of one function: its function command and the commands after it, up to
+    the next function. Every command takes three ints of the code array, its opcode
+    and two operands: push and pop take a segment code and an index, label, goto and
+    if-goto take a name ID, call takes a name ID and the number of arguments, and
+    function a name ID and the number of locals. Unused operands are 0.
+    """
+    __slots__ = ('code',)
+
+    def __init__(self, code=None):
+        self.code = array('i') if code is None else code
+
+    def __len__(self):
+        return len(self.code) // 3
+
+    def commands(self, start=0, stop=None):
+        """
+        :param start, stop: the range of command indices to take, all of them if not
+        given
+        :return: list of (opcode, arg, index) tuples
+        """
+        code = iter(self.code[3 * start:None if stop is None else 3 * stop])
+        return list(zip(code, code, code))
+
+    def command(self, i):
+        """
+        :return: the (opcode, arg, index) tuple of the i'th command
+        """
+        return tuple(self.code[3 * i:3 * i + 3])
+
+    __getitem__ = command
+
+    def delete(self, start, stop=None):
+        """
+        Takes back the commands from start up to stop, or to the end
+        """
+        del self.code[3 * start:None if stop is None else 3 * stop]
+
+    def replace(self, commands):
+        """
+        Replaces the code of the function
+        :param commands: iterable of (opcode, arg, index) tuples
+        """
+        self.code = array('i')
+        for command in commands:
+            self.code.extend(command)
+
+
 class VMWriter:
     def __init__(self, outfile):
         """
         Creates a new file and prepares it for writing
         VM commands
-        :param outfile: output file/stream
+        :param outfile: output file/stream. A stream is written into but not closed.
+        If None, the code is only recorded, for the caller to take (see export)
+        """
+        self.own_file = isinstance(outfile, str)
+        self.file = open(outfile, 'w') if self.own_file else outfile
+        self.names = []
+        self.name_ids = {}
+        self.passes = []
+        # The first group holds the commands before the first function, if any
+        self.functions = []
+        self.__start_function()
+
+    def __start_function(self):
+        """
+        Starts recording into a new function
+        """
+        function = VMFunction()
+        self.functions.append(function)
+        self.emit = function.code.extend
+
+    def intern(self, name):
+        """
+        Returns the ID of a label or function name
+        :param name: string
+        :return: int
+        """
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def name(self, name_id):
+        """
+        Returns the label or function name of the given ID
         """
-        self.file = open(outfile, 'w')
+        return self.names[name_id]
 
+    def current(self):
+        """
+        Returns the function the commands are being recorded into
+        :return: VMFunction
+        """
+        return self.functions[-1]
 
     def write_push(self, segment, index):
         """
         Writes a VM push command
         :param segment: one of (CONST, ARG, LOCAL, STATIC, THIS, THAT, POINTER, TEMP)
-        :param index: int
+        :param index: int, or the digits of one
         :return:
         """
-        self.file.write("push " + segment + " " + str(index) + NEW_LINE)
+        self.emit((PUSH, SEGMENT_CODES[segment], int(index)))
 
 
     def write_pop (self, segment, index):
         """
         Writes a VM pop command
         :param segment: one of (CONST, ARG, LOCAL, STATIC, THIS, THAT, POINTER, TEMP)
-        :param index: int
+        :param index: int, or the digits of one
         :return:
         """
-        self.file.write("pop " + segment + " " + str(index) + NEW_LINE)
+        self.emit((POP, SEGMENT_CODES[segment], int(index)))
 
     def write_arithmetic(self, command):
         """
@@ -44,8 +184,7 @@ class VMWriter:
         :param command: one of  (ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT)
         :return:
         """
-        assert command in ARITHMETIC_COMMANDS
-        self.file.write(command.lower() + NEW_LINE)
+        self.emit((ARITHMETIC_CODES[command], 0, 0))
 
     def write_label(self, label):
         """
@@ -53,7 +192,7 @@ class VMWriter:
         :param label: a string
         :return:
         """
-        self.file.write("label " + label + NEW_LINE)
+        self.emit((LABEL, self.intern(label), 0))
 
     def write_goto(self, label):
         """
@@ -61,7 +200,7 @@ class VMWriter:
         :param label: a string
         :return:
         """
-        self.file.write("goto " + label + NEW_LINE)
+        self.emit((GOTO, self.intern(label), 0))
 
     def write_if(self, label):
         """
@@ -69,8 +208,7 @@ class VMWriter:
         :param label: a string
         :return:
         """
-        # todo: if-goto in this case?
-        self.file.write("if-goto " + label + NEW_LINE)
+        self.emit((IF_GOTO, self.intern(label), 0))
 
     def write_call(self, name, num_args):
         """
@@ -79,7 +217,7 @@ class VMWriter:
         :param num_args: int
         :return:
         """
-        self.file.write("call " + name + " " + str(num_args) + NEW_LINE)
+        self.emit((CALL, self.intern(name), num_args))
 
     def write_function(self, name, num_locals):
         """
@@ -88,20 +226,156 @@ class VMWriter:
         :param num_locals:
         :return:
         """
-
-        self.file.write("function " + name + " " + str(num_locals) + NEW_LINE)
+        self.__start_function()
+        self.emit((FUNCTION, self.intern(name), num_locals))
 
     def write_return(self):
         """
         write a return command
         :return:
         """
-        self.file.write("return" + NEW_LINE)
+        self.emit((RETURN, 0, 0))
+
+    def write_code(self, commands):
+        """
+        Writes commands of this writer that were taken out of its code before, see
+        VMFunction.commands and VMFunction.delete
+        :param commands: iterable of (opcode, arg, index) tuples
+        """
+        for command in commands:
+            self.emit(command)
+
+    def export(self):
+        """
+        Hands over the recorded code, to be added to another writer with extend()
+        :return: (list of VMFunction, list of names)
+        """
+        return self.functions, self.names
+
+    def extend(self, code):
+        """
+        Appends code recorded by another writer, such as in another process. The
+        commands before its first function go on the current function.
+        :param code: (list of VMFunction, list of names), as returned by export()
+        """
+        functions, names = code
+        mapping = [self.intern(name) for name in names]
+        for i, function in enumerate(functions):
+            if i:
+                self.__start_function()
+            for op, arg, index in function.commands():
+                self.emit((op, mapping[arg] if op in NAMED_OPS else arg, index))
+
+    def add_pass(self, vm_pass):
+        """
+        Adds a pass that is run over the code when the writer is closed, before the
+        code is written. Passes run in the order they were added.
+        :param vm_pass: function that takes this writer and may rewrite its functions
+        """
+        self.passes.append(vm_pass)
+
+    def text(self):
+        """
+        Renders the recorded code as VM commands. The text of a command up to its index
+        is made once per opcode and first operand, and only the index is formatted
+        again for every command.
+        :return: string
+        """
+        prefixes = {}
+        lines = []
+        append = lines.append
+        for function in self.functions:
+            code = iter(function.code)
+            for op, arg, index in zip(code, code, code):
+                key = arg << OPCODE_BITS | op
+                prefix = prefixes.get(key)
+                if prefix is None:
+                    prefix = prefixes[key] = self.__prefix(op, arg)
+                append(prefix + str(index) if op in INDEXED_OPS else prefix)
+        append("")
+        return NEW_LINE.join(lines)
 
+    def size(self, commands):
+        """
+        :param commands: iterable of (opcode, arg, index) tuples of this writer
+        :return: the number of bytes the commands take in the written code
+        """
+        return sum(len(self.__prefix(op, arg)) + len(NEW_LINE) +
+                   (len(str(index)) if op in INDEXED_OPS else 0)
+                   for op, arg, index in commands)
+
+    def __prefix(self, op, arg):
+        """
+        The text of a command up to its index, or all of it if it has none
+        """
+        if op >= ARITHMETIC:
+            return ARITHMETIC_COMMANDS[op - ARITHMETIC]
+        if op in (PUSH, POP):
+            return COMMAND_NAMES[op] + " " + SEGMENT_NAMES[arg] + " "
+        if op == RETURN:
+            return COMMAND_NAMES[op]
+        if op in INDEXED_OPS:
+            return COMMAND_NAMES[op] + " " + self.names[arg] + " "
+        return COMMAND_NAMES[op] + " " + self.names[arg]
 
     def close(self):
         """
-        close the file
+        Runs the passes over the code and writes it, then closes the file
         :return:
         """
-        self.file.close()
\ No newline at end of file
+        for vm_pass in self.passes:
+            vm_pass(self)
+        if self.file is not None:
+            self.file.write(self.text())
+        if self.own_file:
+            self.file.close()
+
+
+class NullWriter(VMWriter):
+    """
+    Takes VM commands and drops them, for checking a file without writing any code
+    """
+    def __init__(self):
+        pass
+
+    def write_push(self, segment, index):
+        pass
+
+    def write_pop(self, segment, index):
+        pass
+
+    def write_arithmetic(self, command):
+        pass
+
+    def write_label(self, label):
+        pass
+
+    def write_goto(self, label):
+        pass
+
+    def write_if(self, label):
+        pass
+
+    def write_call(self, name, num_args):
+        pass
+
+    def write_function(self, name, num_locals):
+        pass
+
+    def write_return(self):
+        pass
+
+    def write_code(self, commands):
+        pass
+
+    def current(self):
+        return VMFunction()
+
+    def extend(self, code):
+        pass
+
+    def add_pass(self, vm_pass):
+        pass
+
+    def close(self):
+        pass
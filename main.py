@@ -13,23 +13,51 @@ import traceback
 from JackCompiler import JackCompiler as Compiler
 from JackCompiler.SyntaxAnalyzer import Analyzer as Analyzer
 FILE_PATH = 1
+CHECK_FLAG = '--check'
+JOBS_FLAG = '--jobs'
+OPTIMIZE_FLAG = '-O'
+MULTIPLY_LIMIT_FLAG = '--mul-limit'
+POOL_STRINGS_FLAG = '--pool-strings'
+KEEP_FLAG = '--keep'
+INLINE_LIMIT_FLAG = '--inline-limit'
 
 FILE_EXTENSION_JACK = '.jack'
 FILE_EXTENSION_VM = '.vm'
 FILE_EXTENSION_XML = '.xml'
 
 
-def main(path, no_tokenize=True, no_compile=False):
+def main(path, no_tokenize=True, no_compile=False, streaming=False, no_parse=True,
+         cache_dir=None, precedence=False, ast=False, check=False, jobs=1,
+         optimize=False, multiply_limit=Compiler.MULTIPLY_LIMIT, pool_strings=False,
+         keep=(), inline_limit=Compiler.INLINE_LIMIT):
     """
     Main Compiler. Checks legality of arguments and operates on directory
     or file accordingly.
     :param path: argument
+    :param streaming: compile while tokenizing instead of tokenizing each file first
+    :param no_parse: if False, the parse tree of every file is written as xml
+    :param cache_dir: if given, token streams are cached in this directory
+    :param precedence: compile expressions with conventional operator precedence
+    instead of Jack's left to right order
+    :param ast: generate the code of every file from its syntax tree
+    :param check: only check that the files compile. Nothing is written
+    :param jobs: number of processes the subroutines of a big file are compiled in
+    :param optimize: optimize the VM code, and tell how much of it was removed
+    :param multiply_limit: with optimize, the most VM commands a multiplication by a
+    constant is written in instead of a call of Math.multiply
+    :param pool_strings: build every distinct string constant of a class only once
+    :param keep: with optimize, names of functions to keep when a directory is compiled
+    as a whole program, besides those reached from Main.main
+    :param inline_limit: with optimize, the most VM commands a function of a directory
+    compiled as a whole program is inlined with
+    :return: the number of errors found in all the files, and 1 if the path itself
+    can't be compiled
     """
     jack_files = []
     if not os.path.exists(path):
         print("Error: File or directory does not exist: %s"
               % path)
-        return
+        return 1
 
     elif os.path.isdir(path):  # Directory of files
         jack_files = filter_paths(path)
@@ -37,13 +65,13 @@ def main(path, no_tokenize=True, no_compile=False):
         if not jack_files:  # no vm files found
             print("Error: No files matching %s found in supplied "
                   "directory: %s" % (FILE_EXTENSION_JACK, path))
-            return
+            return 1
 
     elif os.path.isfile(path):  # Single file
         if not path.endswith(FILE_EXTENSION_JACK):
             print("Error: Mismatched file type.\n\"%s\"suffix is not a valid "
                   "file type. Please supply .jack filename or dir." % path)
-            return
+            return 1
         jack_files.append(path)
         dir_path = os.path.dirname(path)
 
@@ -51,34 +79,77 @@ def main(path, no_tokenize=True, no_compile=False):
     else:
         print("Error: Unrecognized path: \"%s\"\n"
               "Please supply dir or path/filename.vm")
-        return
+        return 1
 
 
     # Initilizes write based, using a condition for multiple file reading.
     # Multiple files have a special initialization
     analyzer = Analyzer.Analyzer()
-    compiler = Compiler.Compiler()
-
+    compiler = Compiler.Compiler(streaming=streaming, cache_dir=cache_dir,
+                                 precedence=precedence, ast=ast, jobs=jobs,
+                                 optimize=optimize, multiply_limit=multiply_limit,
+                                 pool_strings=pool_strings, inline_limit=inline_limit)
+
+    # A directory is a whole program, whose uncalled functions can be left out
+    whole_program = optimize and not check and os.path.isdir(path)
+    if whole_program:
+        compiler.start_program()
+    num_errors = 0
     for jack_file in jack_files:
         try:
+            if check:
+                errors = compiler.check(jack_file)
+                for message in errors:
+                    print(message)
+                num_errors += len(errors)
+                continue
+
             if not no_tokenize:
                 dest_file_name = parse_filename(jack_file, FILE_EXTENSION_XML,
                                                 tokenize_only=True)
                 analyzer.tokenize(jack_file, dest_file_name)
 
+            if not no_parse:
+                dest_file_name = parse_filename(jack_file, FILE_EXTENSION_XML)
+                analyzer.compile(jack_file, dest_file_name)
+
             if not no_compile:
                 dest_file_name = parse_filename(jack_file, FILE_EXTENSION_VM)
                 # analyzer.compile(jack_file, dest_file_name)
-                compiler.compile(jack_file, dest_file_name)
+                errors = compiler.compile(jack_file, dest_file_name)
+                for message in errors:
+                    print(message)
+                num_errors += len(errors)
 
         except OSError:
             print("Could not open {} as jack file.\n If file exists, check spelling"
                   " of file path.".format(jack_file))
-
+            num_errors += 1
 
         except Exception as e:
             print("Some exception occurred while parsing {}.".format(jack_file), e)
             traceback.print_exc()
+            num_errors += 1
+
+    if whole_program:
+        compiler.finish_program(keep)
+    if optimize and not check:
+        peephole = compiler.peephole
+        print("Peephole optimizer removed {} of {} VM instructions.".format(
+            peephole.removed, peephole.seen))
+        print("Dead code: {} unreachable VM instructions ({} bytes) removed.".format(
+            peephole.unreachable, peephole.unreachable_bytes))
+    if whole_program:
+        inliner, pruner = compiler.inliner, compiler.pruner
+        print("Inlined {} calls of {} subroutines, {:+d} VM instructions ({:+d} bytes)."
+              .format(inliner.calls, inliner.functions, inliner.added,
+                      inliner.added_bytes))
+        print("Unused subroutines: {} of {} removed, {} VM instructions ({} bytes)."
+              .format(pruner.removed_functions, pruner.functions, pruner.removed,
+                      pruner.removed_bytes))
+    if num_errors:
+        print("{} error(s) found.".format(num_errors))
+    return num_errors
 
 
 
@@ -105,9 +176,45 @@ def parse_filename(path, extension, tokenize_only=False):
 
 
 
+def pop_option(args, flag, default):
+    """
+    Takes a flag and the value after it out of the command line arguments
+    :return: the value, "" if it is missing, or the default if the flag is not given
+    """
+    if flag not in args:
+        return default
+    i = args.index(flag)
+    value = args[i + 1] if i + 1 < len(args) else ""
+    del args[i:i + 2]
+    return value
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    args = sys.argv[FILE_PATH:]
+    check = CHECK_FLAG in args
+    if check:
+        args.remove(CHECK_FLAG)
+    optimize = OPTIMIZE_FLAG in args
+    if optimize:
+        args.remove(OPTIMIZE_FLAG)
+    pool_strings = POOL_STRINGS_FLAG in args
+    if pool_strings:
+        args.remove(POOL_STRINGS_FLAG)
+    keep = pop_option(args, KEEP_FLAG, None)
+    jobs = pop_option(args, JOBS_FLAG, "1")
+    inline_limit = pop_option(args, INLINE_LIMIT_FLAG, str(Compiler.INLINE_LIMIT))
+    multiply_limit = pop_option(args, MULTIPLY_LIMIT_FLAG, str(Compiler.MULTIPLY_LIMIT))
+    if len(args) != 1 or not jobs.isdigit() or not multiply_limit.isdigit() or \
+            not inline_limit.isdigit() or keep == "":
         print("Error: Wrong number of arguments.\n"
-              "Usage: JackCompiler file_name.jack or /existing_dir_path/")
+              "Usage: JackCompiler [--check] [-O] [--mul-limit N] [--pool-strings] "
+              "[--keep Class.name,...] [--inline-limit N] [--jobs N] "
+              "file_name.jack or /existing_dir_path/")
+        sys.exit(2)
     else:
-        main(sys.argv[FILE_PATH], no_compile=False, no_tokenize=True)
+        sys.exit(1 if main(args[0], no_compile=False, no_tokenize=True, check=check,
+                           jobs=int(jobs), optimize=optimize,
+                           multiply_limit=int(multiply_limit),
+                           pool_strings=pool_strings,
+                           keep=keep.split(",") if keep else (),
+                           inline_limit=int(inline_limit)) else 0)
@@ -0,0 +1,1392 @@
+"""
+Performance benchmarks for the Jack compiler.
+
+Each benchmark generates its own Jack sources in a temporary directory, so they can be
+run from anywhere in the project:
+
+    python -m testing.Benchmarks
+
+The results are printed as a table. A benchmark is considered to scale linearly when
+the time per KB stays roughly constant as the input grows.
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JackCompiler.SyntaxAnalyzer.CompilationEngine import CompilationEngine, \
+    OP_COMMANDS, OP_CALLS
+from JackCompiler.SymbolTable import SymbolTable
+from JackCompiler.SyntaxAnalyzer.Analyzer import Analyzer
+from JackCompiler.SyntaxAnalyzer.JackTokenizer import JackTokenizer, scan, IDENTIFIER
+from JackCompiler.SyntaxAnalyzer.TokenCache import TokenCache
+from JackCompiler.SyntaxAnalyzer.Parser import Parser
+from JackCompiler.SyntaxAnalyzer.AST import Node
+from JackCompiler.JackCompiler import Compiler
+from JackCompiler.VMWriter import VMWriter, PUSH, POP, LABEL, GOTO, IF_GOTO, CALL, \
+    FUNCTION, RETURN, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, SEGMENT_CODES
+from JackCompiler.Optimizer import PeepholeOptimizer, FunctionPruner, Inliner
+from JackCompiler.ConstantFolding import to_word
+
+KB = 1024
+MB = 1024 * KB
+
+TOKENIZER_SIZES = [10 * KB, 100 * KB, 1 * MB, 10 * MB]
+MEMORY_SIZES = [1 * MB, 10 * MB]
+COMPILE_SIZES = [64 * KB, 256 * KB, 1 * MB]
+COMMENT_SIZES = [256 * KB, 1 * MB, 4 * MB]
+
+# The example programs that come with the project
+TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_files")
+# The example programs whose compiled code is compared with the expected code
+RESULT_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_files")
+
+# Loop iterations a program is run for at most, as some of them wait for a key forever
+MAX_ITERATIONS = 20000
+# Where the heap of the stubbed OS starts, as on the Hack platform
+HEAP_BASE = 2048
+# The operations of the binary arithmetic commands, on words
+BINARY_OPERATIONS = {ADD: lambda x, y: x + y, SUB: lambda x, y: x - y,
+                     EQ: lambda x, y: -(x == y), GT: lambda x, y: -(x > y),
+                     LT: lambda x, y: -(x < y), AND: lambda x, y: x & y,
+                     OR: lambda x, y: x | y}
+UNARY_OPERATIONS = {NEG: lambda x: -x, NOT: lambda x: ~x}
+
+# Element counts of the long statement, declaration, argument and operator lists
+STRESS_COUNTS = [2500, 5000, 10000]
+# A stack this shallow only fits a compile that does not recurse per element
+STRESS_RECURSION_LIMIT = 200
+
+# How an error message goes on after its file name: ":line:column: message"
+ERROR_POSITION = re.compile(r":(\d+):\d+: ")
+# The statement inject_errors breaks statements into
+BROKEN_STATEMENT = "let sum = sum + ;"
+
+# A string constant and symbols that are escaped in xml, and how they are written there
+ESCAPED_CLASS = """
+class Main {
+    function boolean f(int x) {
+        do Output.printString("a<b & c > d");
+        return (x < 1) & (x > 0);
+    }
+}
+"""
+ESCAPED_TERMINALS = ["<stringConstant> a&lt;b &amp; c &gt; d </stringConstant>",
+                     "<symbol> &lt; </symbol>", "<symbol> &amp; </symbol>",
+                     "<symbol> &gt; </symbol>"]
+
+# The binary operators the long expressions go through, in turn
+EXPRESSION_OPERATORS = ["+", "*", "-", "/", "&", "|", "<", ">", "="]
+
+# Comment bodies that used to make the doc string pattern backtrack
+COMMENT_CASES = [
+    ("doc comment", lambda n: "/** " + "x * y / z " * (n // 10) + "*/ class"),
+    ("plain comment", lambda n: "/* " + "a/b*c " * (n // 6) + "*/ class"),
+    ("nested stars", lambda n: "/**" + "*" * n + "*/ class"),
+    ("unterminated", lambda n: "class /** " + "* / " * (n // 4)),
+    ("line comments", lambda n: "// a * / b\n" * (n // 11) + "class"),
+]
+
+SUBROUTINE_TEMPLATE = """
+    /** Returns a value computed from x and y. */
+    method int compute{0}(int x, int y) {{
+        var int i, sum;
+        var Array a;
+        let i = 0;  // loop counter
+        let a = Array.new(10);
+        while (i < 10) {{
+            let a[i] = (x * i) + (y / 2) - {0};
+            let sum = sum + a[i];
+            let i = i + 1;
+        }}
+        if (~(sum = 0) & (x > y)) {{
+            do Output.printString("sum is positive");
+        }}
+        return sum;
+    }}
+"""
+
+# A subroutine that computes with constants, as game code does with sizes on the screen
+CONSTANT_TEMPLATE = """
+    function int scaled{0}(int x) {{
+        var int width, height, area, i;
+        let width = 16 * 32;
+        let height = 256 - 16;
+        let area = width * height / 8;
+        let i = 0;
+        while (i < (width / 16)) {{
+            let x = x + (height * 2) - (-1 * 3) + i;
+            let i = i + 1;
+        }}
+        return x + area + {0};
+    }}
+"""
+
+# A subroutine that multiplies by small constants, as screen and game code does
+MULTIPLY_TEMPLATE = """
+    function int address{0}(int x, int y) {{
+        var int row, i;
+        let row = y * 32;
+        let i = 0;
+        while (i < 4) {{
+            let x = (x * 2) + (i * 3) - (x * 5) + (y * 10) + (i * -1);
+            let i = i + 1;
+        }}
+        return row + (x / 16) + (y * 0) + (16 * x);
+    }}
+"""
+# The multiply limits the strength reduction benchmark compares
+MULTIPLY_LIMITS = [0, 8, 16, 32]
+# A program whose tracing is switched off by a constant, so that the trace calls and the
+# function they call are dead
+DEAD_CODE_CLASS = """
+class Main {
+    function void main() {
+        var int i;
+        let i = 0;
+        while (i < 10) {
+            if (false) {
+                do Main.trace(i);
+            }
+            let i = i + 1;
+        }
+        return;
+        do Main.trace(i);
+    }
+    function void trace(int i) {
+        do Output.printString("i = ");
+        do Output.printInt(i);
+        do Output.println();
+        return;
+    }
+}
+"""
+# Matrices as arrays of rows, and points as arrays of two coordinates
+ARRAY_CLASS = """
+class Main {
+    function void main() {
+        var Array a, b, c, p;
+        var int i;
+        let a = Main.matrix(4, 1);
+        let b = Main.matrix(4, 2);
+        let c = Main.matrix(4, 0);
+        do Main.multiply(a, b, c, 4);
+        let p = Array.new(2);
+        let p[0] = 0;
+        let p[1] = 0;
+        let i = 0;
+        while (i < 50) {
+            let p[0] = p[0] + 3;
+            let p[1] = p[1] + p[0];
+            let i = i + 1;
+        }
+        return;
+    }
+    function Array matrix(int n, int value) {
+        var Array m, row;
+        var int i, j;
+        let m = Array.new(n);
+        let i = 0;
+        while (i < n) {
+            let row = Array.new(n);
+            let j = 0;
+            while (j < n) {
+                let row[j] = value;
+                let j = j + 1;
+            }
+            let m[i] = row;
+            let i = i + 1;
+        }
+        return m;
+    }
+    function void multiply(Array a, Array b, Array c, int n) {
+        var Array row, result;
+        var int i, j, k, sum;
+        let i = 0;
+        while (i < n) {
+            let row = a[i];
+            let result = c[i];
+            let j = 0;
+            while (j < n) {
+                let sum = 0;
+                let k = 0;
+                while (k < n) {
+                    let sum = sum + (row[k] * Main.entry(b, k, j));
+                    let k = k + 1;
+                }
+                let result[j] = sum;
+                let j = j + 1;
+            }
+            let i = i + 1;
+        }
+        return;
+    }
+    function int entry(Array m, int i, int j) {
+        var Array row;
+        let row = m[i];
+        return row[j];
+    }
+}
+"""
+# The OS functions whose last argument CommandCounter keeps as printed
+PRINT_FUNCTIONS = ("Output.printInt", "Output.printChar")
+# Loops on conditions that are not just true or false. A while loop only goes on while
+# its condition is true, -1, and stops on any other value
+WHILE_CONDITIONS_CLASS = """
+class Main {
+    function void main() {
+        var int n, k, mask;
+        let n = 3;
+        let k = 0;
+        while (n) {
+            let n = n - 1;
+            let k = k + 1;
+        }
+        do Output.printInt(k);
+        let n = -1;
+        let k = 0;
+        while (n) {
+            let n = n + 1;
+            let k = k + 1;
+        }
+        do Output.printInt(k);
+        let mask = 12;
+        let k = 0;
+        while (~(mask & 3)) {
+            let mask = mask + 1;
+            let k = k + 1;
+        }
+        do Output.printInt(k);
+        let k = 0;
+        while (~(k = 5)) {
+            let k = k + 1;
+        }
+        do Output.printInt(k);
+        return;
+    }
+}
+"""
+# The inline limits the inlining benchmark compares
+INLINE_LIMITS = [0, 4, 8, 16]
+# A point moved around in a loop through its accessors, and small helper functions
+ACCESSOR_CLASSES = {"Main": """
+class Main {
+    function void main() {
+        var Walker walker;
+        let walker = Walker.new();
+        do walker.run(200);
+        return;
+    }
+}
+""", "Walker": """
+class Walker {
+    field Point p;
+    field int steps;
+    constructor Walker new() {
+        let p = Point.new(0, 0);
+        let steps = 0;
+        return this;
+    }
+    method void run(int count) {
+        var int i;
+        let i = 0;
+        while (i < count) {
+            do p.setX(Util.clamp(p.getX() + Util.step(i), 511));
+            do p.setY(Util.clamp(p.getY() + Util.twice(p.getX()), 255));
+            let steps = steps + 1;
+            let i = i + 1;
+        }
+        return;
+    }
+}
+""", "Point": """
+class Point {
+    field int x, y;
+    constructor Point new(int ax, int ay) {
+        let x = ax;
+        let y = ay;
+        return this;
+    }
+    method int getX() { return x; }
+    method int getY() { return y; }
+    method void setX(int ax) { let x = ax; return; }
+    method void setY(int ay) { let y = ay; return; }
+}
+""", "Util": """
+class Util {
+    function int step(int i) { return (i & 7) - 3; }
+    function int twice(int x) { return x + x; }
+    function int clamp(int x, int max) { return x & max; }
+}
+"""}
+# A message printed in a loop, the same string constant evaluated again and again
+MESSAGE_LOOP_CLASS = """
+class Main {
+    function void main() {
+        var int i;
+        let i = 0;
+        while (i < 100) {
+            do Output.printString("The quick brown fox jumps over a lazy dog");
+            do Output.println();
+            let i = i + 1;
+        }
+        return;
+    }
+}
+"""
+
+
+def gen_class(size, name="Main", template=SUBROUTINE_TEMPLATE):
+    """
+    Generates a valid jack class of approximately the given size in bytes
+    :param size: size in bytes
+    :param name: class name
+    :param template: the subroutine the class is made of, formatted with its number
+    :return: string of jack code
+    """
+    parts = ["class " + name + " {\n    field int x, y;\n"]
+    total, i = len(parts[0]), 0
+    while total < size:
+        part = template.format(i)
+        parts.append(part)
+        total += len(part)
+        i += 1
+    parts.append("}\n")
+    return "".join(parts)
+
+
+def write_source(directory, text, name="Main"):
+    """
+    Writes jack code into a file in the given directory and returns its path
+    """
+    path = os.path.join(directory, name + ".jack")
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def time_call(func, *args):
+    """
+    Times a single call of func
+    :return: elapsed seconds
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def print_table(title, rows):
+    """
+    Prints rows of (size, seconds) along with the time per KB
+    """
+    print(title)
+    print("{:>12} {:>12} {:>12}".format("size (KB)", "time (s)", "us / KB"))
+    for size, seconds in rows:
+        print("{:>12} {:>12.4f} {:>12.2f}".format(size // KB, seconds,
+                                                   seconds * 1e6 / (size / KB)))
+    print()
+
+
+def bench_tokenizer(sizes=TOKENIZER_SIZES):
+    """
+    Tokenizes generated classes of growing sizes. The time per KB should stay flat
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            rows.append((size, time_call(JackTokenizer, path)))
+    print_table("Tokenizer scaling", rows)
+    return rows
+
+
+def peak_memory(func, *args):
+    """
+    Calls func while tracing allocations
+    :return: (result, peak bytes allocated during the call)
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_token_memory(sizes=MEMORY_SIZES):
+    """
+    Compares the peak memory of the compact token store against a list of
+    (Token_Types, value) tuples of the same tokens
+    """
+    print("Token store memory")
+    print("{:>12} {:>10} {:>14} {:>14} {:>8}".format(
+        "size (KB)", "tokens", "store (B/tok)", "tuples (B/tok)", "ratio"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            tokenizer, store_peak = peak_memory(JackTokenizer, path)
+            # The source text is shared by both, so only count what is on top of it
+            store_peak -= sys.getsizeof(tokenizer.text)
+            _, tuples_peak = peak_memory(lambda: list(tokenizer.token_gen()))
+            n = tokenizer.num_tokens
+            print("{:>12} {:>10} {:>14.1f} {:>14.1f} {:>8.1f}".format(
+                size // KB, n, store_peak / n, tuples_peak / n,
+                tuples_peak / store_peak))
+    print()
+
+
+def bench_streaming(sizes=COMPILE_SIZES):
+    """
+    Compares the peak memory of a full compile with a stored token stream against a
+    streamed one. The streamed peak should only grow with the source text itself
+    """
+    print("Compile peak memory, stored vs streamed tokens")
+    print("{:>12} {:>14} {:>14}".format("size (KB)", "stored (KB)", "streamed (KB)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            dest = os.path.join(directory, "Main.vm")
+            peaks = [peak_memory(CompilationEngine, path, dest, streaming)[1]
+                     for streaming in (False, True)]
+            print("{:>12} {:>14} {:>14}".format(size // KB, peaks[0] // KB,
+                                                peaks[1] // KB))
+    print()
+
+
+def scan_text(text):
+    """
+    Scans the whole text, an unterminated comment is reported as a ValueError
+    """
+    try:
+        for _ in scan(text):
+            pass
+    except ValueError:
+        pass
+
+
+def bench_comments(sizes=COMMENT_SIZES):
+    """
+    Scans pathological comments of growing sizes. The time per KB should stay flat
+    """
+    for name, gen in COMMENT_CASES:
+        rows = [(size, time_call(scan_text, gen(size))) for size in sizes]
+        print_table("Comment scanning: " + name, rows)
+
+
+def bench_incremental(sizes=TOKENIZER_SIZES[:3]):
+    """
+    Compares a one character edit in the middle of a class against lexing the edited
+    class from scratch
+    """
+    print("One character edit, incremental vs full")
+    print("{:>12} {:>14} {:>14} {:>10}".format("size (KB)", "edit (ms)", "full (ms)",
+                                                "relexed"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            tokenizer = JackTokenizer(path)
+            offset = tokenizer.text.index("sum + a[i]", len(tokenizer.text) // 2)
+            start = time.perf_counter()
+            _, _, relexed = tokenizer.edit(offset, 1, "t")
+            edit_time = time.perf_counter() - start
+            full_time = time_call(lambda: list(scan(tokenizer.text)))
+            print("{:>12} {:>14.3f} {:>14.3f} {:>10}".format(
+                size // KB, edit_time * 1e3, full_time * 1e3, relexed))
+    print()
+
+
+def gen_identifier_class(size, num_vars=64):
+    """
+    Generates a class made mostly of identifiers, reading and writing many locals
+    """
+    names = ["variable_number_{}".format(i) for i in range(num_vars)]
+    parts = ["class Main {\n    function void main() {\n"]
+    parts += ["        var int {};\n".format(name) for name in names]
+    total, i = 0, 0
+    while total < size:
+        line = "        let {} = {} + {};\n".format(names[i % num_vars],
+                                                     names[(i + 1) % num_vars],
+                                                     names[(i + 7) % num_vars])
+        parts.append(line)
+        total += len(line)
+        i += 1
+    parts.append("        return;\n    }\n}\n")
+    return "".join(parts)
+
+
+def bench_identifiers(size=1 * MB):
+    """
+    Compares symbol lookups and identifier memory with sliced string names against
+    interned name IDs
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        tokenizer = JackTokenizer(write_source(directory, gen_identifier_class(size)))
+    text, kinds, starts, ends, ids = (tokenizer.text, tokenizer.kinds, tokenizer.starts,
+                                      tokenizer.ends, tokenizer.ids)
+    positions = [i for i in range(tokenizer.num_tokens) if kinds[i] == IDENTIFIER]
+
+    by_name, by_id = SymbolTable(), SymbolTable()
+    for name, name_id in tokenizer.identifiers.ids.items():
+        by_name.define(name, "int", "local")
+        by_id.define(name_id, "int", "local")
+
+    def lookup_names():
+        # A fresh substring per token and three lookups per identifier
+        for i in positions:
+            name = text[starts[i]:ends[i]]
+            by_name.kind_of(name), by_name.index_of(name), by_name.type_of(name)
+
+    def lookup_ids():
+        for i in positions:
+            by_id.lookup(ids[i])
+
+    names_time, ids_time = time_call(lookup_names), time_call(lookup_ids)
+    names_memory = sum(sys.getsizeof(text[starts[i]:ends[i]]) for i in positions)
+    ids_memory = (sum(sys.getsizeof(name) for name in tokenizer.identifiers.names) +
+                  ids.itemsize * len(positions))
+
+    print("Identifier lookups ({} identifiers, {} distinct)".format(
+        len(positions), len(tokenizer.identifiers)))
+    print("{:>12} {:>14} {:>14}".format("", "lookups (ms)", "memory (KB)"))
+    print("{:>12} {:>14.1f} {:>14}".format("names", names_time * 1e3,
+                                            names_memory // KB))
+    print("{:>12} {:>14.1f} {:>14}".format("ids", ids_time * 1e3, ids_memory // KB))
+    print()
+
+
+def bench_xml(sizes=COMPILE_SIZES):
+    """
+    Times the token and parse tree xml of growing classes, next to the time it takes to
+    just write the same number of bytes. Checks first that the xml escapes special
+    characters as it should
+    """
+    analyzer = Analyzer()
+    print("XML generation")
+    print("{:>12} {:>12} {:>12} {:>12} {:>12}".format(
+        "size (KB)", "tokens (s)", "raw (s)", "tree (s)", "raw (s)"))
+    with tempfile.TemporaryDirectory() as directory:
+        # Special characters are escaped once, in the tokens and in the tree
+        path = write_source(directory, ESCAPED_CLASS)
+        for method in (analyzer.tokenize, analyzer.compile):
+            dest = os.path.join(directory, "Main.xml")
+            method(path, dest)
+            with open(dest) as f:
+                data = f.read()
+            for terminal in ESCAPED_TERMINALS:
+                assert terminal in data, (method.__name__, terminal)
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            row = [size // KB]
+            for method in (analyzer.tokenize, analyzer.compile):
+                dest = os.path.join(directory, "Main.xml")
+                row.append(time_call(method, path, dest))
+                with open(dest) as f:
+                    data = f.read()
+                row.append(time_call(write_raw, dest, data))
+            print("{:>12} {:>12.4f} {:>12.4f} {:>12.4f} {:>12.4f}".format(*row))
+    print()
+
+
+def write_raw(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def bench_cache(sizes=TOKENIZER_SIZES[:3]):
+    """
+    Compares tokenizing a file against loading its cached token stream, along with the
+    size of the cache entry
+    """
+    print("Token cache, uncached vs cached")
+    print("{:>12} {:>14} {:>14} {:>14}".format("size (KB)", "lex (ms)", "cached (ms)",
+                                                "entry (KB)"))
+    with tempfile.TemporaryDirectory() as directory:
+        cache = TokenCache(os.path.join(directory, "cache"))
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            lex_time = time_call(JackTokenizer, path, False)
+            # The first run fills the cache, the second one reads it
+            tokenizer = JackTokenizer(path, cache=cache)
+            cached_time = time_call(lambda: JackTokenizer(path, cache=cache))
+            entry_size = os.path.getsize(cache.path_of(tokenizer.text))
+            print("{:>12} {:>14.3f} {:>14.3f} {:>14}".format(
+                size // KB, lex_time * 1e3, cached_time * 1e3, entry_size // KB))
+    print()
+
+
+def gen_long_lists(count):
+    """
+    Generates a class with count statements, count declared variables and arguments,
+    and an expression of count terms
+    """
+    names = ["v{}".format(i) for i in range(count)]
+    return "".join([
+        "class Main {\n    function int f(int a) {\n        return a;\n    }\n",
+        "    function void main() {\n        var int ", ", ".join(names), ";\n",
+        "".join("        let v{} = {};\n".format(i, i) for i in range(count)),
+        "        let v0 = ", " + ".join(names), ";\n",
+        "        do Main.g(", ", ".join(names), ");\n",
+        "        return;\n    }\n}\n"])
+
+
+def bench_long_lists(counts=STRESS_COUNTS):
+    """
+    Compiles classes with growing statement, declaration, argument and operator lists
+    under a shallow recursion limit. The time per element should stay flat
+    """
+    print("Long lists (recursion limit {})".format(STRESS_RECURSION_LIMIT))
+    print("{:>12} {:>12} {:>14}".format("elements", "time (s)", "us / element"))
+    with tempfile.TemporaryDirectory() as directory:
+        for count in counts:
+            path = write_source(directory, gen_long_lists(count))
+            dest = os.path.join(directory, "Main.vm")
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(STRESS_RECURSION_LIMIT)
+            try:
+                start = time.perf_counter()
+                errors = CompilationEngine(path, dest).errors
+                seconds = time.perf_counter() - start
+            finally:
+                sys.setrecursionlimit(limit)
+            assert not errors, errors[:1]
+            with open(dest) as vm_file:
+                code = vm_file.read().splitlines()
+            # Every statement, and the expression and the call of all the variables
+            assert code.count("pop local 0") == 2 and \
+                sum(line.startswith("pop local") for line in code) == count + 1, count
+            assert code.count("add") == count - 1, count
+            assert "call Main.g {}".format(count) in code, count
+            print("{:>12} {:>12.4f} {:>14.2f}".format(count, seconds,
+                                                       seconds * 1e6 / count))
+    print()
+
+
+def bench_probes(sizes=COMPILE_SIZES, probes=100000):
+    """
+    Compares a failed probe for an optional token made with eat() and a caught
+    exception against match(), and prints the parse throughput of growing classes
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        print("Parse throughput")
+        print("{:>12} {:>10} {:>12} {:>14}".format("size (KB)", "tokens", "time (s)",
+                                                   "tokens / s"))
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            dest = os.path.join(directory, "Main.vm")
+            start = time.perf_counter()
+            engine = CompilationEngine(path, dest)
+            seconds = time.perf_counter() - start
+            tokens = engine.tokenizer.num_tokens
+            print("{:>12} {:>10} {:>12.4f} {:>14.0f}".format(size // KB, tokens, seconds,
+                                                             tokens / seconds))
+        print()
+
+    def probe_eat():
+        for _ in range(probes):
+            try:
+                engine.eat(',')
+            except Exception:
+                pass
+
+    def probe_match():
+        for _ in range(probes):
+            engine.match(',')
+
+    eat_time, match_time = time_call(probe_eat), time_call(probe_match)
+    print("Failed probes for an optional token")
+    print("{:>12} {:>14}".format("", "us / probe"))
+    print("{:>12} {:>14.3f}".format("eat/except", eat_time * 1e6 / probes))
+    print("{:>12} {:>14.3f}".format("match", match_time * 1e6 / probes))
+    print()
+
+
+def gen_expression_class(count):
+    """
+    Generates a class returning a single expression of count terms that mixes all the
+    binary operators
+    """
+    terms = ["x" if i % 2 else str(i) for i in range(count)]
+    expression = terms[0] + "".join(
+        " " + EXPRESSION_OPERATORS[i % len(EXPRESSION_OPERATORS)] + " " + terms[i]
+        for i in range(1, count))
+    return ("class Main {\n    function int f(int x) {\n        return " + expression +
+            ";\n    }\n}\n")
+
+
+def expression_code(count):
+    """
+    The VM code of the class of gen_expression_class, compiled in Jack's left to right
+    order: every term, followed by the operator before it
+    :return: list of the lines of the vm file
+    """
+    code = ["function Main.f 0"]
+    for i in range(count):
+        code.append("push argument 0" if i % 2 else "push constant {}".format(i))
+        if i:
+            op = EXPRESSION_OPERATORS[i % len(EXPRESSION_OPERATORS)]
+            code.append(OP_COMMANDS[op] if op in OP_COMMANDS else
+                        "call {} 2".format(OP_CALLS[op]))
+    return code + ["return"]
+
+
+def bench_expressions(counts=STRESS_COUNTS):
+    """
+    Compiles long expressions in Jack's left to right order and with conventional
+    precedence, and checks that none of their terms is lost. The time per term should
+    stay flat in both
+    """
+    print("Expressions")
+    print("{:>12} {:>18} {:>24}".format("terms", "jack (us / term)",
+                                         "precedence (us / term)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for count in counts:
+            path = write_source(directory, gen_expression_class(count))
+            dest = os.path.join(directory, "Main.vm")
+            expected = expression_code(count)
+            times = []
+            for precedence in (False, True):
+                start = time.perf_counter()
+                errors = CompilationEngine(path, dest, precedence=precedence).errors
+                times.append(time.perf_counter() - start)
+                assert not errors, errors[:1]
+                with open(dest) as vm_file:
+                    code = vm_file.read().splitlines()
+                # With precedence, the same commands come in another order
+                assert (sorted(code) == sorted(expected) if precedence else
+                        code == expected), (count, precedence)
+            print("{:>12} {:>18.2f} {:>24.2f}".format(count, times[0] * 1e6 / count,
+                                                      times[1] * 1e6 / count))
+    print()
+
+
+def count_nodes(roots):
+    """
+    Counts the nodes of syntax trees, without recursing
+    """
+    count, stack = 0, list(roots)
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Node):
+            count += 1
+            stack.extend(getattr(item, field) for field in item.__slots__)
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return count
+
+
+def bench_ast(sizes=COMPILE_SIZES):
+    """
+    Measures the memory the syntax tree of growing classes takes, and compares
+    compiling through the tree against compiling while parsing
+    """
+    print("Syntax tree")
+    print("{:>12} {:>10} {:>12} {:>12} {:>14} {:>12}".format(
+        "size (KB)", "nodes", "tree (KB)", "B / node", "direct (s)", "ast (s)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            dest = os.path.join(directory, "Main.vm")
+            tokenizer = JackTokenizer(path)
+            identifiers = tokenizer.identifiers
+            # Only the tree is measured: the token store is freed once parsing is done
+            # and the names are already interned
+            tokens_peak = peak_memory(JackTokenizer, path, False, 8, identifiers)[1]
+            classes, parse_peak = peak_memory(
+                lambda: Parser(path, identifiers=identifiers).classes)
+            tree = parse_peak - tokens_peak
+            nodes = count_nodes(classes)
+            direct = time_call(CompilationEngine, path, dest)
+            ast = time_call(Compiler(ast=True).compile, path, dest)
+            print("{:>12} {:>10} {:>12} {:>12.1f} {:>14.4f} {:>12.4f}".format(
+                size // KB, nodes, tree // KB, tree / nodes, direct, ast))
+    print()
+
+
+def inject_errors(text, every=10):
+    """
+    Breaks one statement in every few subroutines of a generated class
+    :return: (broken text, number of errors put in)
+    """
+    statement = "let sum = sum + a[i];"
+    parts = text.split(statement)
+    pieces = [parts[0]]
+    for i, part in enumerate(parts[1:]):
+        pieces.append(BROKEN_STATEMENT if i % every == 0 else statement)
+        pieces.append(part)
+    return "".join(pieces), len(range(0, len(parts) - 1, every))
+
+
+def bench_recovery(sizes=COMPILE_SIZES):
+    """
+    Compiles generated classes as they are and with an error in every tenth
+    subroutine, checking that every error is reported in a single run
+    """
+    print("Error recovery")
+    print("{:>12} {:>12} {:>12} {:>10} {:>10}".format("size (KB)", "clean (s)",
+                                                      "broken (s)", "errors", "found"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            text = gen_class(size)
+            dest = os.path.join(directory, "Main.vm")
+            clean = time_call(CompilationEngine, write_source(directory, text), dest)
+            broken_text, num_errors = inject_errors(text)
+            path = write_source(directory, broken_text)
+            start = time.perf_counter()
+            errors = CompilationEngine(path, dest).errors
+            broken = time.perf_counter() - start
+            found = len(errors)
+            assert found == num_errors, (size, found, num_errors)
+            # The first error is on the line of the first broken statement
+            position = ERROR_POSITION.match(errors[0][len(path):])
+            line = broken_text[:broken_text.index(BROKEN_STATEMENT)].count("\n") + 1
+            assert errors[0].startswith(path) and position and \
+                int(position.group(1)) == line, errors[0]
+            print("{:>12} {:>12.4f} {:>12.4f} {:>10} {:>10}".format(
+                size // KB, clean, broken, num_errors, found))
+    print()
+
+
+def bench_check(sizes=COMPILE_SIZES):
+    """
+    Compares checking generated classes against compiling them
+    """
+    compiler = Compiler()
+    print("Check only vs compile")
+    print("{:>12} {:>12} {:>12} {:>8}".format("size (KB)", "compile (s)", "check (s)",
+                                              "ratio"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            dest = os.path.join(directory, "Main.vm")
+            compile_time = time_call(compiler.compile, path, dest)
+            check_time = time_call(compiler.check, path)
+            print("{:>12} {:>12.4f} {:>12.4f} {:>8.2f}".format(
+                size // KB, compile_time, check_time, compile_time / check_time))
+    print()
+
+
+def bench_parallel(sizes=COMPILE_SIZES, jobs=None):
+    """
+    Compares compiling generated classes on one core and in a pool of processes, and
+    checks that both write the same code and report the same errors. Each class is
+    also compiled with errors put in (see inject_errors), which makes the pool fall
+    back to compiling the class on one core
+    :param jobs: number of processes, the number of cores if not given
+    """
+    jobs = jobs or os.cpu_count()
+    print("Serial vs parallel compile, {} jobs".format(jobs))
+    print("{:>12} {:>8} {:>12} {:>13} {:>8} {:>6}".format(
+        "size (KB)", "errors", "serial (s)", "parallel (s)", "speedup", "same"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            text = gen_class(size)
+            for broken in (False, True):
+                path = write_source(directory,
+                                    inject_errors(text)[0] if broken else text)
+                serial_dest = os.path.join(directory, "serial.vm")
+                parallel_dest = os.path.join(directory, "parallel.vm")
+                start = time.perf_counter()
+                serial_errors = CompilationEngine(path, serial_dest).errors
+                serial_time = time.perf_counter() - start
+                start = time.perf_counter()
+                parallel_errors = CompilationEngine(path, parallel_dest,
+                                                    jobs=jobs).errors
+                parallel_time = time.perf_counter() - start
+                with open(serial_dest) as serial, open(parallel_dest) as parallel:
+                    same = serial.read() == parallel.read() and \
+                        serial_errors == parallel_errors
+                assert same, (size, broken)
+                assert bool(serial_errors) == broken, (size, broken)
+                print("{:>12} {:>8} {:>12.4f} {:>13.4f} {:>8.2f} {:>6}".format(
+                    size // KB, len(serial_errors), serial_time, parallel_time,
+                    serial_time / parallel_time, str(same)))
+    print()
+
+
+def bench_vm_code(sizes=COMPILE_SIZES):
+    """
+    Measures the in-memory VM code of generated classes: how long rendering it as text
+    takes, and how its size compares to the size of the text
+    """
+    print("VM code in memory")
+    print("{:>12} {:>10} {:>12} {:>11} {:>10} {:>10}".format(
+        "size (KB)", "commands", "compile (s)", "render (s)", "code (KB)", "text (KB)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = write_source(directory, gen_class(size))
+            writer = VMWriter(None)
+            compile_time = time_call(CompilationEngine, path, writer)
+            start = time.perf_counter()
+            text = writer.text()
+            render_time = time.perf_counter() - start
+            functions, _ = writer.export()
+            commands = sum(len(function) for function in functions)
+            code_size = sum(function.code.itemsize * len(function.code)
+                            for function in functions)
+            print("{:>12} {:>10} {:>12.4f} {:>11.4f} {:>10} {:>10}".format(
+                size // KB, commands, compile_time, render_time, code_size // KB,
+                len(text) // KB))
+    print()
+
+
+def optimize_program(jack_files, directory):
+    """
+    Compiles Jack files into a directory with the peephole optimizer
+    :return: (seconds, the optimizer)
+    """
+    peephole = PeepholeOptimizer()
+    start = time.perf_counter()
+    for path in jack_files:
+        dest = os.path.join(directory, os.path.basename(path)[:-len(".jack")] + ".vm")
+        CompilationEngine(path, dest, passes=[peephole])
+    return time.perf_counter() - start, peephole
+
+
+def bench_peephole(sizes=COMPILE_SIZES):
+    """
+    Measures how many VM commands the peephole optimizer removes from the example
+    programs and from generated classes, and what it costs in compile time
+    """
+    print("Peephole optimizer")
+    print("{:>16} {:>10} {:>9} {:>8} {:>12} {:>14}".format(
+        "program", "commands", "removed", "%", "compile (s)", "optimized (s)"))
+    programs = [(name, [os.path.join(TEST_FILES, name, file_name)
+                        for file_name in sorted(os.listdir(os.path.join(TEST_FILES, name)))
+                        if file_name.endswith(".jack")])
+                for name in sorted(os.listdir(TEST_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            programs.append(("{} KB".format(size // KB),
+                             [write_source(directory, gen_class(size))]))
+        for name, jack_files in programs:
+            compile_time = time_call(
+                lambda: [CompilationEngine(path, VMWriter(None)) for path in jack_files])
+            optimize_time, peephole = optimize_program(jack_files, directory)
+            print("{:>16} {:>10} {:>9} {:>8.1f} {:>12.4f} {:>14.4f}".format(
+                name, peephole.seen, peephole.removed,
+                100.0 * peephole.removed / max(peephole.seen, 1), compile_time,
+                optimize_time))
+    print()
+
+
+def count_code(jack_files, optimize, **options):
+    """
+    Compiles Jack files without writing them
+    :param options: more keyword arguments of the CompilationEngine
+    :return: (number of VM commands, number of calls to Math.multiply and Math.divide)
+    """
+    commands = calls = 0
+    for path in jack_files:
+        writer = VMWriter(None)
+        CompilationEngine(path, writer, optimize=optimize, **options)
+        math_ids = {writer.name_ids.get(name) for name in ("Math.multiply", "Math.divide")}
+        for function in writer.functions:
+            for op, arg, index in function.commands():
+                commands += 1
+                calls += op == CALL and arg in math_ids
+    return commands, calls
+
+
+def bench_folding(sizes=COMPILE_SIZES[:1]):
+    """
+    Compares the code of the example programs and of generated classes with and
+    without constant folding
+    """
+    print("Constant folding")
+    print("{:>16} {:>10} {:>10} {:>12} {:>12}".format(
+        "program", "commands", "folded", "math calls", "folded"))
+    programs = [(name, [os.path.join(TEST_FILES, name, file_name)
+                        for file_name in sorted(os.listdir(os.path.join(TEST_FILES, name)))
+                        if file_name.endswith(".jack")])
+                for name in sorted(os.listdir(TEST_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for label, template in (("", SUBROUTINE_TEMPLATE),
+                                    (" const", CONSTANT_TEMPLATE)):
+                name = "Main{}{}".format(size, label.strip())
+                programs.append(("{} KB{}".format(size // KB, label), [write_source(
+                    directory, gen_class(size, name, template), name)]))
+        for name, jack_files in programs:
+            commands, calls = count_code(jack_files, False)
+            folded_commands, folded_calls = count_code(jack_files, True)
+            print("{:>16} {:>10} {:>10} {:>12} {:>12}".format(
+                name, commands, folded_commands, calls, folded_calls))
+    print()
+
+
+def bench_strength_reduction(size=COMPILE_SIZES[0], limits=MULTIPLY_LIMITS):
+    """
+    Compares the code of multiplications by constants under different multiply limits:
+    a bigger limit leaves fewer calls of Math.multiply for more commands
+    """
+    print("Strength reduction")
+    print("{:>12} {:>10} {:>12}".format("limit", "commands", "math calls"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_source(directory, gen_class(size, template=MULTIPLY_TEMPLATE))
+        commands, calls = count_code([path], False)
+        print("{:>12} {:>10} {:>12}".format("no -O", commands, calls))
+        for limit in limits:
+            commands, calls = count_code([path], True, multiply_limit=limit)
+            print("{:>12} {:>10} {:>12}".format(limit, commands, calls))
+    print()
+
+
+class StopRun(Exception):
+    """
+    Raised when a program has run for as many loop iterations as it may
+    """
+
+
+class CommandCounter():
+    """
+    Runs compiled programs on a VM that counts the commands it executes, the calls it
+    makes, and the jumps back it takes: one for every iteration of a loop. Labels are
+    not counted, as they are not executed. The OS is stubbed out, and each of its calls
+    counted as one command. Only multiply, divide and allocation work, so that programs
+    compute the same with and without -O. The numbers and characters a program prints
+    are kept in printed. A pop from an empty stack takes 0, as the compiler writes one
+    pop too many after every array store. A function starts with the this and that of
+    its caller, as the VM does not set them on a call.
+    """
+
+    def __init__(self, writers, max_iterations=MAX_ITERATIONS):
+        """
+        :param writers: the closed VMWriters of the classes of a program
+        :param max_iterations: the most loop iterations a program is run for
+        """
+        self.max_iterations = max_iterations
+        self.functions = {}
+        for writer in writers:
+            for function in writer.functions:
+                commands = function.commands()
+                if not commands or commands[0][0] != FUNCTION:
+                    continue
+                labels = {arg: i for i, (op, arg, index) in enumerate(commands)
+                          if op == LABEL}
+                code = []
+                for op, arg, index in commands:
+                    if op in (GOTO, IF_GOTO):
+                        arg = labels[arg]
+                    elif op == CALL:
+                        arg = writer.name(arg)
+                    code.append((op, arg, index))
+                name = writer.name(commands[0][1])
+                self.functions[name] = (name.split('.')[0], code)
+
+    def run(self, entry="Main.main"):
+        """
+        Runs a program from its entry function
+        :return: (number of commands executed, number of loop iterations)
+        """
+        self.memory = {}
+        self.statics = {}
+        self.temp = [0] * 8
+        self.heap = HEAP_BASE
+        self.commands = self.iterations = self.calls = 0
+        self.printed = []
+        try:
+            self.call(entry, [])
+        except StopRun:
+            pass
+        return self.commands, self.iterations
+
+    def call(self, name, args, pointers=(0, 0)):
+        """
+        Runs a function
+        :param pointers: the this and that of the caller
+        :return: the word it returns
+        """
+        self.calls += 1
+        if name not in self.functions:
+            self.commands += 1
+            return self.os_call(name, args)
+        class_name, code = self.functions[name]
+        frame = (args, [0] * code[0][2], list(pointers),
+                 self.statics.setdefault(class_name, {}))
+        stack = []
+        pc = 1
+        while pc < len(code):
+            op, arg, index = code[pc]
+            pc += 1
+            if op == LABEL:
+                continue
+            self.commands += 1
+            if op == PUSH:
+                stack.append(self.read(frame, arg, index))
+            elif op == POP:
+                self.write(frame, arg, index, stack.pop() if stack else 0)
+            elif op in BINARY_OPERATIONS:
+                y = stack.pop()
+                stack[-1] = to_word(BINARY_OPERATIONS[op](stack[-1], y))
+            elif op in UNARY_OPERATIONS:
+                stack[-1] = to_word(UNARY_OPERATIONS[op](stack[-1]))
+            elif op == GOTO or op == IF_GOTO and stack.pop():
+                if arg < pc:
+                    self.iterations += 1
+                    if self.iterations >= self.max_iterations:
+                        raise StopRun()
+                pc = arg
+            elif op == CALL:
+                call_args = stack[len(stack) - index:]
+                del stack[len(stack) - index:]
+                stack.append(to_word(self.call(arg, call_args, frame[2])))
+            elif op == RETURN:
+                return stack.pop() if stack else 0
+        return 0
+
+    def read(self, frame, segment, index):
+        """
+        :return: the word at an index of a segment
+        """
+        args, local, pointers, statics = frame
+        if segment == SEGMENT_CODES["constant"]:
+            return index
+        if segment == SEGMENT_CODES["argument"]:
+            return args[index] if index < len(args) else 0
+        if segment == SEGMENT_CODES["local"]:
+            return local[index]
+        if segment == SEGMENT_CODES["static"]:
+            return statics.get(index, 0)
+        if segment == SEGMENT_CODES["this"]:
+            return self.memory.get(pointers[0] + index, 0)
+        if segment == SEGMENT_CODES["that"]:
+            return self.memory.get(pointers[1] + index, 0)
+        if segment == SEGMENT_CODES["pointer"]:
+            return pointers[index]
+        return self.temp[index]
+
+    def write(self, frame, segment, index, value):
+        """
+        Stores a word at an index of a segment
+        """
+        args, local, pointers, statics = frame
+        if segment == SEGMENT_CODES["argument"]:
+            args.extend([0] * (index + 1 - len(args)))
+            args[index] = value
+        elif segment == SEGMENT_CODES["local"]:
+            local[index] = value
+        elif segment == SEGMENT_CODES["static"]:
+            statics[index] = value
+        elif segment == SEGMENT_CODES["this"]:
+            self.memory[pointers[0] + index] = value
+        elif segment == SEGMENT_CODES["that"]:
+            self.memory[pointers[1] + index] = value
+        elif segment == SEGMENT_CODES["pointer"]:
+            pointers[index] = value
+        else:
+            self.temp[index] = value
+
+    def os_call(self, name, args):
+        """
+        The stubbed OS
+        :return: the word an OS function returns
+        """
+        if name == "Math.multiply":
+            return to_word(args[0] * args[1])
+        if name == "Math.divide":
+            return 0 if args[1] == 0 else to_word(int(args[0] / args[1]))
+        if name in ("Memory.alloc", "Array.new", "String.new"):
+            address = self.heap
+            self.heap += max(args[0], 1)
+            return address
+        if name == "String.appendChar":
+            return args[0]
+        if name in PRINT_FUNCTIONS:
+            self.printed.append(args[-1])
+        return 0
+
+
+def compile_program(directory, optimize, passes=None, **options):
+    """
+    Compiles the Jack files of a directory without writing them, with the peephole
+    optimizer under optimize
+    :param passes: the passes to run over the code, instead of a new peephole optimizer
+    :param options: more keyword arguments of the CompilationEngine
+    :return: list of the closed VMWriters
+    """
+    if passes is None:
+        passes = [PeepholeOptimizer()] if optimize else []
+    writers = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".jack"):
+            writer = VMWriter(None)
+            CompilationEngine(os.path.join(directory, file_name), writer,
+                              passes=passes, optimize=optimize, **options)
+            writers.append(writer)
+    return writers
+
+
+def bench_control_flow(max_iterations=MAX_ITERATIONS):
+    """
+    Runs the example programs, and loops on conditions that are not just true or false,
+    compiled with and without -O, and compares the commands they execute per loop
+    iteration. Both run the same iterations and print the same, as -O leaves what a
+    program computes as it is
+    """
+    print("Executed commands, up to {} loop iterations".format(max_iterations))
+    print("{:>16} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "program", "iterations", "commands", "-O", "per iter", "-O per iter"))
+    programs = [(name, os.path.join(RESULT_FILES, name))
+                for name in sorted(os.listdir(RESULT_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        write_source(directory, WHILE_CONDITIONS_CLASS)
+        programs.append(("while conditions", directory))
+        for name, program in programs:
+            counter = CommandCounter(compile_program(program, False), max_iterations)
+            commands, iterations = counter.run()
+            optimized_counter = CommandCounter(compile_program(program, True),
+                                               max_iterations)
+            optimized, optimized_iterations = optimized_counter.run()
+            assert iterations == optimized_iterations, name
+            assert counter.printed == optimized_counter.printed, name
+            print("{:>16} {:>10} {:>10} {:>10} {:>12.2f} {:>12.2f}".format(
+                name, iterations, commands, optimized, commands / max(iterations, 1),
+                optimized / max(iterations, 1)))
+    print()
+
+
+def bench_string_pool(max_iterations=MAX_ITERATIONS):
+    """
+    Compares the example programs with and without pooled string constants: the
+    commands they are compiled into, the commands they execute and the heap they take,
+    up to the same loop iteration
+    """
+    print("Pooled strings, up to {} loop iterations".format(max_iterations))
+    print("{:>16} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "program", "code", "pooled", "executed", "pooled", "heap", "pooled"))
+    programs = [(name, os.path.join(RESULT_FILES, name))
+                for name in sorted(os.listdir(RESULT_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        write_source(directory, MESSAGE_LOOP_CLASS)
+        programs.append(("message loop", directory))
+        for name, program in programs:
+            bench_pooled_program(name, program, max_iterations)
+    print()
+
+
+def bench_pooled_program(name, directory, max_iterations):
+    """
+    Prints a row of the pooled strings benchmark
+    """
+    row = [name]
+    for pool_strings in (False, True):
+        writers = compile_program(directory, False, pool_strings=pool_strings)
+        counter = CommandCounter(writers, max_iterations)
+        row += [sum(len(function) for writer in writers for function in writer.functions),
+                counter.run()[0], counter.heap - HEAP_BASE]
+    print("{:>16} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        row[0], row[1], row[4], row[2], row[5], row[3], row[6]))
+
+
+def bench_dead_code():
+    """
+    Measures the unreachable commands -O drops from the example programs, and the
+    functions it removes from them as whole programs
+    """
+    print("Dead code")
+    print("{:>16} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "program", "commands", "unreachable", "bytes", "functions", "unused",
+        "bytes"))
+    programs = [(name, os.path.join(RESULT_FILES, name))
+                for name in sorted(os.listdir(RESULT_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        write_source(directory, DEAD_CODE_CLASS)
+        programs.append(("tracing off", directory))
+        for name, program in programs:
+            peephole, pruner = PeepholeOptimizer(), FunctionPruner()
+            pruner(compile_program(program, True, passes=[peephole]))
+            print("{:>16} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+                name, peephole.seen, peephole.unreachable, peephole.unreachable_bytes,
+                pruner.functions, pruner.removed_functions, pruner.removed_bytes))
+    print()
+
+
+def bench_arrays(max_iterations=MAX_ITERATIONS):
+    """
+    Compares the commands of array heavy programs with and without -O, in the code and
+    as they are executed
+    """
+    print("Array accesses, up to {} loop iterations".format(max_iterations))
+    print("{:>16} {:>10} {:>10} {:>10} {:>10}".format(
+        "program", "code", "-O", "executed", "-O"))
+    with tempfile.TemporaryDirectory() as directory:
+        write_source(directory, ARRAY_CLASS)
+        for name, program in (("ComplexArrays", os.path.join(RESULT_FILES,
+                                                             "ComplexArrays")),
+                              ("matrices", directory)):
+            row = [name]
+            for optimize in (False, True):
+                writers = compile_program(program, optimize)
+                row.append(sum(len(function) for writer in writers
+                               for function in writer.functions))
+                row.append(CommandCounter(writers, max_iterations).run()[0])
+            print("{:>16} {:>10} {:>10} {:>10} {:>10}".format(
+                row[0], row[1], row[3], row[2], row[4]))
+    print()
+
+
+def bench_inlining(limits=INLINE_LIMITS, max_iterations=MAX_ITERATIONS):
+    """
+    Measures what inlining the small functions of whole programs under -O does to their
+    code, and to the commands and calls they execute, for several inline limits
+    """
+    print("Inlining, up to {} loop iterations".format(max_iterations))
+    print("{:>16} {:>6} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "program", "limit", "inlined", "commands", "bytes", "executed", "calls"))
+    programs = [(name, os.path.join(RESULT_FILES, name))
+                for name in sorted(os.listdir(RESULT_FILES))]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, text in ACCESSOR_CLASSES.items():
+            write_source(directory, text, name)
+        programs.append(("accessors", directory))
+        for name, program in programs:
+            for limit in limits:
+                writers = compile_program(program, True)
+                inliner = Inliner(limit)
+                inliner(writers)
+                FunctionPruner()(writers)
+                counter = CommandCounter(writers, max_iterations)
+                print("{:>16} {:>6} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+                    name, limit, inliner.calls,
+                    sum(len(function) for writer in writers
+                        for function in writer.functions),
+                    sum(writer.size(function.commands()) for writer in writers
+                        for function in writer.functions),
+                    counter.run()[0], counter.calls))
+    print()
+
+
+def main():
+    bench_tokenizer()
+    bench_token_memory()
+    bench_streaming()
+    bench_comments()
+    bench_incremental()
+    bench_identifiers()
+    bench_xml()
+    bench_cache()
+    bench_long_lists()
+    bench_probes()
+    bench_expressions()
+    bench_ast()
+    bench_recovery()
+    bench_check()
+    bench_parallel()
+    bench_vm_code()
+    bench_peephole()
+    bench_folding()
+    bench_strength_reduction()
+    bench_control_flow()
+    bench_string_pool()
+    bench_dead_code()
+    bench_arrays()
+    bench_inlining()
+
+
+if __name__ == '__main__':
+    main()